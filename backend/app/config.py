@@ -1,10 +1,24 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
+# Runtime data locations; relative values are resolved against DATA_DIR
+DATA_PATHS = (
+    "OUTPUT_DIR", "PROJECT_STATE_PATH", "LOG_DIR", "TASK_STORE_PATH", "TASK_STORE_LEGACY_JSON",
+    "LIBRARY_DB_PATH", "RENDER_CACHE_DIR", "RENDITION_CACHE_DIR", "UPLOAD_DIR", "ANALYSIS_DIR",
+    "TASK_LOG_DIR", "PROFILE_DIR",
+)
+
 class Settings(BaseSettings):
     APP_NAME: str = "Kuno AI Music Engine"
     VERSION: str = "0.1.0"
     
+    # Runtime Data (songs, stores, caches, logs)
+    DATA_DIR: Path = Path(__file__).resolve().parent.parent # backend/, independent of the working directory
+    OUTPUT_DIR: str = "generated_songs" # Finished songs
+    PROJECT_STATE_PATH: str = "current_project.json" # Last project sent to /generate
+    LOG_DIR: str = "logs" # Application log
+    
     # Hardware Config
     DEVICE_BACKEND: str = "privateuseone" # DirectML often uses this or 'cpu' mapped. For torch-directml specifically it's often DML. 
     # NOTE: torch-directml uses torch.device("privateuseone:0") usually mapped to DML.
@@ -17,12 +31,90 @@ class Settings(BaseSettings):
     MODELS_DIR: Path = Path("./models")
     HEARTMULA_MODEL_ID: str = "HeartMuLa/HeartMuLa-RL-oss-3B"
     HEARTCODEC_MODEL_PATH: str = "./models/heartcodec"
+    MODEL_SNAPSHOTS: bool = True # Load from pre-cast, memory-mapped weight snapshots
+    MODEL_SNAPSHOT_DIR: Path = Path("./model_snapshots") # Next to MODELS_DIR; one sub-dir per device/dtype
     
     # Streaming Config
     MAX_GPU_LAYERS: int = 10 # Reduced for 50% compute (~half layers active)
     VRAM_TARGET_USAGE: float = 0.50 # ~4GB target, stays under 6GB on 8GB Card
+    LAYER_STREAMING: bool = True # Stream backbone layers through the accelerator (window of MAX_GPU_LAYERS)
+    VRAM_TOTAL_GB: float = 8.0 # Used when the backend can't report card memory (DirectML)
+    
+    # Model Residency (keep models warm between jobs)
+    MODEL_IDLE_TIMEOUT: float = 900.0 # Seconds a model may sit idle before it is unloaded
+    RAM_BUDGET_FRACTION: float = 0.75 # Share of system RAM resident models may occupy
+    MEMORY_PRESSURE_PERCENT: float = 90.0 # Evict idle models when system RAM use goes above this
+    MODEL_LOAD_WAIT_SECONDS: float = 300.0 # How long a load that doesn't fit waits for pinned models before it is refused
+    
+    # Startup Warm-up (after model verification; progress per component at /ready)
+    WARMUP_ENABLED: bool = True # Load the pipeline and render a tiny song before reporting ready
+    WARMUP_SECONDS: int = 2 # Length of the synthetic song / enhancer clip
+    WARMUP_UPSCALE: bool = False # Also run AudioSR in the enhancer pass (slow on CPU)
+    WARMUP_TIMEOUT: float = 600.0 # Per stage; a stuck warm-up marks its component failed
+    
+    # Task Store
+    TASK_STORE_BACKEND: str = "sqlite" # "sqlite" (WAL, persistent) or "memory"
+    TASK_STORE_PATH: str = "tasks.db"
+    TASK_STORE_LEGACY_JSON: str = "tasks.json" # Migrated once into the store, then renamed
+    TASK_STORE_FLUSH_INTERVAL: float = 1.0 # Seconds between batched progress writes
+    TASK_TTL_HOURS: float = 168.0 # Finished tasks older than this are pruned
+    
+    # Telemetry (background sampler behind /stats)
+    TELEMETRY_INTERVAL: float = 1.0 # Seconds between samples
+    TELEMETRY_HISTORY: int = 600 # Samples kept in the ring buffer (10 min at 1 s)
+    
+    # Library Catalog
+    LIBRARY_DB_PATH: str = "library.db" # Index of finished songs (reconciled with generated_songs at startup)
+    
+    # Job Scheduling
+    GENERATION_WORKERS: int = 1 # Device workers; each loaded pipeline still runs one job at a time
+    GENERATION_QUEUE_SIZE: int = 32 # Further submissions get HTTP 429
+    GENERATION_MAX_BATCH: int = 1 # >1 runs compatible queued requests of equal prompt length as one batch
+    GENERATION_THREADS: int = 0 # torch CPU threads per generation worker (0 = auto split with enhancement)
+    ENHANCE_WORKERS: int = 1 # Enhancement runs as its own stage, overlapping the next generation
+    ENHANCE_THREADS: int = 0 # torch CPU threads per enhancement worker (0 = auto)
+    
+    # Live Preview (raw audio decoded while tokens are generated)
+    PREVIEW_STREAMING: bool = True # Allow /preview subscriptions; only subscribed jobs are decoded
+    PREVIEW_CHUNK_SECONDS: float = 2.0 # Audio decoded per preview step (time-to-first-audio)
+    PREVIEW_OVERLAP_SECONDS: float = 0.4 # Context re-decoded and crossfaded at chunk boundaries
+    
+    # Enhancement
+    ENHANCE_SR_WORKERS: int = 0 # AudioSR chunks processed in parallel (0 = auto: half the cores on CPU, 1 on GPU)
+    
+    # Render Cache (seeded requests only; identical payload -> stored final WAV)
+    RENDER_CACHE_DIR: str = "generated_songs/.cache"
+    RENDER_CACHE_MAX_ENTRIES: int = 200
+    RENDER_CACHE_MAX_GB: float = 5.0
+    
+    # Audio Renditions (compressed copies served by /audio)
+    RENDITION_CACHE_DIR: str = "generated_songs/.renditions"
+    RENDITION_CACHE_MAX_GB: float = 2.0 # Least recently served renditions are evicted past this
+    RENDITION_WORKERS: int = 2 # Background transcodes running at once
+    
+    # Uploads (reference audio, stored by content hash)
+    UPLOAD_DIR: str = "uploads"
+    UPLOAD_MAX_MB: float = 200.0 # Larger uploads get HTTP 413
+    
+    # Track Analysis (waveform peaks + loudness sidecars)
+    ANALYSIS_DIR: str = "generated_songs/.analysis"
+    ANALYSIS_BACKFILL: bool = True # Analyze existing songs without sidecars at startup
+    
+    # Task Logs
+    TASK_LOG_DIR: str = "logs/tasks" # Full per-task logs are spilled here
+    TASK_LOG_MAX_LINES: int = 1000 # Lines kept in memory per task (ring buffer)
+    
+    # Profiling (opt-in per task: POST /generate?profile=cprofile|torch)
+    PROFILE_DIR: str = "logs/profiles" # One capture per task and stage
+    PROFILE_MAX_FILES: int = 100 # Oldest captures are deleted past this
     
     class Config:
         env_file = ".env"
+    
+    @model_validator(mode="after")
+    def _resolve_data_paths(self):
+        for name in DATA_PATHS:
+            setattr(self, name, str(self.DATA_DIR / getattr(self, name)))
+        return self
 
 settings = Settings()
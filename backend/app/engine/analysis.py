@@ -0,0 +1,378 @@
+import json
+import math
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+# scipy.signal is imported where it's used: it's slow to import and the API imports this module
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+log = get_logger("Analysis")
+
+SIDECAR_MAGIC = b"KPK1"
+SIDECAR_VERSION = 1
+BLOCK_FRAMES = 65536
+SAMPLES_PER_PEAK = 256 # Finest pyramid level
+MIN_LEVEL_PEAKS = 64 # Coarsest level has at least this many buckets
+FFT_SIZE = 4096
+TRUE_PEAK_OVERSAMPLE = 4
+
+
+def k_weighting(sample_rate: int) -> np.ndarray:
+    """BS.1770 K-weighting (high shelf + high pass) as second-order sections for any rate."""
+    # Pre-filter: high shelf, ~+4 dB above ~1.7 kHz (bilinear form used by libebur128)
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # RLB weighting: high pass at ~38 Hz
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass], dtype=np.float64)
+
+
+class TrackAnalyzer:
+    """
+    One streaming pass over a track: feed blocks of [frames, channels]
+    float audio, then `finish()`. Computes the finest min/max peak level
+    (coarser levels are derived from it), BS.1770 integrated loudness,
+    4x-oversampled true peak and the long-term spectrum's centroid,
+    bandwidth and 99% rolloff. Memory is bounded by the block size plus the
+    peak level (one pair per SAMPLES_PER_PEAK frames).
+    """
+
+    def __init__(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        # Peaks
+        self._peak_rest = np.zeros((0,), dtype=np.float32)
+        self._peak_min: List[np.ndarray] = []
+        self._peak_max: List[np.ndarray] = []
+        # Loudness: K-weighted energy per 100 ms sub-block (gating blocks are 4 of them)
+        self._sos = k_weighting(sample_rate)
+        self._sos_zi = np.zeros((len(self._sos), 2, channels))
+        self._sub_len = int(round(sample_rate * 0.1))
+        self._sub_rest = np.zeros((0, channels))
+        self._sub_energy: List[np.ndarray] = []
+        # True peak
+        from scipy.signal import firwin
+        self._fir = firwin(12 * TRUE_PEAK_OVERSAMPLE, 1.0 / TRUE_PEAK_OVERSAMPLE) * TRUE_PEAK_OVERSAMPLE
+        self._fir_zi = np.zeros((len(self._fir) - 1, channels))
+        self._true_peak = 0.0
+        self._sample_peak = 0.0
+        # Spectrum
+        self._window = np.hanning(FFT_SIZE)
+        self._fft_rest = np.zeros((0,), dtype=np.float64)
+        self._magnitude = np.zeros(FFT_SIZE // 2 + 1)
+        self._fft_frames = 0
+
+    def feed(self, block: np.ndarray):
+        if not len(block):
+            return
+        self.frames += len(block)
+        self._feed_peaks(block)
+        self._feed_loudness(block)
+        self._feed_true_peak(block)
+        self._feed_spectrum(block.mean(axis=1))
+
+    def _feed_peaks(self, block: np.ndarray):
+        lo, hi = block.min(axis=1), block.max(axis=1)
+        # Interleave per-frame min and max so one buffer carries both across blocks
+        data = np.concatenate([self._peak_rest, np.stack([lo, hi], axis=1).reshape(-1)])
+        whole = len(data) // (2 * SAMPLES_PER_PEAK) * 2 * SAMPLES_PER_PEAK
+        if whole:
+            buckets = data[:whole].reshape(-1, SAMPLES_PER_PEAK, 2)
+            self._peak_min.append(buckets[:, :, 0].min(axis=1))
+            self._peak_max.append(buckets[:, :, 1].max(axis=1))
+        self._peak_rest = data[whole:]
+
+    def _feed_loudness(self, block: np.ndarray):
+        from scipy.signal import sosfilt
+        weighted, self._sos_zi = sosfilt(self._sos, block.astype(np.float64), axis=0, zi=self._sos_zi)
+        data = np.concatenate([self._sub_rest, weighted ** 2])
+        whole = len(data) // self._sub_len * self._sub_len
+        if whole:
+            self._sub_energy.append(data[:whole].reshape(-1, self._sub_len, self.channels).sum(axis=1))
+        self._sub_rest = data[whole:]
+
+    def _feed_true_peak(self, block: np.ndarray):
+        self._sample_peak = max(self._sample_peak, float(np.abs(block).max()))
+        stuffed = np.zeros((len(block) * TRUE_PEAK_OVERSAMPLE, self.channels))
+        stuffed[::TRUE_PEAK_OVERSAMPLE] = block
+        from scipy.signal import lfilter
+        upsampled, self._fir_zi = lfilter(self._fir, [1.0], stuffed, axis=0, zi=self._fir_zi)
+        self._true_peak = max(self._true_peak, float(np.abs(upsampled).max()))
+
+    def _feed_spectrum(self, mono: np.ndarray):
+        data = np.concatenate([self._fft_rest, mono])
+        whole = len(data) // FFT_SIZE * FFT_SIZE
+        if whole:
+            frames = data[:whole].reshape(-1, FFT_SIZE) * self._window
+            self._magnitude += np.abs(np.fft.rfft(frames, axis=1)).sum(axis=0)
+            self._fft_frames += len(frames)
+        self._fft_rest = data[whole:]
+
+    def _integrated_loudness(self) -> Optional[float]:
+        if not self._sub_energy:
+            return None
+        sub = np.concatenate(self._sub_energy) # [sub-blocks, channels]
+        if len(sub) < 4:
+            return None
+        # 400 ms gating blocks with 75% overlap; L/R/C weights are all 1.0
+        blocks = (sub[:-3] + sub[1:-2] + sub[2:-1] + sub[3:]).sum(axis=1) / (4 * self._sub_len)
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[loudness > -70.0]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+        with np.errstate(divide="ignore"):
+            gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+        return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+    def _spectrum_stats(self) -> Dict[str, Optional[float]]:
+        if not self._fft_frames or not self._magnitude.sum():
+            return {"spectral_centroid_hz": None, "spectral_bandwidth_hz": None, "spectral_rolloff_hz": None}
+        freqs = np.fft.rfftfreq(FFT_SIZE, 1.0 / self.sample_rate)
+        weights = self._magnitude / self._magnitude.sum()
+        centroid = float((freqs * weights).sum())
+        bandwidth = float(np.sqrt(((freqs - centroid) ** 2 * weights).sum()))
+        energy = np.cumsum(self._magnitude ** 2)
+        rolloff = float(freqs[np.searchsorted(energy, 0.99 * energy[-1])])
+        return {
+            "spectral_centroid_hz": round(centroid, 1),
+            "spectral_bandwidth_hz": round(bandwidth, 1),
+            "spectral_rolloff_hz": round(rolloff, 1),
+        }
+
+    def finish(self) -> Dict[str, Any]:
+        """Summary plus the finest peak level (min, max arrays)."""
+        if len(self._peak_rest):
+            rest = self._peak_rest.reshape(-1, 2)
+            self._peak_min.append(rest[:, 0].min(keepdims=True))
+            self._peak_max.append(rest[:, 1].max(keepdims=True))
+            self._peak_rest = self._peak_rest[:0]
+        peak = max(self._sample_peak, self._true_peak)
+
+        def dbfs(value):
+            return round(20 * math.log10(value), 2) if value > 0 else None
+
+        return {
+            "frames": self.frames,
+            "duration": round(self.frames / self.sample_rate, 3),
+            "integrated_lufs": self._integrated_loudness(),
+            "true_peak_dbtp": dbfs(peak),
+            "sample_peak_dbfs": dbfs(self._sample_peak),
+            **self._spectrum_stats(),
+            "peaks": (
+                np.concatenate(self._peak_min) if self._peak_min else np.zeros(0, np.float32),
+                np.concatenate(self._peak_max) if self._peak_max else np.zeros(0, np.float32),
+            ),
+        }
+
+
+def build_pyramid(lo: np.ndarray, hi: np.ndarray) -> List[np.ndarray]:
+    """Levels of int16 [count, 2] (min, max) pairs, each half the resolution of the previous."""
+    levels = []
+    while True:
+        pairs = np.empty((len(lo), 2), dtype="<i2")
+        pairs[:, 0] = np.floor(np.clip(lo, -1.0, 1.0) * 32767)
+        pairs[:, 1] = np.ceil(np.clip(hi, -1.0, 1.0) * 32767)
+        levels.append(pairs)
+        if len(lo) <= MIN_LEVEL_PEAKS or len(lo) < 2:
+            return levels
+        if len(lo) % 2:
+            lo, hi = np.append(lo, lo[-1]), np.append(hi, hi[-1])
+        lo = np.minimum(lo[0::2], lo[1::2])
+        hi = np.maximum(hi[0::2], hi[1::2])
+
+
+# --- Sidecar files ---
+# Layout: magic, uint32 header length, JSON header, then each level's
+# little-endian int16 (min, max) pairs. The header records the source's
+# size and mtime so a re-rendered song gets a fresh sidecar.
+
+def sidecar_path(audio_path: str) -> str:
+    return os.path.join(settings.ANALYSIS_DIR, os.path.basename(audio_path) + ".analysis")
+
+
+def _source_signature(audio_path: str) -> Dict[str, int]:
+    st = os.stat(audio_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_sidecar(path: str, header: Dict[str, Any], levels: List[np.ndarray]):
+    offset = 0
+    header = dict(header, levels=[])
+    for index, pairs in enumerate(levels):
+        header["levels"].append({"samples_per_peak": SAMPLES_PER_PEAK << index, "count": len(pairs),
+                                 "offset": offset})
+        offset += pairs.nbytes
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SIDECAR_MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        for pairs in levels:
+            f.write(pairs.tobytes())
+    os.replace(tmp, path)
+
+
+def _parse_header(f) -> Optional[Dict[str, Any]]:
+    if f.read(4) != SIDECAR_MAGIC:
+        return None
+    (length,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(length))
+    header["data_offset"] = 8 + length
+    return header
+
+
+def read_header(path: str) -> Optional[Dict[str, Any]]:
+    """Sidecar header (summary + level table), or None if missing/unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return _parse_header(f)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def analyze_file(audio_path: str, output_path: Optional[str] = None) -> Dict[str, Any]:
+    """Analyze a track in one streaming pass and write its sidecar. Returns the header."""
+    output_path = output_path or sidecar_path(audio_path)
+    signature = _source_signature(audio_path)
+    with sf.SoundFile(audio_path) as src:
+        analyzer = TrackAnalyzer(src.samplerate, src.channels)
+        while True:
+            block = src.read(BLOCK_FRAMES, dtype="float32", always_2d=True)
+            if not len(block):
+                break
+            analyzer.feed(block)
+    summary = analyzer.finish()
+    lo, hi = summary.pop("peaks")
+    header = {
+        "version": SIDECAR_VERSION,
+        "source": signature,
+        "sample_rate": analyzer.sample_rate,
+        "channels": analyzer.channels,
+        **summary,
+    }
+    write_sidecar(output_path, header, build_pyramid(lo, hi))
+    log.info(f"Analyzed {os.path.basename(audio_path)}: {summary['integrated_lufs']} LUFS, "
+             f"{summary['true_peak_dbtp']} dBTP.")
+    return read_header(output_path)
+
+
+# Per-sidecar [lock, callers holding or waiting on it]; an entry is dropped with its last caller
+_locks: Dict[str, list] = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _sidecar_lock(path: str):
+    with _locks_guard:
+        entry = _locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[path]
+
+
+def ensure_analysis(audio_path: str) -> Dict[str, Any]:
+    """Header of an up-to-date sidecar, analyzing the track first if needed."""
+    path = sidecar_path(audio_path)
+    with _sidecar_lock(path):
+        header = read_header(path)
+        if (header is None or header.get("version") != SIDECAR_VERSION
+                or header.get("source") != _source_signature(audio_path)):
+            header = analyze_file(audio_path, path)
+    return header
+
+
+def summary(header: Dict[str, Any]) -> Dict[str, Any]:
+    """Header without the storage details."""
+    return {k: v for k, v in header.items() if k not in ("levels", "data_offset", "source", "version")}
+
+
+def read_waveform(path: str, pixels: int, start: float = 0.0, end: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Min/max per pixel over [start, end) seconds. Reads only the coarsest
+    level that still has one bucket per pixel, so the cost is O(pixels)
+    whatever the track length or zoom.
+    """
+    with open(path, "rb") as f:
+        # Header and data from one handle: a concurrent re-analysis replaces the file atomically
+        header = _parse_header(f)
+        if header is None:
+            raise ValueError(f"Not an analysis sidecar: {path}")
+        return _read_levels(f, header, pixels, start, end)
+
+
+def _read_levels(f, header: Dict[str, Any], pixels: int, start: float, end: Optional[float]) -> Dict[str, Any]:
+    rate = header["sample_rate"]
+    total = header["frames"]
+    first = min(max(0, int(start * rate)), total)
+    last = total if end is None else min(max(first, int(end * rate)), total)
+    pixels = max(1, pixels)
+    levels = header["levels"]
+    chosen = levels[0]
+    for level in levels:
+        if (last - first) / level["samples_per_peak"] >= pixels:
+            chosen = level
+    spp = chosen["samples_per_peak"]
+    lo_index = first // spp
+    hi_index = min(chosen["count"], max(lo_index + 1, -(-last // spp)))
+    count = hi_index - lo_index
+    f.seek(header["data_offset"] + chosen["offset"] + lo_index * 4)
+    pairs = np.frombuffer(f.read(count * 4), dtype="<i2").reshape(-1, 2)
+    if len(pairs) > pixels:
+        edges = np.linspace(0, len(pairs), pixels + 1).astype(int)[:-1]
+        lo = np.minimum.reduceat(pairs[:, 0], edges)
+        hi = np.maximum.reduceat(pairs[:, 1], edges)
+    else:
+        lo, hi = pairs[:, 0], pairs[:, 1]
+    return {
+        "sample_rate": rate,
+        "start": round(first / rate, 4),
+        "end": round(last / rate, 4),
+        "samples_per_peak": spp,
+        "pixels": len(lo),
+        "min": np.round(lo / 32767.0, 4).tolist(),
+        "max": np.round(hi / 32767.0, 4).tolist(),
+    }
+
+
+def backfill(audio_paths) -> int:
+    """Analyze songs that have no (or a stale) sidecar. Returns how many were analyzed."""
+    done = 0
+    for audio_path in audio_paths:
+        try:
+            header = read_header(sidecar_path(audio_path))
+            if (header is not None and header.get("version") == SIDECAR_VERSION
+                    and header.get("source") == _source_signature(audio_path)):
+                continue
+            ensure_analysis(audio_path)
+            done += 1
+        except FileNotFoundError:
+            continue # Deleted meanwhile
+        except Exception as e:
+            log.warning(f"Analysis backfill skipped {audio_path}: {e}")
+    if done:
+        log.info(f"Analysis backfill: {done} song(s) analyzed.")
+    return done
@@ -0,0 +1,92 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from app.utils.logger import get_logger
+
+log = get_logger("ChunkedAudio")
+
+# fn(chunk [frames, channels] float32, samplerate, chunk index) -> (output [frames, channels], output samplerate)
+ChunkFn = Callable[[np.ndarray, int, int], Tuple[np.ndarray, int]]
+
+
+def plan_chunks(total_frames: int, chunk_frames: int, overlap_frames: int) -> List[Tuple[int, int]]:
+    """(start, length) of overlapping chunks covering [0, total_frames)."""
+    if total_frames <= chunk_frames:
+        return [(0, total_frames)]
+    step = chunk_frames - overlap_frames
+    chunks = []
+    start = 0
+    while True:
+        length = min(chunk_frames, total_frames - start)
+        chunks.append((start, length))
+        if start + length >= total_frames:
+            return chunks
+        start += step
+
+
+def process_in_chunks(input_path: str, output_path: str, fn: ChunkFn, chunk_seconds: float,
+                      overlap_seconds: float, workers: int = 1, cancel_token=None,
+                      subtype: str = "FLOAT", initializer: Optional[Callable[[], None]] = None) -> str:
+    """
+    Run `fn` over overlapping chunks of a WAV and stitch the results with a
+    linear crossfade over each overlap (overlap-add), writing the output as
+    chunks complete. Only `workers` chunks (plus one overlap tail) are in
+    memory at a time, however long the track is. Chunks are read and written
+    in order; with workers > 1 they are processed concurrently. `initializer`
+    runs once in each pool thread (e.g. to set its torch thread count).
+    """
+    with sf.SoundFile(input_path) as src:
+        samplerate = src.samplerate
+        total = src.frames
+        chunk_frames = max(1, int(chunk_seconds * samplerate))
+        overlap_frames = min(int(overlap_seconds * samplerate), chunk_frames // 2)
+        plan = plan_chunks(total, chunk_frames, overlap_frames)
+        log.info(f"Processing {total / samplerate:.1f}s in {len(plan)} chunk(s) with {workers} worker(s).")
+
+        writer: Optional[sf.SoundFile] = None
+        tail: Optional[np.ndarray] = None
+        pending = deque()
+        next_chunk = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chunk",
+                                    initializer=initializer) as pool:
+                for index in range(len(plan)):
+                    # Keep up to `workers` chunks in flight, reading the input in order
+                    while next_chunk < len(plan) and len(pending) < max(1, workers):
+                        if cancel_token is not None:
+                            cancel_token.raise_if_cancelled()
+                        start, length = plan[next_chunk]
+                        src.seek(start)
+                        chunk = src.read(length, dtype="float32", always_2d=True)
+                        pending.append(pool.submit(fn, chunk, samplerate, next_chunk))
+                        next_chunk += 1
+
+                    out, out_rate = pending.popleft().result()
+                    out = np.asarray(out, dtype=np.float32)
+                    if out.ndim == 1:
+                        out = out[:, None]
+                    if writer is None:
+                        writer = sf.SoundFile(output_path, "w", samplerate=out_rate, channels=out.shape[1],
+                                              subtype=subtype)
+                    if tail is not None:
+                        n = min(len(tail), len(out))
+                        fade = np.linspace(0.0, 1.0, n + 2, dtype=np.float32)[1:-1, None]
+                        out[:n] = tail[:n] * (1.0 - fade) + out[:n] * fade
+                    if index < len(plan) - 1:
+                        out_overlap = int(round(overlap_frames * out_rate / samplerate))
+                        keep = max(0, len(out) - out_overlap)
+                        writer.write(out[:keep])
+                        tail = out[keep:].copy()
+                    else:
+                        writer.write(out)
+                        tail = None
+        finally:
+            for future in pending:
+                future.cancel()
+            if writer is not None:
+                writer.close()
+    return output_path
@@ -0,0 +1,193 @@
+import contextlib
+from typing import Callable, List, Optional
+
+import torch
+
+from app.utils.logger import get_logger
+
+log = get_logger("FrameLoop")
+
+# HeartMuLa emits one frame (8 codebook tokens) per 80 ms of audio
+FRAME_MS = 80
+
+
+class FrameRequest:
+    """One prompt inside a batched frame loop."""
+
+    def __init__(self, inputs: dict, max_audio_length_ms: int,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 frame_callback: Optional[Callable[[int, torch.Tensor], None]] = None):
+        self.inputs = inputs
+        self.max_frames = max(1, max_audio_length_ms // FRAME_MS)
+        self.progress_callback = progress_callback
+        self.frame_callback = frame_callback
+        self.frames: List[torch.Tensor] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+    def frames_tensor(self) -> torch.Tensor:
+        """[codebooks, T] like the pipeline's own frame stack."""
+        return torch.stack(self.frames).transpose(0, 1)
+
+
+def supports_batching(pipeline) -> bool:
+    """The batched loop drives the pipeline's internals; only use it when they're there."""
+    mula = getattr(pipeline, "mula", None)
+    return (
+        hasattr(pipeline, "preprocess")
+        and hasattr(pipeline, "config")
+        and hasattr(pipeline, "codec")
+        and hasattr(mula, "generate_frame")
+        and hasattr(mula, "setup_caches")
+    )
+
+
+def _as_list(value) -> list:
+    if isinstance(value, torch.Tensor):
+        return value.flatten().tolist()
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _collate(prompts: List[dict], rows_per: int, device):
+    """
+    Stack equal-length prompts with rows laid out as [cond_1..cond_n,
+    uncond_1..uncond_n] so the model's CFG split (first half vs. second half
+    of the batch) pairs each request with its own uncond row.
+    """
+    length = prompts[0]["tokens"].shape[1]
+    if any(p["tokens"].shape[1] != length for p in prompts):
+        # generate_frame takes no attention mask: padded rows would sample differently
+        raise ValueError("Prompts of different token lengths can't share a frame loop.")
+    tokens, masks, embeds, starts = [], [], [], []
+    for row in range(rows_per):
+        for p in prompts:
+            tokens.append(p["tokens"][row])
+            masks.append(p["tokens_mask"][row])
+            embeds.append(p["muq_embed"][row])
+            idx = _as_list(p["muq_idx"])
+            starts.append(int(idx[row] if row < len(idx) else idx[-1]))
+    pos = torch.arange(length, device=device).unsqueeze(0).expand(len(tokens), length)
+    return (
+        torch.stack(tokens).to(device),
+        torch.stack(masks).to(device),
+        torch.stack(embeds).to(device),
+        starts,
+        pos,
+    )
+
+
+def _pad_audio_token(token: torch.Tensor, parallel_number: int, empty_id: int):
+    # Same layout as the pipeline's own loop: 8 audio codebooks + empty text slot
+    padded = torch.full((token.shape[0], parallel_number), empty_id, dtype=torch.long, device=token.device)
+    padded[:, :-1] = token
+    padded = padded.unsqueeze(1)
+    mask = torch.ones_like(padded, dtype=torch.bool)
+    mask[..., -1] = False
+    return padded, mask
+
+
+def run_batched_frames(pipeline, requests: List[FrameRequest], temperature: float, topk: int,
+                       cfg_scale: float,
+                       on_group_done: Optional[Callable[[List[FrameRequest]], None]] = None) -> List[FrameRequest]:
+    """
+    Run the autoregressive frame loops of several prompts as batches.
+
+    generate_frame takes no attention mask, so a left-padded row would attend
+    to its pad tokens and sample differently than it does alone. Only prompts
+    of equal token length share a batch (scheduled batches already do: the
+    prompt length is part of their batch_key); other lengths run as their own
+    loop, and on_group_done gets each group's requests as soon as its loop
+    ends, so they don't wait for the next group.
+
+    Every request keeps its own frame budget, stops on its own EOS and gets
+    its own progress callbacks. A request whose callback raises (e.g.
+    cancellation) is dropped from the results; the others keep going. Rows
+    of finished requests stay in the batch until all are done (KV caches
+    can't shrink), their samples are discarded.
+    """
+    prompts = [pipeline.preprocess(r.inputs, cfg_scale=cfg_scale) for r in requests]
+    groups = {}
+    for request, prompt in zip(requests, prompts):
+        groups.setdefault(prompt["tokens"].shape[1], []).append((request, prompt))
+    for group in groups.values():
+        group_requests = [r for r, _ in group]
+        _run_frames(pipeline, group_requests, [p for _, p in group], temperature, topk, cfg_scale)
+        if on_group_done:
+            on_group_done(group_requests)
+    return requests
+
+
+def _run_frames(pipeline, requests: List[FrameRequest], prompts: List[dict], temperature: float, topk: int,
+                cfg_scale: float):
+    """One batched frame loop over equal-length prompts."""
+    config = pipeline.config
+    mula = pipeline.mula
+    device = getattr(pipeline, "mula_device", torch.device("cpu"))
+    dtype = getattr(pipeline, "mula_dtype", torch.float32)
+    rows_per = 2 if cfg_scale != 1.0 else 1
+    n = len(requests)
+
+    tokens, masks, embeds, starts, pos = _collate(prompts, rows_per, device)
+    parallel_number = tokens.shape[-1]
+
+    autocast = (
+        torch.autocast(device_type=device.type, dtype=dtype)
+        if dtype != torch.float32 else contextlib.nullcontext()
+    )
+
+    def collect(curr: torch.Tensor):
+        for i, req in enumerate(requests):
+            if req.done:
+                continue
+            token = curr[i]
+            if torch.any(token >= config.audio_eos_id):
+                req.done = True
+                continue
+            req.frames.append(token.detach().clone())
+            try:
+                if req.frame_callback:
+                    req.frame_callback(len(req.frames) - 1, req.frames[-1])
+                if req.progress_callback:
+                    req.progress_callback(len(req.frames), req.max_frames)
+            except BaseException as e:
+                req.error = e
+                req.done = True
+                continue
+            if len(req.frames) >= req.max_frames:
+                req.done = True
+
+    mula.setup_caches(n * rows_per)
+    with autocast:
+        curr = mula.generate_frame(
+            tokens=tokens,
+            tokens_mask=masks,
+            input_pos=pos,
+            temperature=temperature,
+            topk=topk,
+            cfg_scale=cfg_scale,
+            continuous_segments=embeds,
+            starts=starts,
+        )
+    collect(curr)
+
+    step = 0
+    while not all(r.done for r in requests):
+        step += 1
+        padded, padded_mask = _pad_audio_token(curr, parallel_number, config.empty_id)
+        with autocast:
+            curr = mula.generate_frame(
+                tokens=padded,
+                tokens_mask=padded_mask,
+                input_pos=pos[..., -1:] + step,
+                temperature=temperature,
+                topk=topk,
+                cfg_scale=cfg_scale,
+                continuous_segments=None,
+                starts=None,
+            )
+        collect(curr)
+
+    log.info(f"Batched frame loop: {n} requests, {step + 1} steps, "
+             f"{sum(len(r.frames) for r in requests)} frames kept.")
@@ -1,20 +1,74 @@
-import torch
-import torch.nn as nn
-try:
-    import torch_directml
-    has_directml = True
-except ImportError:
-    has_directml = False
-
-from heartlib import HeartMuLaGenPipeline
 from app.config import settings
+from app.engine.residency import residency, module_size_bytes
+from app.engine.preview import preview_decoder
+from app.engine.scheduler import TaskCancelled
 from app.utils.logger import get_logger
-import os
+from app.utils.metrics import TOKEN_GENERATION_SECONDS, CODEC_DECODE_SECONDS, GENERATION_FPS, REALTIME_FACTOR
+from app.utils.task_spans import task_spans, span, add_span
+import contextlib
+import functools
+import threading
+import time
+from typing import TYPE_CHECKING
+import soundfile as sf
 
 import gc
 
+if TYPE_CHECKING:
+    from app.engine.frame_loop import FrameRequest
+
+# torch, torch_directml and heartlib take seconds to import; they load on
+# first use (device probe in the startup warm-up, or the first job), never
+# when the API imports this module. Tests patch this name.
+HeartMuLaGenPipeline = None
+
 log = get_logger("HeartMuLaService")
 
+def pipeline_class():
+    """HeartMuLaGenPipeline, importing heartlib on first use."""
+    global HeartMuLaGenPipeline
+    if HeartMuLaGenPipeline is None:
+        from heartlib import HeartMuLaGenPipeline as cls
+        HeartMuLaGenPipeline = cls
+    return HeartMuLaGenPipeline
+
+@functools.lru_cache(maxsize=None)
+def directml():
+    """The torch_directml module, or None when it isn't installed."""
+    try:
+        import torch_directml
+        return torch_directml
+    except ImportError:
+        return None
+
+def has_accelerator() -> bool:
+    """True when HeartMuLa runs on DirectML/CUDA rather than the CPU (imports torch)."""
+    import torch
+    return directml() is not None or torch.cuda.is_available()
+
+def record_job_metrics(frames: int, token_seconds: float, decode_seconds: float):
+    """Per-job generation timings: frame loop, codec decode, throughput and real-time factor."""
+    from app.engine.frame_loop import FRAME_MS
+
+    TOKEN_GENERATION_SECONDS.observe(token_seconds)
+    CODEC_DECODE_SECONDS.observe(decode_seconds)
+    if frames and token_seconds > 0:
+        GENERATION_FPS.observe(frames / token_seconds)
+        REALTIME_FACTOR.observe((token_seconds + decode_seconds) / (frames * FRAME_MS / 1000))
+
+def accelerator_name() -> str:
+    """Name of the device HeartMuLa runs on (the CPU when there is no accelerator)."""
+    try:
+        import torch
+        if directml() is not None:
+            return directml().device_name(0)
+        if torch.cuda.is_available():
+            return torch.cuda.get_device_name(0)
+    except Exception as e:
+        log.warning(f"Could not query accelerator name: {e}")
+    import platform
+    return platform.processor() or platform.machine() or "CPU"
+
 class HeartMuLaService:
     _instance = None
 
@@ -22,35 +76,108 @@ class HeartMuLaService:
         if cls._instance is None:
             cls._instance = super(HeartMuLaService, cls).__new__(cls)
             cls._instance.pipeline = None
+            cls._instance.streamer = None # LayerStreamingExecutor when an accelerator is used
+            # Serializes use of the shared pipeline (generation vs. generation/reset)
+            cls._instance.lock = threading.RLock()
             # HeartLib expects the path to the folder containing gen_config.json etc.
             # which is now settings.MODELS_DIR itself.
             cls._instance.model_path = str(settings.MODELS_DIR)
+            # CPU-sized until probe_device() knows better: probing needs torch
+            cls._instance._register_models(accelerated=False)
         return cls._instance
 
     def __init__(self):
         # Init logic is now in __new__ to prevent re-initialization
         pass
-        
+
+    def _register_models(self, accelerated: bool):
+        """Hand pipeline lifetime over to the residency manager (kept warm between jobs)."""
+        # 3B params: float16 on accelerators, float32 on CPU
+        estimate = 3_000_000_000 * (2 if accelerated else 4)
+        streamed = accelerated and settings.LAYER_STREAMING
+        if streamed:
+            # The streaming window grows to fill the vram budget
+            estimate = min(estimate, residency.status()["budgets"]["vram"])
+        residency.register(
+            "heartmula",
+            loader=self._build_pipeline,
+            unloader=self._release_pipeline,
+            pool="ram", # Moved to "vram" by probe_device() when layers stream through an accelerator
+            size_estimate=estimate,
+            sizer=self._pipeline_bytes,
+        )
+        residency.register(
+            "heartcodec",
+            loader=lambda: getattr(self.pipeline, "codec", None) or self.pipeline,
+            unloader=self._release_codec,
+            pool="ram", # Codec is pinned to CPU (_get_devices), even on an accelerator
+            size_estimate=1_500_000_000,
+            requires=("heartmula",),
+        )
+        if streamed and not residency.is_resident("heartmula"):
+            residency.set_pool("heartmula", "vram")
+
+    def _pipeline_bytes(self, pipeline) -> int:
+        """Size in the entry's pool: accelerator memory while streaming, else the host-resident model."""
+        if self.streamer is not None:
+            return self.streamer.device_bytes()
+        return module_size_bytes(getattr(pipeline, "mula", None))
+
+    def probe_device(self) -> bool:
+        """Import torch and detect the accelerator; sizes and pools the residency entries to match."""
+        accelerated = has_accelerator()
+        # Re-registration only replaces entries that aren't loaded yet
+        self._register_models(accelerated)
+        return accelerated
+
     def reset(self):
         """Force cleanup of VRAM/RAM resources."""
         log.info("Resetting HeartMuLa Service...")
-        if self.pipeline:
+        # Waits for an in-flight generation instead of tearing its model down
+        with self.lock:
+            residency.evict("heartmula", force=True)
+        log.info("System Reset Complete. Resources freed.")
+
+    def _release_pipeline(self, pipeline):
+        if self.streamer is not None:
+            self.streamer.detach()
+            self.streamer = None
+        if pipeline is not None:
             # Manually unload internal components if possible
-            if hasattr(self.pipeline, "_unload"):
-                self.pipeline.lazy_load = True # Force lazy load to enable unload
-                self.pipeline._unload()
-            
-            del self.pipeline
-            self.pipeline = None
-            
+            if hasattr(pipeline, "_unload"):
+                pipeline.lazy_load = True # Force lazy load to enable unload
+                pipeline._unload()
+        self.pipeline = None
+
         gc.collect()
+        import torch
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        elif has_directml:
+        elif directml() is not None:
              # DirectML cleanup if applicable
              pass
-             
-        log.info("System Reset Complete. Resources freed.")
+
+    def _release_job_buffers(self):
+        """Drop KV caches / activations of an aborted run; the weights stay warm."""
+        mula = getattr(self.pipeline, "mula", None) if self.pipeline is not None else None
+        if mula is not None and hasattr(mula, "reset_caches"):
+            try:
+                mula.reset_caches()
+            except Exception as e:
+                log.warning(f"Could not reset KV caches: {e}")
+        gc.collect()
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _release_codec(self, codec):
+        pipeline = self.pipeline
+        if pipeline is not None and getattr(pipeline, "lazy_load", False) and hasattr(pipeline, "_codec"):
+            # Lazy pipelines rebuild the codec on next access
+            pipeline._codec = None
+        elif pipeline is not None:
+            # The codec is owned by the pipeline; it can only go with it.
+            residency.evict("heartmula")
         
     def _get_devices(self):
         """
@@ -58,12 +185,13 @@ class HeartMuLaService:
         - mula: DirectML (if available) or CUDA/CPU
         - codec: CPU (Strictly requested by user)
         """
+        import torch
         devices = {}
         
         # Mula Device
-        if has_directml:
+        if directml() is not None:
             log.info("DirectML detected. Using DirectML for HeartMuLa.")
-            devices["mula"] = torch_directml.device()
+            devices["mula"] = directml().device()
         elif torch.cuda.is_available():
              log.info("CUDA detected. Using CUDA for HeartMuLa.")
              devices["mula"] = torch.device("cuda")
@@ -78,9 +206,22 @@ class HeartMuLaService:
         return devices
 
     def load_pipeline(self):
-        if self.pipeline:
-            return
-            
+        """Ensure the pipeline is resident (no-op when it is still warm)."""
+        residency.load("heartcodec")
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Pin pipeline + codec so the residency manager can't swap them mid-job (loading is a "load" span)."""
+        with contextlib.ExitStack() as stack:
+            with span("load"):
+                stack.enter_context(residency.use("heartcodec"))
+                pipeline = stack.enter_context(residency.use("heartmula"))
+            yield pipeline
+
+    def _build_pipeline(self):
+        import torch
+        from app.engine.snapshots import snapshot_model_path, dtype_name
+
         log.info(f"Loading HeartMuLa Pipeline from {self.model_path}...")
         devices = self._get_devices()
         
@@ -93,11 +234,9 @@ class HeartMuLaService:
             
             mula_dtype = torch.float32
             mula_device = torch.device("cpu")  # Layer streaming - load to CPU first
-            use_dml_streaming = False
             
-            if has_directml:
+            if directml() is not None:
                 mula_dtype = torch.float16
-                use_dml_streaming = True  # Will stream layers to DirectML
                 log.info("DirectML detected. Using layer streaming for GPU acceleration (float16).")
             elif torch.cuda.is_available():
                 mula_dtype = torch.float16
@@ -115,8 +254,18 @@ class HeartMuLaService:
             
             log.info(f"Initializing pipeline with mula_dtype={mula_dtype} (layer streaming enabled)...")
 
-            self.pipeline = HeartMuLaGenPipeline.from_pretrained(
-                self.model_path,
+            model_path = self.model_path
+            if settings.MODEL_SNAPSHOTS:
+                # Weights pre-cast for this device/dtype: mmap-loaded, no cast pass
+                backend = "dml" if directml() is not None else "cuda" if torch.cuda.is_available() else "cpu"
+                model_path = str(snapshot_model_path(
+                    f"{backend}-{dtype_name(mula_dtype)}",
+                    {"HeartMuLa-oss-3B": mula_dtype, "HeartCodec-oss": codec_dtype},
+                    self.model_path,
+                ))
+
+            pipeline = pipeline_class().from_pretrained(
+                model_path,
                 device=load_devices, 
                 dtype={
                     "mula": mula_dtype, 
@@ -127,24 +276,42 @@ class HeartMuLaService:
             )
             
             # Post-loading setup 
-            if has_directml:
+            if settings.LAYER_STREAMING and mula_dtype != torch.float32:
+                self._attach_streaming(pipeline, devices["mula"], mula_dtype)
+            if directml() is not None:
                 log.info("Pipeline loaded. DirectML acceleration active.")
             else:
                 log.info("Pipeline loaded.")
+            self.pipeline = pipeline
+            return pipeline
             
         except Exception as e:
             log.error(f"Failed to load pipeline: {e}")
             raise e
 
-    def generate(self, prompt_dict: dict, output_path: str, video_callback=None):
-        """
-        Generates music and saves to output_path.
-        Returns the path on success.
-        video_callback: Optional function(current_step, total_steps)
-        """
-        if not self.pipeline:
-            self.load_pipeline()
-            
+    def _attach_streaming(self, pipeline, device, dtype):
+        """Stream backbone layers through the accelerator; on failure the model stays on CPU."""
+        import torch
+        from app.engine.layer_streaming import attach_layer_streaming
+
+        try:
+            self.streamer = attach_layer_streaming(pipeline.mula, device, dtype)
+            if self.streamer is not None and hasattr(pipeline, "mula_device"):
+                # Inputs and KV caches follow the non-streamed modules onto the device
+                pipeline.mula_device = device
+        except Exception as e:
+            log.warning(f"Layer streaming unavailable ({e}); running HeartMuLa on CPU.")
+            if self.streamer is not None:
+                self.streamer.detach()
+            self.streamer = None
+            pipeline.mula.to(torch.device("cpu"))
+        if self.streamer is None:
+            # Nothing on the accelerator after all: account the model to host memory
+            residency.set_pool("heartmula", "ram")
+
+    @staticmethod
+    def build_inputs(prompt_dict: dict) -> dict:
+        """Flatten Kuno's song JSON into the pipeline's lyrics/tags inputs."""
         # Parse prompt dict to args for pipeline
         # Assuming prompt_dict keys align roughly or we parse them
         
@@ -165,27 +332,258 @@ class HeartMuLaService:
                 
         # If no lyrics, use description as tags/prompt
         # ensure lyrics is never None (fix for pipelines/music_generation.py crash)
-        inputs = {
+        return {
             "lyrics": lyrics if lyrics else "", 
             "tags": description
         }
+
+    @staticmethod
+    def sampling_params(prompt_dict: dict) -> dict:
+        """Sampling settings for a request (generation_parameters may override the defaults)."""
+        overrides = prompt_dict.get("generation_parameters") or {}
+        return {
+            "max_audio_length_ms": int(prompt_dict.get("duration_target") or 30) * 1000,
+            "topk": int(overrides.get("topk", 50)),
+            "temperature": float(overrides.get("temperature", 1.0)),
+            "cfg_scale": float(overrides.get("cfg_scale", 1.5)),
+            "seed": prompt_dict.get("seed"),
+        }
+
+    def prompt_length(self, prompt_dict: dict):
+        """
+        Token length of the request's prompt, or None while the pipeline (which
+        holds the tokenizer) isn't loaded. Never triggers a load.
+        """
+        pipeline = residency.peek("heartmula")
+        if pipeline is None:
+            return None
+        from app.engine.frame_loop import supports_batching
+
+        if not supports_batching(pipeline):
+            return None
+        try:
+            prompt = pipeline.preprocess(self.build_inputs(prompt_dict),
+                                         cfg_scale=self.sampling_params(prompt_dict)["cfg_scale"])
+            return int(prompt["tokens"].shape[1])
+        except Exception as e:
+            log.warning(f"Could not tokenize prompt for batching: {e}")
+            return None
+
+    def batch_key(self, prompt_dict: dict):
+        """
+        Requests with equal keys can share one batched frame loop.
+        Seeded requests never batch: the RNG stream is shared across the batch.
+        The prompt's token length is part of the key: generate_frame takes no
+        attention mask, so only equal-length prompts batch without padding.
+        While it's unknown (pipeline not loaded) the request doesn't batch.
+        """
+        sampling = self.sampling_params(prompt_dict)
+        if sampling["seed"] is not None:
+            return None
+        length = self.prompt_length(prompt_dict)
+        if length is None:
+            return None
+        return (sampling["topk"], sampling["temperature"], sampling["cfg_scale"], length)
+
+    def generate(self, prompt_dict: dict, output_path: str, video_callback=None, cancel_token=None, preview=None):
+        """
+        Generates music and saves to output_path.
+        Returns the path on success.
+        video_callback: Optional function(current_step, total_steps)
+        cancel_token: Optional CancellationToken, checked at every frame boundary
+        preview: Optional PreviewBuffer, filled with audio decoded while frames are generated
+        """
+        import torch
+        from app.engine.frame_loop import supports_batching
+
+        with span("prompt"):
+            inputs = self.build_inputs(prompt_dict)
+            sampling = self.sampling_params(prompt_dict)
         
         log.info(f"Generating for inputs: {inputs}")
+        progress = {"frames": 0, "last_frame_at": None}
+        
+        def on_frame(current, total):
+            # Raising here unwinds the pipeline's frame loop at a frame boundary
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            progress["frames"] = current
+            progress["last_frame_at"] = time.perf_counter()
+            if video_callback:
+                video_callback(current, total)
         
         try:
-            with torch.no_grad():
-                 self.pipeline(
-                    inputs,
-                    max_audio_length_ms=int(prompt_dict.get("duration_target", 30)) * 1000, 
-                    save_path=output_path,
-                    topk=50,
-                    temperature=1.0,
-                    cfg_scale=1.5,
-                    progress_callback=video_callback
-                )
+            with self.lock, self.pinned() as pipeline, torch.no_grad():
+                 if sampling["seed"] is not None:
+                     # Explicit seed -> reproducible render (enables the render cache)
+                     torch.manual_seed(sampling["seed"])
+                 if preview is not None and supports_batching(pipeline):
+                     # Own frame loop, only for jobs with a preview subscriber: the pipeline's callback doesn't expose tokens
+                     self._generate_with_preview(pipeline, inputs, sampling, output_path, on_frame, preview)
+                 else:
+                     if preview is not None:
+                         preview.close() # No token access; nothing to preview
+                     start = time.perf_counter()
+                     pipeline(
+                        inputs,
+                        max_audio_length_ms=sampling["max_audio_length_ms"], 
+                        save_path=output_path,
+                        topk=sampling["topk"],
+                        temperature=sampling["temperature"],
+                        cfg_scale=sampling["cfg_scale"],
+                        progress_callback=on_frame
+                    )
+                     # Opaque pipeline: the frame loop ends at the last callback, the rest is decode + save
+                     end = time.perf_counter()
+                     last_frame_at = progress["last_frame_at"] or end
+                     record_job_metrics(progress["frames"], last_frame_at - start, end - last_frame_at)
+                     add_span("token_generation", start, last_frame_at, frames=progress["frames"])
+                     add_span("codec_decode", last_frame_at, end)
             log.info(f"Generation saved to {output_path}")
             return output_path
             
+        except TaskCancelled:
+            log.info("Generation cancelled. Releasing per-job buffers.")
+            self._release_job_buffers()
+            raise
         except Exception as e:
             log.error(f"Generation failed: {e}")
             raise e
+
+    def _generate_with_preview(self, pipeline, inputs, sampling, output_path, on_frame, preview):
+        from app.engine.frame_loop import FrameRequest, run_batched_frames
+
+        decoder = preview_decoder(pipeline, preview)
+        request = FrameRequest(inputs, sampling["max_audio_length_ms"], progress_callback=on_frame,
+                               frame_callback=decoder.on_frame)
+        start = time.perf_counter()
+        try:
+            with span("token_generation") as attrs:
+                run_batched_frames(pipeline, [request], sampling["temperature"], sampling["topk"], sampling["cfg_scale"])
+                attrs["frames"] = len(request.frames)
+        finally:
+            decoder.finish(flush=request.error is None)
+        if request.error is not None:
+            raise request.error
+        token_seconds = time.perf_counter() - start
+        record_job_metrics(len(request.frames), token_seconds, self._write_song(pipeline, request, output_path))
+
+    def _write_song(self, pipeline, request: "FrameRequest", output_path: str) -> float:
+        """Full (non-chunked) codec decode of a finished frame loop -> WAV. Returns the decode time."""
+        import torch
+
+        if not request.frames:
+            raise RuntimeError("Model produced no audio frames.")
+        start = time.perf_counter()
+        with span("codec_decode"), torch.no_grad():
+            # Codec is pinned to CPU
+            wav = pipeline.codec.detokenize(request.frames_tensor().cpu())
+        decode_seconds = time.perf_counter() - start
+        with span("save"):
+            sf.write(output_path, wav.detach().float().cpu().numpy().T, getattr(pipeline, "sample_rate", 48000))
+        log.info(f"Generation saved to {output_path}")
+        return decode_seconds
+
+    def generate_batch(self, items: list, on_result=None) -> list:
+        """
+        Generates several songs in batched frame loops (one per prompt length).
+        items: dicts with prompt_dict, output_path and optional video_callback / cancel_token /
+        preview / task_id (all with the same batch_key; task_id keeps a song's decode out of
+        the other songs' timing spans). Returns one entry per item: None on
+        success, the exception otherwise. on_result(index, error), if given,
+        gets each song's entry as soon as that song is decoded, so it can be
+        handed off while the rest of the batch is still running. Falls back to
+        one-by-one generation when the loaded pipeline doesn't expose its
+        frame-level internals.
+        """
+        import torch
+        from app.engine.frame_loop import FrameRequest, run_batched_frames, supports_batching
+
+        results = [None] * len(items)
+        reported = set()
+
+        def report(index: int, error):
+            results[index] = error
+            reported.add(index)
+            if on_result:
+                on_result(index, error)
+
+        with self.lock, self.pinned() as pipeline:
+            if len(items) == 1 or not supports_batching(pipeline):
+                for index, item in enumerate(items):
+                    try:
+                        self.generate(item["prompt_dict"], item["output_path"],
+                                      item.get("video_callback"), item.get("cancel_token"), item.get("preview"))
+                        error = None
+                    except Exception as e:
+                        error = e
+                    report(index, error)
+                return results
+
+            prompt_start = time.perf_counter()
+            sampling = self.sampling_params(items[0]["prompt_dict"])
+            requests = []
+            decoders = {}
+            for index, item in enumerate(items):
+                token = item.get("cancel_token")
+                callback = item.get("video_callback")
+
+                def on_frame(current, total, token=token, callback=callback):
+                    if token is not None:
+                        token.raise_if_cancelled()
+                    if callback:
+                        callback(current, total)
+
+                decoder = preview_decoder(pipeline, item["preview"]) if item.get("preview") is not None else None
+                if decoder is not None:
+                    decoders[index] = decoder
+                requests.append(FrameRequest(
+                    self.build_inputs(item["prompt_dict"]),
+                    self.sampling_params(item["prompt_dict"])["max_audio_length_ms"],
+                    progress_callback=on_frame,
+                    frame_callback=decoder.on_frame if decoder else None,
+                ))
+            add_span("prompt", prompt_start, time.perf_counter())
+            position = {id(req): index for index, req in enumerate(requests)}
+            log.info(f"Generating {len(items)} songs as one batch.")
+            start = time.perf_counter()
+
+            def finish_group(group):
+                # Every song of the group spent the group's whole frame loop generating
+                token_end = time.perf_counter()
+                for req in group:
+                    index = position[id(req)]
+                    decoder = decoders.pop(index, None)
+                    if decoder is not None:
+                        decoder.finish(flush=req.error is None)
+                    if req.error is not None:
+                        report(index, req.error)
+                        continue
+                    try:
+                        with task_spans.narrow(items[index].get("task_id")):
+                            add_span("token_generation", start, token_end, batch=len(items), frames=len(req.frames))
+                            decode_seconds = self._write_song(pipeline, req, items[index]["output_path"])
+                        record_job_metrics(len(req.frames), token_end - start, decode_seconds)
+                        error = None
+                    except Exception as e:
+                        log.error(f"Decoding batched song failed: {e}")
+                        error = e
+                    report(index, error)
+
+            try:
+                with torch.no_grad():
+                    run_batched_frames(pipeline, requests, sampling["temperature"], sampling["topk"],
+                                       sampling["cfg_scale"], on_group_done=finish_group)
+            except Exception as e:
+                log.error(f"Batched generation failed: {e}")
+                for decoder in decoders.values():
+                    decoder.finish(flush=False)
+                self._release_job_buffers()
+                for index in range(len(items)):
+                    if index not in reported:
+                        report(index, e)
+                return results
+
+            if any(isinstance(r, TaskCancelled) for r in results):
+                self._release_job_buffers()
+        return results
@@ -0,0 +1,311 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+from app.config import settings
+from app.engine.residency import _detect_vram_total
+from app.utils.logger import get_logger
+
+log = get_logger("LayerStreaming")
+
+
+class DevicePool:
+    """
+    Moves a layer's weights between its host copy and the accelerator.
+
+    Host copies are made once at attach time: cast to the compute dtype up
+    front and, on CUDA, pinned so uploads can run asynchronously on a side
+    stream. Offloading never copies back: weights are read-only, so the
+    parameters are simply re-pointed at their host copies.
+    """
+
+    def __init__(self, device: torch.device):
+        self.device = device
+        self._cuda = device.type == "cuda"
+        self._stream = torch.cuda.Stream(device) if self._cuda else None
+
+    def prepare_host(self, tensor: torch.Tensor, dtype: Optional[torch.dtype]) -> torch.Tensor:
+        host = tensor.detach()
+        if dtype is not None and host.is_floating_point():
+            host = host.to(dtype)
+        host = host.cpu().contiguous()
+        if self._cuda:
+            host = host.pin_memory()
+        return host
+
+    def upload(self, host: Dict[str, torch.Tensor]):
+        """Copy host tensors to the device; returns (device tensors, ready handle)."""
+        if self._cuda:
+            with torch.cuda.stream(self._stream):
+                out = {name: t.to(self.device, non_blocking=True) for name, t in host.items()}
+                event = torch.cuda.Event()
+                event.record(self._stream)
+            return out, event
+        return {name: t.to(self.device) for name, t in host.items()}, None
+
+    def wait(self, handle):
+        """Make the compute stream wait for an upload (no-op off CUDA)."""
+        if handle is not None:
+            torch.cuda.current_stream(self.device).wait_event(handle)
+
+    def release(self, device_tensors: Dict[str, torch.Tensor]):
+        pass
+
+
+class SimulatedDevicePool(DevicePool):
+    """
+    CPU stand-in for an accelerator: "uploads" clone the tensors after a
+    configurable delay and the pool records what is resident, so scheduling
+    (window size, prefetch order, overlap) can be checked without a GPU.
+    """
+
+    def __init__(self, transfer_delay: float = 0.0):
+        super().__init__(torch.device("cpu"))
+        self.transfer_delay = transfer_delay
+        self.uploads: List[int] = []
+        self.resident_bytes = 0
+        self.peak_bytes = 0
+        self._lock = threading.Lock()
+
+    def upload(self, host: Dict[str, torch.Tensor]):
+        if self.transfer_delay:
+            time.sleep(self.transfer_delay)
+        out = {name: t.clone() for name, t in host.items()}
+        size = sum(t.numel() * t.element_size() for t in out.values())
+        with self._lock:
+            self.uploads.append(size)
+            self.resident_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.resident_bytes)
+        return out, None
+
+    def release(self, device_tensors: Dict[str, torch.Tensor]):
+        size = sum(t.numel() * t.element_size() for t in device_tensors.values())
+        with self._lock:
+            self.resident_bytes -= size
+
+
+class _StreamedLayer:
+    def __init__(self, index: int, module: nn.Module):
+        self.index = index
+        self.module = module
+        self.host: Dict[str, torch.Tensor] = {}
+        self.device: Optional[Dict[str, torch.Tensor]] = None
+        self.pending: Optional[Future] = None
+        self.bytes = 0
+
+
+class LayerStreamingExecutor:
+    """
+    Keeps a sliding window of transformer layers on the accelerator.
+
+    Forward pre-hooks make sure layer i is resident (waiting on its prefetch
+    if needed), drop layers that fell out of the window and queue uploads of
+    the next layers on a background thread, so the copy of layer i+1 overlaps
+    the compute of layer i. The window wraps around: the decoder runs every
+    layer once per frame, so layer 0 of the next frame follows the last one.
+
+    Window size is MAX_GPU_LAYERS, capped by what fits in the VRAM budget
+    (VRAM_TARGET_USAGE of the card minus `reserved_bytes` for the rest of the
+    model).
+    """
+
+    def __init__(self, layers: nn.ModuleList, pool: DevicePool, max_layers: Optional[int] = None,
+                 vram_budget: Optional[int] = None, dtype: Optional[torch.dtype] = None,
+                 reserved_bytes: int = 0):
+        self.layers = [_StreamedLayer(i, m) for i, m in enumerate(layers)]
+        self.pool = pool
+        self.dtype = dtype
+        self.max_layers = max_layers if max_layers is not None else settings.MAX_GPU_LAYERS
+        self.vram_budget = vram_budget if vram_budget is not None else \
+            int(_detect_vram_total() * settings.VRAM_TARGET_USAGE)
+        self.reserved_bytes = reserved_bytes
+        self.window = 1
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._prefetcher: Optional[ThreadPoolExecutor] = None
+        self._compute_started: Dict[int, float] = {}
+        self.transfer_seconds = 0.0 # time spent copying (background thread)
+        self.stall_seconds = 0.0 # time compute waited for a copy
+        self.compute_seconds = 0.0
+        self.transfers = 0
+        self.layer_calls = 0
+
+    # --- Setup ---
+
+    def attach(self):
+        for layer in self.layers:
+            layer.host = {
+                name: self.pool.prepare_host(t, self.dtype)
+                for name, t in self._tensors(layer.module).items()
+            }
+            layer.bytes = sum(t.numel() * t.element_size() for t in layer.host.values())
+            self._point_at(layer, layer.host)
+        largest = max((layer.bytes for layer in self.layers), default=1) or 1
+        fits = max(1, (self.vram_budget - self.reserved_bytes) // largest)
+        self.window = max(1, min(self.max_layers, fits, len(self.layers)))
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="layer-prefetch")
+        for layer in self.layers:
+            self._hooks.append(layer.module.register_forward_pre_hook(
+                lambda module, args, i=layer.index: self._before(i)))
+            self._hooks.append(layer.module.register_forward_hook(
+                lambda module, args, output, i=layer.index: self._after(i)))
+        log.info(f"Layer streaming: {len(self.layers)} layers, window {self.window} "
+                 f"(MAX_GPU_LAYERS={self.max_layers}, {largest / 1024 ** 2:.0f} MB/layer, "
+                 f"budget {self.vram_budget / 1024 ** 3:.1f} GB).")
+        return self
+
+    def detach(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=True)
+            self._prefetcher = None
+        for layer in self.layers:
+            self._offload(layer)
+
+    @staticmethod
+    def _tensors(module: nn.Module) -> Dict[str, torch.Tensor]:
+        named = dict(module.named_parameters(recurse=True))
+        named.update(dict(module.named_buffers(recurse=True)))
+        return named
+
+    @staticmethod
+    def _point_at(layer: _StreamedLayer, tensors: Dict[str, torch.Tensor]):
+        for name, tensor in tensors.items():
+            owner_name, _, attr = name.rpartition(".")
+            owner = layer.module.get_submodule(owner_name) if owner_name else layer.module
+            current = getattr(owner, attr)
+            if isinstance(current, nn.Parameter):
+                current.data = tensor
+            else:
+                owner._buffers[attr] = tensor
+
+    # --- Scheduling ---
+
+    def _window_of(self, index: int) -> List[int]:
+        n = len(self.layers)
+        return [(index + k) % n for k in range(self.window)]
+
+    def _upload(self, layer: _StreamedLayer):
+        started = time.perf_counter()
+        tensors, handle = self.pool.upload(layer.host)
+        with self._lock:
+            self.transfer_seconds += time.perf_counter() - started
+            self.transfers += 1
+        return tensors, handle
+
+    def _prefetch(self, layer: _StreamedLayer):
+        if layer.device is None and layer.pending is None:
+            layer.pending = self._prefetcher.submit(self._upload, layer)
+
+    def _ensure(self, layer: _StreamedLayer):
+        if layer.device is not None:
+            return
+        started = time.perf_counter()
+        if layer.pending is None:
+            # Nothing in flight (first call or window of 1): load synchronously
+            tensors, handle = self._upload(layer)
+        else:
+            tensors, handle = layer.pending.result()
+            layer.pending = None
+        self.pool.wait(handle)
+        self.stall_seconds += time.perf_counter() - started
+        layer.device = tensors
+        self._point_at(layer, tensors)
+
+    def _offload(self, layer: _StreamedLayer):
+        if layer.pending is not None:
+            tensors, _ = layer.pending.result()
+            layer.pending = None
+            self.pool.release(tensors)
+        if layer.device is not None:
+            self._point_at(layer, layer.host)
+            self.pool.release(layer.device)
+            layer.device = None
+
+    def _before(self, index: int):
+        window = self._window_of(index)
+        self._ensure(self.layers[index])
+        keep = set(window)
+        for layer in self.layers:
+            if layer.index not in keep:
+                self._offload(layer)
+        for i in window[1:]:
+            self._prefetch(self.layers[i])
+        self._compute_started[index] = time.perf_counter()
+
+    def _after(self, index: int):
+        started = self._compute_started.pop(index, None)
+        if started is not None:
+            self.compute_seconds += time.perf_counter() - started
+        self.layer_calls += 1
+
+    def device_bytes(self) -> int:
+        """Accelerator memory held while streaming: the non-streamed modules plus one window of layers."""
+        largest = max((layer.bytes for layer in self.layers), default=0)
+        return self.reserved_bytes + self.window * largest
+
+    def resident(self) -> List[int]:
+        return [layer.index for layer in self.layers if layer.device is not None]
+
+    def stats(self) -> dict:
+        """Transfer vs. compute time (host clock; CUDA compute is asynchronous so compute is a lower bound)."""
+        return {
+            "layers": len(self.layers),
+            "window": self.window,
+            "max_gpu_layers": self.max_layers,
+            "vram_budget": self.vram_budget,
+            "transfers": self.transfers,
+            "layer_calls": self.layer_calls,
+            "transfer_seconds": round(self.transfer_seconds, 4),
+            "stall_seconds": round(self.stall_seconds, 4),
+            "compute_seconds": round(self.compute_seconds, 4),
+            "resident": self.resident(),
+        }
+
+
+def find_layers(model: nn.Module) -> Optional[nn.ModuleList]:
+    """The transformer block list of a HeartMuLa-style model (backbone first)."""
+    for path in ("backbone.layers", "model.layers", "layers"):
+        try:
+            layers = model.get_submodule(path)
+        except AttributeError:
+            continue
+        if isinstance(layers, nn.ModuleList) and len(layers):
+            return layers
+    return None
+
+
+def attach_layer_streaming(model: nn.Module, device: torch.device,
+                           dtype: Optional[torch.dtype] = None) -> Optional[LayerStreamingExecutor]:
+    """
+    Put everything except the transformer blocks on `device` and stream the
+    blocks through a LayerStreamingExecutor. Returns None if the model has no
+    recognizable block list (it is then left untouched on the host).
+    """
+    layers = find_layers(model)
+    if layers is None:
+        log.warning("No transformer layer list found; layer streaming disabled.")
+        return None
+    streamed = {id(p) for p in layers.parameters()} | {id(b) for b in layers.buffers()}
+    reserved = 0
+    for module in model.modules():
+        if module is layers:
+            continue
+        for name, param in list(module.named_parameters(recurse=False)):
+            if id(param) in streamed:
+                continue
+            param.data = param.data.to(device=device, dtype=dtype if param.is_floating_point() and dtype else None)
+            reserved += param.numel() * param.element_size()
+        for name, buf in list(module.named_buffers(recurse=False)):
+            if id(buf) in streamed:
+                continue
+            module._buffers[name] = buf.to(device)
+            reserved += buf.numel() * buf.element_size()
+    executor = LayerStreamingExecutor(layers, DevicePool(device), dtype=dtype, reserved_bytes=reserved)
+    return executor.attach()
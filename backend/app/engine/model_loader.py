@@ -1,12 +1,25 @@
 import os
+import json
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from huggingface_hub import snapshot_download
+from huggingface_hub import snapshot_download, hf_hub_download
 from app.utils.logger import get_logger
+from app.utils.file_hash import cached_sha256, file_signature
 from app.config import settings
-import shutil
 
 log = get_logger("ModelLoader")
 
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+# (repo id, sub-directory of MODELS_DIR, allow_patterns)
+MODEL_REPOS = [
+    ("HeartMuLa/HeartMuLaGen", "", ["*.json", "*.model"]), # Base configs: tokenizer.json, gen_config.json
+    ("HeartMuLa/HeartMuLa-oss-3B", "HeartMuLa-oss-3B", None), # The main model
+    ("HeartMuLa/HeartCodec-oss", "HeartCodec-oss", None), # The audio codec
+]
+
 def download_repo(repo_id: str, local_dir: Path, allow_patterns=None):
     log.info(f"Checking {repo_id} in {local_dir}...")
     try:
@@ -22,6 +35,119 @@ def download_repo(repo_id: str, local_dir: Path, allow_patterns=None):
         log.error(f"Failed to download {repo_id}: {e}")
         raise e
 
+def download_files(repo_id: str, base_dir: Path, subdir: str, filenames):
+    """Re-fetch individual files of a repo (paths relative to the repo root)."""
+    local_dir = base_dir / subdir if subdir else base_dir
+    for filename in filenames:
+        log.info(f"Fetching {repo_id}/{filename}...")
+        target = local_dir / filename
+        if target.exists():
+            target.unlink() # Corrupt copy; don't let the hub client "resume" it
+        hf_hub_download(repo_id=repo_id, filename=filename, local_dir=local_dir)
+
+# --- Manifest ---
+
+def manifest_path(base_dir: Path) -> Path:
+    return base_dir / MANIFEST_NAME
+
+def load_manifest(base_dir: Path):
+    try:
+        manifest = json.loads(manifest_path(base_dir).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(base_dir: Path, manifest: dict):
+    tmp = manifest_path(base_dir).with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, manifest_path(base_dir))
+
+def repo_files(base_dir: Path, subdir: str, allow_patterns=None):
+    """Files a repo put on disk, relative to the repo root (hub metadata/hidden files skipped)."""
+    root = base_dir / subdir if subdir else base_dir
+    if not root.exists():
+        return []
+    if not subdir:
+        # Base configs live at the top of MODELS_DIR next to the other repos' folders
+        candidates = [p for p in root.iterdir() if p.is_file()]
+    else:
+        candidates = [p for p in root.rglob("*") if p.is_file()]
+    files = []
+    for path in sorted(candidates):
+        rel = path.relative_to(root).as_posix()
+        if any(part.startswith(".") for part in rel.split("/")):
+            continue
+        if allow_patterns and not any(fnmatch.fnmatch(rel, pat) for pat in allow_patterns):
+            continue
+        files.append(rel)
+    return files
+
+def build_manifest(base_dir: Path, previous=None) -> dict:
+    """Record size, mtime and sha256 of every model file (hashes reused when unchanged)."""
+    previous = previous or {"repos": {}}
+    jobs = []
+    for repo_id, subdir, patterns in MODEL_REPOS:
+        known = previous["repos"].get(repo_id, {}).get("files", {})
+        for rel in repo_files(base_dir, subdir, patterns):
+            jobs.append((repo_id, rel, (base_dir / subdir / rel) if subdir else base_dir / rel, known.get(rel)))
+
+    def record(job):
+        repo_id, rel, path, known = job
+        return repo_id, rel, {**file_signature(path), "sha256": cached_sha256(path, known)}
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "repos": {repo_id: {"dir": subdir, "files": {}} for repo_id, subdir, _ in MODEL_REPOS},
+    }
+    with ThreadPoolExecutor(max_workers=_hash_workers()) as pool:
+        for repo_id, rel, entry in pool.map(record, jobs):
+            manifest["repos"][repo_id]["files"][rel] = entry
+    return manifest
+
+def _hash_workers() -> int:
+    return max(2, min(8, os.cpu_count() or 2))
+
+def verify_manifest(base_dir: Path, manifest: dict) -> dict:
+    """
+    Check every file listed in the manifest. Size + mtime match -> trusted;
+    size matches but mtime changed -> full sha256 compare. Returns
+    {repo_id: [bad files]} (missing, truncated or corrupt).
+    """
+    jobs = []
+    for repo_id, subdir, _ in MODEL_REPOS:
+        entry = manifest["repos"].get(repo_id)
+        if not entry or not entry.get("files"):
+            jobs.append((repo_id, None, None, None)) # Never downloaded
+            continue
+        for rel, expected in entry["files"].items():
+            jobs.append((repo_id, rel, (base_dir / subdir / rel) if subdir else base_dir / rel, expected))
+
+    def check(job):
+        repo_id, rel, path, expected = job
+        if rel is None:
+            return repo_id, None, False
+        try:
+            signature = file_signature(path)
+        except FileNotFoundError:
+            return repo_id, rel, False
+        if signature["size"] != expected["size"]:
+            return repo_id, rel, False
+        if signature["mtime_ns"] == expected["mtime_ns"]:
+            return repo_id, rel, True
+        ok = cached_sha256(path, None) == expected["sha256"]
+        if ok:
+            expected["mtime_ns"] = signature["mtime_ns"] # Touched but intact; refresh
+        return repo_id, rel, ok
+
+    bad = {}
+    with ThreadPoolExecutor(max_workers=_hash_workers()) as pool:
+        for repo_id, rel, ok in pool.map(check, jobs):
+            if not ok:
+                bad.setdefault(repo_id, []).append(rel)
+    return bad
+
 def ensure_models_available():
     """
     Ensures the 'models' directory structure matches HeartLib requirements:
@@ -30,25 +156,40 @@ def ensure_models_available():
        ├── HeartMuLa-oss-3B/
        ├── gen_config.json (from HeartMuLaGen)
        └── tokenizer.json  (from HeartMuLaGen)
+
+    Offline first: once a manifest exists, startup only verifies local files
+    against it and touches the network for missing/corrupt files. Repos are
+    fetched concurrently.
     """
     base_dir = settings.MODELS_DIR # e.g., backend/models
     base_dir.mkdir(parents=True, exist_ok=True)
-    
-    # 1. HeartMuLaGen (Base configs like tokenizer.json, gen_config.json)
-    # Download to root of models dir
-    log.info("Downloading Base Configs (HeartMuLaGen)...")
-    download_repo("HeartMuLa/HeartMuLaGen", base_dir, allow_patterns=["*.json", "*.model"])
-
-    # 2. HeartMuLa-oss-3B (The Main Model)
-    # Target: ./models/HeartMuLa-oss-3B
-    hm_dir = base_dir / "HeartMuLa-oss-3B"
-    log.info("Downloading HeartMuLa 3B...")
-    download_repo("HeartMuLa/HeartMuLa-oss-3B", hm_dir)
-    
-    # 3. HeartCodec-oss (The Audio Codec)
-    # Target: ./models/HeartCodec-oss
-    hc_dir = base_dir / "HeartCodec-oss"
-    log.info("Downloading HeartCodec...")
-    download_repo("HeartMuLa/HeartCodec-oss", hc_dir)
 
+    manifest = load_manifest(base_dir)
+    if manifest is not None:
+        bad = verify_manifest(base_dir, manifest)
+        if not bad:
+            save_manifest(base_dir, manifest) # Persist refreshed mtimes
+            log.info("All models verified against local manifest (offline).")
+            return
+        log.warning(f"Model files need repair: { {repo: len(files) for repo, files in bad.items()} }")
+    else:
+        log.info("No model manifest yet; downloading/verifying all repos...")
+        bad = {repo_id: [None] for repo_id, _, _ in MODEL_REPOS}
+
+    def fetch(repo):
+        repo_id, subdir, patterns = repo
+        files = bad.get(repo_id)
+        if not files:
+            return
+        if None in files:
+            # Unknown file list: let the hub client resolve and resume the repo
+            download_repo(repo_id, base_dir / subdir if subdir else base_dir, allow_patterns=patterns)
+        else:
+            download_files(repo_id, base_dir, subdir, files)
+
+    with ThreadPoolExecutor(max_workers=len(MODEL_REPOS)) as pool:
+        # list() re-raises the first download error
+        list(pool.map(fetch, MODEL_REPOS))
+
+    save_manifest(base_dir, build_manifest(base_dir, manifest))
     log.info("All models verified.")
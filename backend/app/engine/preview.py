@@ -0,0 +1,253 @@
+import struct
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.engine.scheduler import generation_scheduler
+from app.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    import torch # Imported by the decoder thread; the API imports this module without it
+
+log = get_logger("Preview")
+
+
+def wav_stream_header(sample_rate: int, channels: int, bits: int = 16) -> bytes:
+    """RIFF header for a PCM stream of unknown length (sizes set to max, as streaming players expect)."""
+    byte_rate = sample_rate * channels * bits // 8
+    return b"".join([
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, channels * bits // 8, bits),
+        b"data", struct.pack("<I", 0xFFFFFFFF),
+    ])
+
+
+class PreviewBuffer:
+    """
+    Growing PCM16 buffer of a task's preview audio. Written by the decoder
+    thread, read by any number of streaming clients by byte offset.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.sample_rate: Optional[int] = None
+        self.channels: Optional[int] = None
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def append(self, audio: np.ndarray, sample_rate: int):
+        """audio: [frames, channels] float."""
+        pcm = (np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+        with self.cond:
+            self.sample_rate = sample_rate
+            self.channels = audio.shape[1]
+            self._chunks.append(pcm)
+            self._size += len(pcm)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def read(self, offset: int, timeout: float = 1.0) -> bytes:
+        """Bytes after `offset`; waits up to `timeout` for more while the buffer is open."""
+        with self.cond:
+            if self._size <= offset and not self.closed:
+                self.cond.wait(timeout)
+            if self._size <= offset:
+                return b""
+            data = b"".join(self._chunks)
+            if len(self._chunks) > 1:
+                self._chunks = [data] # Compact so later reads are cheap
+            return data[offset:]
+
+    def wait_for_format(self, timeout: float) -> bool:
+        with self.cond:
+            if self.sample_rate is None and not self.closed:
+                self.cond.wait(timeout)
+            return self.sample_rate is not None
+
+
+class PreviewDecoder:
+    """
+    Decodes a generation's frames with the codec while they are produced.
+
+    Every `chunk_frames` new frames, a background thread decodes them with
+    already-decoded frames in front as context. The last `overlap_frames`
+    of each chunk are held back; the next decode re-covers them (with as
+    much context again in front, which is discarded) and crossfades over
+    the held tail, so chunk boundaries don't click. Decoding overlaps
+    generation instead of trailing it, and the first audio is ready after
+    one chunk.
+    """
+
+    def __init__(self, decode: Callable[["torch.Tensor"], "torch.Tensor"], buffer: PreviewBuffer, sample_rate: int,
+                 chunk_frames: int, overlap_frames: int, thread_init: Optional[Callable[[], None]] = None):
+        self.decode = decode
+        self.thread_init = thread_init
+        self.buffer = buffer
+        self.sample_rate = sample_rate
+        self.chunk_frames = max(1, chunk_frames)
+        self.overlap_frames = max(0, min(overlap_frames, chunk_frames // 2))
+        self._frames: List["torch.Tensor"] = []
+        self._decoded = 0 # frames already turned into audio
+        self._tail: Optional[np.ndarray] = None
+        self._cond = threading.Condition()
+        self._finishing = False
+        self._aborted = False
+        self._thread = threading.Thread(target=self._run, name=f"preview-{buffer.task_id[:8]}", daemon=True)
+        self._thread.start()
+
+    def on_frame(self, index: int, token: "torch.Tensor"):
+        with self._cond:
+            self._frames.append(token.detach().cpu())
+            if len(self._frames) - self._decoded >= self.chunk_frames:
+                self._cond.notify()
+
+    def finish(self, flush: bool = True):
+        """Decode what's left (flush) or drop it, then close the buffer."""
+        with self._cond:
+            self._finishing = True
+            self._aborted = not flush
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        import torch
+
+        if self.thread_init:
+            self.thread_init()
+        try:
+            while True:
+                with self._cond:
+                    while (len(self._frames) - self._decoded < self.chunk_frames
+                           and not self._finishing):
+                        self._cond.wait()
+                    if self._aborted:
+                        return
+                    end = len(self._frames)
+                    final = self._finishing
+                    if end == self._decoded:
+                        if final:
+                            self._flush_tail()
+                            return
+                        continue
+                    # Held tail covers [decoded - overlap, decoded); decode from one more overlap before it
+                    held = self.overlap_frames if self._tail is not None else 0
+                    start = max(0, self._decoded - held - self.overlap_frames)
+                    window = torch.stack(self._frames[start:end]).transpose(0, 1)
+                self._emit(window, skip=self._decoded - held - start, total=end - start, final=final)
+                self._decoded = end
+                if final:
+                    self._flush_tail()
+                    return
+        except Exception as e:
+            log.warning(f"Preview decoding stopped for {self.buffer.task_id}: {e}")
+        finally:
+            self.buffer.close()
+
+    def _emit(self, window: "torch.Tensor", skip: int, total: int, final: bool):
+        import torch
+
+        with torch.no_grad():
+            wav = self.decode(window)
+        audio = wav.detach().float().cpu().numpy()
+        audio = audio.T if audio.ndim > 1 else audio[:, None] # [samples, channels]
+        per_frame = len(audio) / max(1, total)
+        out = audio[int(round(skip * per_frame)):]
+        if self._tail is not None:
+            # The held tail and the start of this decode cover the same frames
+            n = min(len(self._tail), len(out))
+            fade = np.linspace(0.0, 1.0, n + 2, dtype=np.float32)[1:-1, None]
+            out = out.copy()
+            out[:n] = self._tail[:n] * (1.0 - fade) + out[:n] * fade
+            self._tail = None
+        if not final and self.overlap_frames:
+            hold = int(round(self.overlap_frames * per_frame))
+            self._tail = out[len(out) - hold:].copy()
+            out = out[:len(out) - hold]
+        if len(out):
+            self.buffer.append(out, self.sample_rate)
+
+    def _flush_tail(self):
+        if self._tail is not None and len(self._tail):
+            self.buffer.append(self._tail, self.sample_rate)
+        self._tail = None
+
+
+class PreviewRegistry:
+    """
+    Preview buffers of subscribed tasks, plus the last few finished ones.
+    A task is only decoded for preview when a client subscribed before its
+    job started generating; otherwise the job runs the plain pipeline.
+    """
+
+    def __init__(self, keep_finished: int = 4):
+        self.keep_finished = keep_finished
+        self._buffers: "OrderedDict[str, PreviewBuffer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_id: str) -> PreviewBuffer:
+        """The task's buffer for a streaming client (closed if its job started without one)."""
+        with self._lock:
+            buffer = self._buffers.get(task_id)
+            if buffer is None:
+                buffer = PreviewBuffer(task_id)
+                self._buffers[task_id] = buffer
+                self._trim()
+            return buffer
+
+    def claim(self, task_id: str) -> Optional[PreviewBuffer]:
+        """
+        Called by a job as it starts generating: the subscribed buffer to decode
+        into, or None when nobody subscribed. In that case a closed buffer is
+        left behind, so a client subscribing from now on gets no preview
+        instead of waiting on audio that is never decoded.
+        """
+        with self._lock:
+            buffer = self._buffers.get(task_id)
+            if buffer is not None and not buffer.closed:
+                return buffer
+            buffer = PreviewBuffer(task_id)
+            buffer.closed = True
+            self._buffers[task_id] = buffer
+            self._trim()
+            return None
+
+    def get(self, task_id: str) -> Optional[PreviewBuffer]:
+        with self._lock:
+            return self._buffers.get(task_id)
+
+    def _trim(self):
+        finished = [tid for tid, buf in self._buffers.items() if buf.closed]
+        for tid in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._buffers[tid]
+
+
+def preview_decoder(pipeline, buffer: PreviewBuffer) -> PreviewDecoder:
+    """Decoder feeding `buffer` from the pipeline's codec (CPU-pinned, generation stage threads)."""
+    from app.engine.frame_loop import FRAME_MS
+
+    chunk = max(1, int(settings.PREVIEW_CHUNK_SECONDS * 1000 // FRAME_MS))
+    overlap = int(settings.PREVIEW_OVERLAP_SECONDS * 1000 // FRAME_MS)
+    return PreviewDecoder(
+        lambda frames: pipeline.codec.detokenize(frames),
+        buffer,
+        getattr(pipeline, "sample_rate", 48000),
+        chunk,
+        overlap,
+        thread_init=generation_scheduler.helper_initializer(),
+    )
+
+
+previews = PreviewRegistry()
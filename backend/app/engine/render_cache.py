@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import CACHE_REQUESTS
+
+log = get_logger("RenderCache")
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """Canonical hash: sorted keys, no whitespace, floats as JSON numbers."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hard-link when possible (same volume, no extra disk), else copy."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class RenderCache:
+    """
+    Content-addressed store of final renders.
+
+    Entries are WAV files named by key, indexed in SQLite with size and last
+    access. Least recently used entries are evicted when the cache holds more
+    than `max_entries` files or `max_bytes` on disk. Also tracks in-flight
+    keys so identical concurrent requests share one job (single-flight).
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+        self._inflight: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    # --- Lookup / insert ---
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(path):
+                if row is not None:
+                    # File removed behind our back
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="render", result="miss")
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        CACHE_REQUESTS.inc(cache="render", result="hit")
+        return path
+
+    def put(self, key: str, source_path: str) -> str:
+        path = self.path_for(key)
+        link_or_copy(source_path, path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created_at, last_access, hits) VALUES (?, ?, ?, ?, 0)",
+                (key, os.path.getsize(path), now, now),
+            )
+            self._evict()
+        return path
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            log.info(f"Evicted cached render {key[:12]} ({size / 1024 ** 2:.1f} MB).")
+
+    # --- Single-flight ---
+
+    def join_inflight(self, key: str, task_id: str) -> Optional[str]:
+        """
+        Register task_id as the producer of key. If an identical render is
+        already running, returns that task's id instead (caller should reuse it).
+        """
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is not None:
+                return leader
+            self._inflight[key] = task_id
+            return None
+
+    def finish_inflight(self, key: str, task_id: str):
+        with self._lock:
+            if self._inflight.get(key) == task_id:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            return {
+                "entries": count,
+                "bytes": total,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "inflight": len(self._inflight),
+            }
+
+
+render_cache = RenderCache(
+    settings.RENDER_CACHE_DIR,
+    settings.RENDER_CACHE_MAX_ENTRIES,
+    int(settings.RENDER_CACHE_MAX_GB * 1024 ** 3),
+)
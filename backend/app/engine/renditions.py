@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import soundfile as sf
+
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import CACHE_REQUESTS
+
+log = get_logger("Renditions")
+
+# Bump when encoder settings change so stale renditions are not served
+RENDITION_VERSION = 1
+BLOCK_FRAMES = 65536
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# name -> (libsndfile format, subtype, media type, extension, compression level)
+FORMATS = {
+    "flac": ("FLAC", "PCM_24", "audio/flac", ".flac", 0.5),
+    "opus": ("OGG", "OPUS", "audio/ogg", ".opus", 0.3),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg", ".mp3", 0.3),
+}
+MEDIA_TYPES = {
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+}
+
+
+def negotiate_format(fmt: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """
+    Rendition for a request: explicit `format` query wins, else the first
+    compressed type in Accept (by q-value). None means the original WAV.
+    """
+    if fmt:
+        fmt = fmt.lower()
+        if fmt in ("wav", "original"):
+            return None
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}' (expected wav, {', '.join(FORMATS)})")
+        return fmt
+    if not accept:
+        return None
+    ranked = []
+    for i, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        if fields[0].lower() in MEDIA_TYPES and q > 0:
+            ranked.append((-q, i, MEDIA_TYPES[fields[0].lower()]))
+    return min(ranked)[2] if ranked else None
+
+
+def transcode(source: str, dest: str, fmt: str):
+    """Stream `source` into `dest` block by block (Opus input is resampled to 48 kHz if needed)."""
+    container, subtype, _, _, level = FORMATS[fmt]
+    with sf.SoundFile(source) as src:
+        rate = src.samplerate
+        resample = fmt == "opus" and rate not in OPUS_RATES
+        with sf.SoundFile(dest, "w", samplerate=48000 if resample else rate, channels=src.channels,
+                          format=container, subtype=subtype, compression_level=level) as out:
+            if resample:
+                # Rare (uploads); polyphase resampling needs the whole signal
+                from scipy.signal import resample_poly
+                audio = src.read(dtype="float32", always_2d=True)
+                g = np.gcd(48000, rate)
+                out.write(resample_poly(audio, 48000 // g, rate // g, axis=0).astype(np.float32))
+                return
+            while True:
+                block = src.read(BLOCK_FRAMES, dtype="float32", always_2d=True)
+                if not len(block):
+                    break
+                out.write(block)
+
+
+class RenditionCache:
+    """
+    Compressed renditions of generated songs, produced on demand by a small
+    worker pool and kept in a directory next to the originals. Names embed
+    the source's size and mtime, so a re-rendered song never serves a stale
+    rendition. Least recently served renditions are evicted past `max_bytes`.
+    Concurrent requests for the same rendition share one transcode.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, workers: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._entries: "OrderedDict[str, int]" = OrderedDict() # path -> size, LRU order
+        self._scanned = False
+        self.hits = 0
+        self.transcodes = 0
+
+    def _scan(self):
+        # Called with the lock held; rebuilds the LRU index (oldest mtime first)
+        if self._scanned:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif os.path.isfile(path):
+                st = os.stat(path)
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+        self._scanned = True
+
+    def path_for(self, source: str, fmt: str) -> str:
+        st = os.stat(source)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        sig = hashlib.sha1(
+            f"{os.path.abspath(source)}|{st.st_size}|{st.st_mtime_ns}|{fmt}|{RENDITION_VERSION}".encode()
+        ).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{stem}.{sig}{FORMATS[fmt][3]}")
+
+    def request(self, source: str, fmt: str) -> Future:
+        """Future resolving to the rendition's path (immediately done on a cache hit)."""
+        path = self.path_for(source, fmt)
+        with self._lock:
+            self._scan()
+            if path in self._entries and os.path.exists(path):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="renditions", result="hit")
+                done = Future()
+                done.set_result(path)
+                return done
+            CACHE_REQUESTS.inc(cache="renditions", result="miss")
+            future = self._pending.get(path)
+            if future is None:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+                future = self._pool.submit(self._produce, source, fmt, path)
+                self._pending[path] = future
+            return future
+
+    def _produce(self, source: str, fmt: str, path: str) -> str:
+        tmp = path + ".tmp"
+        try:
+            transcode(source, tmp, fmt)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+            log.info(f"Rendered {os.path.basename(path)} ({size / 1024 ** 2:.1f} MB).")
+            with self._lock:
+                self._entries[path] = size
+                self._entries.move_to_end(path)
+                self.transcodes += 1
+                self._evict(keep=path)
+            return path
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def _evict(self, keep: str):
+        total = sum(self._entries.values())
+        for path in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= self._entries.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "transcodes": self.transcodes,
+                "pending": len(self._pending),
+            }
+
+
+renditions = RenditionCache(
+    settings.RENDITION_CACHE_DIR,
+    int(settings.RENDITION_CACHE_MAX_GB * 1024 ** 3),
+    settings.RENDITION_WORKERS,
+)
@@ -0,0 +1,395 @@
+import sys
+import threading
+import time
+import gc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import psutil
+
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import MODEL_LOAD_SECONDS
+
+log = get_logger("ModelResidency")
+
+# Memory pools a model can live in. "vram" is the accelerator (DirectML/CUDA),
+# "ram" is host memory (CPU-resident models and layer-streaming host copies).
+POOLS = ("ram", "vram")
+
+
+class ModelDoesNotFit(Exception):
+    pass
+
+
+class ResidencyEntry:
+    def __init__(self, name: str, loader: Callable[[], Any], unloader: Callable[[Any], None],
+                 pool: str, size_estimate: int, requires: Tuple[str, ...] = (),
+                 sizer: Optional[Callable[[Any], int]] = None):
+        self.name = name
+        self.loader = loader
+        self.unloader = unloader
+        self.sizer = sizer or module_size_bytes
+        self.pool = pool
+        self.size_bytes = size_estimate
+        self.requires = requires
+        self.model = None
+        self.loading: Optional[threading.Event] = None # Set while a loader runs (outside the manager lock)
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+
+    @property
+    def resident(self) -> bool:
+        return self.model is not None
+
+
+def module_size_bytes(obj) -> int:
+    """Sum parameter + buffer bytes of a torch module (0 if not a module)."""
+    total = 0
+    for attr in ("parameters", "buffers"):
+        fn = getattr(obj, attr, None)
+        if not callable(fn):
+            continue
+        try:
+            for t in fn():
+                total += t.numel() * t.element_size()
+        except Exception:
+            return 0
+    return total
+
+
+def _detect_vram_total() -> int:
+    """Best effort total accelerator memory in bytes (configured card size until torch is loaded)."""
+    # Never import torch just for this: the manager is built at API import.
+    # The startup warm-up refreshes the budget once torch is in.
+    torch = sys.modules.get("torch")
+    try:
+        if torch is not None and torch.cuda.is_available():
+            return torch.cuda.get_device_properties(0).total_memory
+    except Exception:
+        pass
+    # DirectML exposes no memory query; fall back to the configured card size.
+    return int(settings.VRAM_TOTAL_GB * 1024 ** 3)
+
+
+class ModelResidencyManager:
+    """
+    Keeps heavy models (HeartMuLa, HeartCodec, AudioSR) warm between jobs.
+
+    Models are registered with a loader/unloader pair and a pool. A model stays
+    resident until it is idle for MODEL_IDLE_TIMEOUT seconds, host memory goes
+    above MEMORY_PRESSURE_PERCENT, or another model needs its room in the
+    pool budget (least recently used idle models are swapped out first).
+    A load that only fits once pinned models are released waits for them
+    (up to MODEL_LOAD_WAIT_SECONDS) and is then refused with ModelDoesNotFit.
+    """
+
+    def __init__(self, ram_budget: Optional[int] = None, vram_budget: Optional[int] = None,
+                 idle_timeout: Optional[float] = None):
+        self._entries: Dict[str, ResidencyEntry] = {}
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock) # Notified when a model is unpinned, evicted or done loading
+        self._budgets = {
+            "ram": ram_budget if ram_budget is not None else
+                int(psutil.virtual_memory().total * settings.RAM_BUDGET_FRACTION),
+            "vram": vram_budget if vram_budget is not None else
+                int(_detect_vram_total() * settings.VRAM_TARGET_USAGE),
+        }
+        self.idle_timeout = idle_timeout if idle_timeout is not None else settings.MODEL_IDLE_TIMEOUT
+        self._reaper = None
+        self._stop = threading.Event()
+
+    # --- Registration ---
+
+    def register(self, name: str, loader: Callable[[], Any], unloader: Callable[[Any], None],
+                 pool: str = "ram", size_estimate: int = 0, requires: Tuple[str, ...] = (),
+                 sizer: Optional[Callable[[Any], int]] = None):
+        """
+        loader: returns the loaded model. unloader: releases it.
+        sizer: measures the loaded model in bytes (defaults to torch module size).
+        requires: entries that must be resident (and stay pinned) alongside this one.
+        """
+        if pool not in POOLS:
+            raise ValueError(f"Unknown pool '{pool}'")
+        with self._lock:
+            existing = self._entries.get(name)
+            if existing and existing.resident:
+                # Re-registration keeps the loaded model; only update hooks.
+                existing.loader, existing.unloader = loader, unloader
+                return
+            self._entries[name] = ResidencyEntry(name, loader, unloader, pool, size_estimate, requires, sizer)
+
+    def set_pool(self, name: str, pool: str):
+        """Move an entry's accounting to another pool (e.g. after device detection)."""
+        with self._lock:
+            self._entries[name].pool = pool
+
+    def set_budget(self, pool: str, budget_bytes: int):
+        with self._lock:
+            self._budgets[pool] = int(budget_bytes)
+            self._enforce_budget(pool, needed=0)
+
+    def refresh_vram_budget(self):
+        """Re-read VRAM_TARGET_USAGE (it can be changed at runtime via /config)."""
+        self.set_budget("vram", int(_detect_vram_total() * settings.VRAM_TARGET_USAGE))
+
+    # --- Access ---
+
+    def is_resident(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return bool(entry and entry.resident)
+
+    def peek(self, name: str):
+        """The model if it is resident, else None. Never loads it and doesn't count as a use."""
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry.model if entry else None
+
+    def load(self, name: str):
+        """
+        Make a model resident (loading and swapping as needed) and return it.
+        The loader runs outside the manager lock, so status/budget calls and
+        other models stay available during a minutes-long load; concurrent
+        callers for the same model wait for the one load in flight.
+        Raises ModelDoesNotFit when the room is still held by pinned models
+        after MODEL_LOAD_WAIT_SECONDS, or the model is larger than the whole
+        vram budget.
+        """
+        deadline = None
+        while True:
+            for dep in self._entries[name].requires:
+                self.load(dep)
+            with self._lock:
+                entry = self._entries[name]
+                if entry.resident:
+                    entry.last_used = time.time()
+                    return entry.model
+                loading = entry.loading
+                deps = [self._entries[dep] for dep in entry.requires]
+                if loading is None and all(dep.resident for dep in deps):
+                    blockers = self._make_room(entry)
+                    if not blockers:
+                        # This caller loads; dependencies stay pinned until it is done
+                        entry.loading = threading.Event()
+                        for dep in deps:
+                            dep.in_use += 1
+                        break
+                    if deadline is None:
+                        deadline = time.time() + settings.MODEL_LOAD_WAIT_SECONDS
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise ModelDoesNotFit(
+                            f"'{name}' needs {entry.size_bytes / 1024 ** 3:.2f} GB of {entry.pool} "
+                            f"still held by {', '.join(blockers)}.")
+                    log.info(f"Deferring load of '{name}' until {', '.join(blockers)} "
+                             f"release {entry.pool} room...")
+                    # Dependencies may be swapped out meanwhile: start over afterwards
+                    self._released.wait(remaining)
+                    continue
+            if loading is not None:
+                # Re-check afterwards: the other load may have failed
+                loading.wait()
+
+        log.info(f"Loading '{name}' into {entry.pool}...")
+        start = time.time()
+        model, loaded = None, False
+        try:
+            model = entry.loader()
+            measured = entry.sizer(model)
+            loaded = True
+        finally:
+            with self._lock:
+                for dep in deps:
+                    dep.in_use = max(0, dep.in_use - 1)
+                event, entry.loading = entry.loading, None
+                if loaded:
+                    entry.model = model
+                    entry.loads += 1
+                    if measured:
+                        entry.size_bytes = measured
+                    entry.last_used = time.time()
+                self._released.notify_all()
+            event.set()
+        MODEL_LOAD_SECONDS.observe(entry.last_used - start, model=name)
+        log.info(f"'{name}' resident ({entry.size_bytes / 1024 ** 3:.2f} GB) in {entry.last_used - start:.2f}s.")
+        with self._lock:
+            # The real size may be larger than the estimate; rebalance others.
+            self._enforce_budget(entry.pool, needed=0, exclude=name)
+        return model
+
+    @contextmanager
+    def use(self, name: str):
+        """Load (if needed) and pin a model for the duration of the block."""
+        while True:
+            self.load(name)
+            with self._lock:
+                pinned = [name] + list(self._entries[name].requires)
+                # Swapped out between the load and the pin: load again
+                if all(self._entries[n].resident for n in pinned):
+                    model = self._entries[name].model
+                    for n in pinned:
+                        self._entries[n].in_use += 1
+                    break
+        try:
+            yield model
+        finally:
+            with self._lock:
+                now = time.time()
+                for n in pinned:
+                    entry = self._entries[n]
+                    entry.in_use = max(0, entry.in_use - 1)
+                    entry.last_used = now
+                self._released.notify_all()
+
+    # --- Eviction ---
+
+    def evict(self, name: str, force: bool = False) -> bool:
+        with self._lock:
+            entry = self._entries.get(name)
+            if not entry or not entry.resident:
+                return False
+            if entry.in_use and not force:
+                log.warning(f"Not evicting '{name}': in use.")
+                return False
+            # Dependents cannot outlive the model they were loaded from.
+            for other in self._entries.values():
+                if name in other.requires and other.resident:
+                    self.evict(other.name, force=force)
+            log.info(f"Evicting '{name}' from {entry.pool}...")
+            model, entry.model = entry.model, None
+            try:
+                entry.unloader(model)
+            except Exception as e:
+                log.error(f"Unloader for '{name}' failed: {e}")
+            del model
+            self._released.notify_all()
+        _free_memory()
+        return True
+
+    def evict_all(self, force: bool = False):
+        for name in list(self._entries):
+            self.evict(name, force=force)
+
+    def evict_idle(self, now: Optional[float] = None) -> list:
+        """Evict models idle for longer than the idle timeout."""
+        now = now or time.time()
+        evicted = []
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if entry.resident and not entry.in_use and now - entry.last_used > self.idle_timeout:
+                    if self.evict(entry.name):
+                        evicted.append(entry.name)
+        return evicted
+
+    def relieve_pressure(self) -> list:
+        """Evict idle models (LRU first) while host memory is above the pressure mark."""
+        evicted = []
+        while psutil.virtual_memory().percent > settings.MEMORY_PRESSURE_PERCENT:
+            victim = self._lru_idle()
+            if victim is None:
+                break
+            self.evict(victim.name)
+            evicted.append(victim.name)
+        return evicted
+
+    def _lru_idle(self, pool: Optional[str] = None, exclude: Optional[str] = None):
+        candidates = [
+            e for e in self._entries.values()
+            if e.resident and not e.in_use and e.name != exclude
+            and (pool is None or e.pool == pool)
+            and not (exclude and e.name in self._entries[exclude].requires)
+        ]
+        return min(candidates, key=lambda e: e.last_used) if candidates else None
+
+    def _used(self, pool: str) -> int:
+        # Loads in flight count too, so two loads can't both claim the same headroom
+        return sum(e.size_bytes for e in self._entries.values()
+                   if (e.resident or e.loading is not None) and e.pool == pool)
+
+    def _enforce_budget(self, pool: str, needed: int, exclude: Optional[str] = None) -> bool:
+        """Swap out idle models (LRU first) until `needed` more bytes fit. False if they still don't."""
+        budget = self._budgets[pool]
+        while self._used(pool) + needed > budget:
+            victim = self._lru_idle(pool, exclude=exclude)
+            if victim is None:
+                if not needed:
+                    # A measured size above its estimate, or a lowered budget
+                    log.warning(f"{pool} budget exceeded ({self._used(pool) / 1024 ** 3:.2f} GB "
+                                f"> {budget / 1024 ** 3:.2f} GB) and nothing idle to swap out.")
+                return False
+            log.info(f"Swapping out '{victim.name}' to stay within the {pool} budget.")
+            self.evict(victim.name)
+        return True
+
+    def _make_room(self, entry: ResidencyEntry) -> list:
+        """
+        Swap out idle models until `entry` fits its pool. Returns the names of
+        the pinned/loading models still in the way (empty when it can load).
+        """
+        if self._enforce_budget(entry.pool, needed=entry.size_bytes, exclude=entry.name):
+            return []
+        blockers = [e.name for e in self._entries.values()
+                    if e.pool == entry.pool and e.name != entry.name and e.name not in entry.requires
+                    and (e.resident or e.loading is not None)]
+        if blockers:
+            return blockers
+        # Nothing else holds the pool: the model alone is larger than the budget
+        size = f"{entry.size_bytes / 1024 ** 3:.2f} GB > {self._budgets[entry.pool] / 1024 ** 3:.2f} GB"
+        if entry.pool == "vram":
+            # Card memory doesn't page: the load would fail halfway through
+            raise ModelDoesNotFit(f"'{entry.name}' is larger than the whole vram budget ({size}).")
+        log.warning(f"'{entry.name}' is larger than the whole ram budget ({size}); loading it anyway.")
+        return []
+
+    # --- Background reaper ---
+
+    def start(self, interval: float = 30.0):
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.evict_idle()
+                    self.relieve_pressure()
+                except Exception as e:
+                    log.error(f"Residency reaper error: {e}")
+
+        self._reaper = threading.Thread(target=run, name="residency-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "budgets": dict(self._budgets),
+                "used": {pool: self._used(pool) for pool in POOLS},
+                "models": {
+                    e.name: {
+                        "resident": e.resident,
+                        "pool": e.pool,
+                        "size_bytes": e.size_bytes,
+                        "in_use": e.in_use,
+                        "idle_seconds": round(time.time() - e.last_used, 1) if e.resident else None,
+                        "loads": e.loads,
+                    }
+                    for e in self._entries.values()
+                },
+            }
+
+
+def _free_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+residency = ModelResidencyManager()
@@ -0,0 +1,342 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+
+log = get_logger("JobScheduler")
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def set_torch_threads(count: int):
+    """torch.set_num_threads for the calling thread (0 = leave torch's default)."""
+    if not count:
+        return
+    try:
+        import torch
+        # Per-thread under OpenMP: only this thread's ops are affected
+        torch.set_num_threads(count)
+    except ImportError:
+        pass
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """Cooperative cancellation flag checked by jobs at safe points (frame boundaries)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled("Cancelled by user.")
+
+
+class Job:
+    def __init__(self, task_id: str, fn: Callable[[CancellationToken], None], priority: str, cost: float, seq: int,
+                 batch_key: Optional[tuple] = None, payload=None):
+        self.task_id = task_id
+        self.fn = fn
+        self.batch_key = batch_key # jobs with equal keys may run together
+        self.payload = payload
+        self.token = CancellationToken()
+        self.priority = priority
+        self.cost = max(cost, 1.0)
+        self.seq = seq
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+
+    def sort_key(self):
+        return (PRIORITIES[self.priority], self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+
+class JobScheduler:
+    """
+    Bounded priority queue in front of a fixed pool of device workers.
+
+    Jobs run in priority order (FIFO within a class). `cost` is a relative
+    size hint (seconds of audio requested); the scheduler learns seconds of
+    wall time per unit of cost from finished jobs to estimate queue ETAs.
+
+    With a batch runner set, a worker that picks up a job carrying a
+    `batch_key` also takes up to `max_batch - 1` queued jobs with the same
+    key and hands them all to the runner in one call.
+
+    `resource` tags what the stage's workers occupy ("accelerator", "cpu");
+    `threads` caps each worker's torch intra-op threads so stages sharing
+    the CPU don't oversubscribe it.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int, max_batch: int = 1,
+                 resource: str = "cpu", threads: Optional[int] = None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.resource = resource
+        self.threads = threads
+        self.max_batch = max(1, max_batch)
+        self._batch_runner: Optional[Callable[[List[Job]], None]] = None
+        self._heap: List[Job] = []
+        self._running: Dict[str, Job] = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._rate: Optional[float] = None # EMA of wall seconds per cost unit
+        self.completed = 0
+
+    # --- Lifecycle ---
+
+    def start(self):
+        with self._cond:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        log.info(f"Started {self.workers} {self.name} worker(s) on {self.resource}"
+                 f"{f' ({self.threads} threads each)' if self.threads else ''}.")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop accepting work; workers exit after their current job."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def set_batch_runner(self, runner: Callable[[List[Job]], None], max_batch: Optional[int] = None):
+        self._batch_runner = runner
+        if max_batch is not None:
+            self.max_batch = max(1, max_batch)
+
+    # --- Submission ---
+
+    def submit(self, task_id: str, fn: Callable[[CancellationToken], None], priority: str = "normal",
+               cost: float = 30.0, batch_key: Optional[tuple] = None, payload=None) -> Job:
+        """Queue `fn(token)`; the job should check `token` at safe points."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of {', '.join(PRIORITIES)})")
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                raise QueueFull(f"{self.name} queue is full ({self.max_queue} jobs)")
+            job = Job(task_id, fn, priority, cost, next(self._seq), batch_key, payload)
+            heapq.heappush(self._heap, job)
+            self._cond.notify()
+        if not self._stopping:
+            self.start()
+        return job
+
+    def _take_batch(self, first: Job) -> List[Job]:
+        """Pop queued jobs that can share `first`'s run (caller holds the lock)."""
+        if first.batch_key is None or self.max_batch < 2 or self._batch_runner is None:
+            return [first]
+        batch = [first]
+        for job in sorted(self._heap):
+            if len(batch) >= self.max_batch:
+                break
+            if job.batch_key == first.batch_key:
+                batch.append(job)
+        if len(batch) > 1:
+            self._heap = [job for job in self._heap if job not in batch]
+            heapq.heapify(self._heap)
+        return batch
+
+    def helper_initializer(self, helpers: int = 1) -> Callable[[], None]:
+        """
+        Thread initializer for threads a job starts (chunk pools, preview
+        decoders): they run this stage's work, so they get its torch thread
+        count, split evenly across `helpers` threads running at once.
+        """
+        threads = max(1, self.threads // max(1, helpers)) if self.threads else 0
+        return lambda: set_torch_threads(threads)
+
+    def _worker(self):
+        set_torch_threads(self.threads)
+        while True:
+            with self._cond:
+                while not self._heap and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                batch = self._take_batch(heapq.heappop(self._heap))
+                started_at = time.time()
+                for job in batch:
+                    job.started_at = started_at
+                    self._running[job.task_id] = job
+                    QUEUE_WAIT_SECONDS.observe(started_at - job.submitted_at, stage=self.name)
+            label = ", ".join(job.task_id for job in batch)
+            try:
+                if len(batch) == 1:
+                    batch[0].fn(batch[0].token)
+                else:
+                    log.info(f"Running {len(batch)} jobs as one batch: {label}")
+                    self._batch_runner(batch)
+            except TaskCancelled:
+                log.info(f"Job {label} cancelled.")
+            except Exception as e:
+                log.error(f"Job {label} raised: {e}")
+            finally:
+                elapsed = time.time() - started_at
+                # Only full runs say anything about throughput
+                finished = [job for job in batch if not job.token.cancelled]
+                with self._cond:
+                    for job in batch:
+                        self._running.pop(job.task_id, None)
+                    if finished:
+                        rate = elapsed / sum(job.cost for job in finished)
+                        self._rate = rate if self._rate is None else 0.7 * self._rate + 0.3 * rate
+                    self.completed += len(batch)
+
+    def cancel(self, task_id: str) -> Optional[str]:
+        """
+        Cancel a job. Returns "queued" if it was removed from the queue,
+        "running" if its token was tripped (it stops at the next check),
+        or None if the scheduler doesn't know the task.
+        """
+        with self._cond:
+            for i, job in enumerate(self._heap):
+                if job.task_id == task_id:
+                    job.token.cancel()
+                    self._heap.pop(i)
+                    heapq.heapify(self._heap)
+                    return "queued"
+            job = self._running.get(task_id)
+            if job is not None:
+                job.token.cancel()
+                return "running"
+        return None
+
+    # --- Introspection ---
+
+    def queued(self) -> List[Job]:
+        with self._cond:
+            return sorted(self._heap)
+
+    def position(self, task_id: str) -> Optional[int]:
+        """0-based position among queued jobs (None if not queued)."""
+        for i, job in enumerate(self.queued()):
+            if job.task_id == task_id:
+                return i
+        return None
+
+    def eta(self, task_id: str) -> Optional[float]:
+        """Estimated seconds until the job starts (None until a job has finished)."""
+        with self._cond:
+            if self._rate is None:
+                return None
+            ahead = []
+            for job in sorted(self._heap):
+                if job.task_id == task_id:
+                    break
+                ahead.append(job)
+            else:
+                return None
+            now = time.time()
+            # Each worker frees up when its running job finishes; queued jobs
+            # ahead of us are then spread across the workers.
+            free_at = sorted(
+                max(0.0, job.cost * self._rate - (now - job.started_at)) for job in self._running.values()
+            )
+            free_at += [0.0] * (self.workers - len(free_at))
+            for job in ahead:
+                free_at[0] += job.cost * self._rate
+                free_at.sort()
+            return round(free_at[0], 1)
+
+    def queue_info(self, task_id: str) -> dict:
+        position = self.position(task_id)
+        if position is None:
+            return {}
+        return {"queue_position": position, "eta_seconds": self.eta(task_id)}
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "resource": self.resource,
+                "threads": self.threads,
+                "queued": len(self._heap),
+                "running": list(self._running),
+                "max_queue": self.max_queue,
+                "max_batch": self.max_batch,
+                "completed": self.completed,
+                "seconds_per_cost_unit": self._rate,
+            }
+
+
+def stage_thread_split(cpu_count: int, generation_on_accelerator: bool, enhance_workers: int):
+    """
+    Divide CPU threads between the generation and enhancement stages.
+    With an accelerator, generation only needs a couple of host threads
+    (sampling, layer uploads) and enhancement gets the rest; on CPU the
+    cores are split evenly. Returns (generation threads, threads per enhance worker).
+    """
+    cpu_count = max(1, cpu_count)
+    generation = min(2, cpu_count) if generation_on_accelerator else max(1, cpu_count // 2)
+    remaining = max(1, cpu_count - generation)
+    return generation, max(1, remaining // max(1, enhance_workers))
+
+
+generation_scheduler = JobScheduler(
+    "generation", settings.GENERATION_WORKERS, settings.GENERATION_QUEUE_SIZE, settings.GENERATION_MAX_BATCH,
+    resource="accelerator",
+)
+# Fed only by finished generations, so it can't hold more than the generation side
+enhancement_scheduler = JobScheduler(
+    "enhancement", settings.ENHANCE_WORKERS, settings.GENERATION_QUEUE_SIZE + settings.GENERATION_WORKERS,
+    resource="cpu",
+)
+
+
+QUEUE_DEPTH.set_function(lambda: {
+    (scheduler.name,): scheduler.stats()["queued"] for scheduler in (generation_scheduler, enhancement_scheduler)
+})
+
+
+def pipeline_stage() -> dict:
+    """What the pipeline is doing right now (for telemetry)."""
+    generation, enhancement = generation_scheduler.stats(), enhancement_scheduler.stats()
+    stages = [name for name, stats in (("generating", generation), ("enhancing", enhancement)) if stats["running"]]
+    return {
+        "stage": "+".join(stages) or "idle",
+        "running": {"generation": generation["running"], "enhancement": enhancement["running"]},
+        "queued": generation["queued"] + enhancement["queued"],
+    }
+
+
+def configure_stage_threads(generation_on_accelerator: bool):
+    """Apply GENERATION_THREADS / ENHANCE_THREADS (0 = automatic split) before workers start."""
+    generation, enhancement = stage_thread_split(
+        os.cpu_count() or 1, generation_on_accelerator, enhancement_scheduler.workers
+    )
+    generation_scheduler.threads = settings.GENERATION_THREADS or generation
+    enhancement_scheduler.threads = settings.ENHANCE_THREADS or enhancement
+    if not generation_on_accelerator:
+        generation_scheduler.resource = "cpu"
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from safetensors import safe_open
+
+from app.config import settings
+from app.utils.file_hash import cached_sha256, file_signature
+from app.utils.logger import get_logger
+
+log = get_logger("ModelSnapshots")
+
+SNAPSHOT_FORMAT = 1
+STAMP_NAME = "snapshot.json"
+
+_DTYPE_CODES = {
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.float32: "F32",
+    torch.float64: "F64",
+}
+_FLOAT_CODES = set(_DTYPE_CODES.values())
+_CODE_SIZES = {
+    "F64": 8, "F32": 4, "F16": 2, "BF16": 2,
+    "I64": 8, "I32": 4, "I16": 2, "I8": 1, "U8": 1, "BOOL": 1,
+}
+
+
+def dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def _source_files(source_dir: Path) -> List[Path]:
+    """Relative paths of model files (hidden files/dirs such as caches are skipped)."""
+    files = []
+    for path in sorted(source_dir.rglob("*")):
+        rel = path.relative_to(source_dir)
+        if path.is_file() and not any(part.startswith(".") for part in rel.parts):
+            files.append(rel)
+    return files
+
+
+def _link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def needs_cast(path: Path, dtype: torch.dtype) -> bool:
+    target = _DTYPE_CODES[dtype]
+    with safe_open(str(path), framework="pt") as f:
+        for name in f.keys():
+            code = f.get_slice(name).get_dtype()
+            if code in _FLOAT_CODES and code != target:
+                return True
+    return False
+
+
+def write_cast_safetensors(src: Path, dst: Path, dtype: torch.dtype):
+    """
+    Rewrite a safetensors file with every floating tensor cast to `dtype`.
+    Streams tensor by tensor, so peak memory is one tensor, not the shard.
+    """
+    target = _DTYPE_CODES[dtype]
+    with safe_open(str(src), framework="pt") as f:
+        names = list(f.keys())
+        header = {}
+        metadata = f.metadata()
+        if metadata:
+            header["__metadata__"] = metadata
+        offset = 0
+        for name in names:
+            sl = f.get_slice(name)
+            shape = list(sl.get_shape())
+            code = target if sl.get_dtype() in _FLOAT_CODES else sl.get_dtype()
+            numel = 1
+            for dim in shape:
+                numel *= dim
+            size = numel * _CODE_SIZES[code]
+            header[name] = {"dtype": code, "shape": shape, "data_offsets": [offset, offset + size]}
+            offset += size
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        # Data section starts 8-byte aligned (the reference writer pads with spaces)
+        header_bytes += b" " * (-len(header_bytes) % 8)
+
+        with open(dst, "wb") as out:
+            out.write(len(header_bytes).to_bytes(8, "little"))
+            out.write(header_bytes)
+            for name in names:
+                tensor = f.get_tensor(name)
+                if tensor.is_floating_point():
+                    tensor = tensor.to(dtype)
+                out.write(tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+
+
+class SnapshotBuilder:
+    """
+    Device/dtype-specific copies of the model directory.
+
+    Each snapshot mirrors MODELS_DIR (so the pipeline loads it unchanged) with
+    the safetensors weights of the listed components pre-cast to their
+    runtime dtype. Files that need no cast are hard-linked. Loading then
+    memory-maps tensors that already have the right dtype: no cast pass and
+    no second copy in RAM.
+
+    A stamp records the hash of every source file; a snapshot whose stamp no
+    longer matches the source (model updated) is rebuilt. Source hashes are
+    reused while a file's size and mtime are unchanged, so checking is cheap.
+    """
+
+    def __init__(self, source_dir: Path, snapshot_root: Path):
+        self.source_dir = Path(source_dir)
+        self.snapshot_root = Path(snapshot_root)
+
+    def path_for(self, tag: str) -> Path:
+        return self.snapshot_root / tag
+
+    def _read_stamp(self, target: Path) -> dict:
+        try:
+            return json.loads((target / STAMP_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _fingerprint(self, hashes: Dict[str, str], dtypes: Dict[str, torch.dtype]) -> str:
+        payload = {
+            "format": SNAPSHOT_FORMAT,
+            "files": hashes,
+            "dtypes": {k: dtype_name(v) for k, v in sorted(dtypes.items())},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def ensure(self, tag: str, dtypes: Dict[str, torch.dtype]) -> Path:
+        """
+        Return the snapshot for `tag`, (re)building it if missing or stale.
+        dtypes: component sub-directory -> dtype its weights are cast to.
+        """
+        target = self.path_for(tag)
+        stamp = self._read_stamp(target)
+        known = stamp.get("files", {})
+        files = _source_files(self.source_dir)
+        if not files:
+            raise FileNotFoundError(f"No model files in {self.source_dir}")
+
+        records = {}
+        for rel in files:
+            key = rel.as_posix()
+            path = self.source_dir / rel
+            records[key] = {**file_signature(path), "sha256": cached_sha256(path, known.get(key))}
+        fingerprint = self._fingerprint({k: r["sha256"] for k, r in records.items()}, dtypes)
+
+        if stamp.get("fingerprint") == fingerprint:
+            if records != known:
+                # Same content, new mtimes (e.g. re-download): refresh the hash cache
+                self._write_stamp(target, fingerprint, records, dtypes)
+            return target
+
+        log.info(f"Building model snapshot '{tag}' (first run or model changed)...")
+        tmp = self.snapshot_root / f"{tag}.tmp"
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        for rel in files:
+            src = self.source_dir / rel
+            dst = tmp / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            dtype = dtypes.get(rel.parts[0]) if len(rel.parts) > 1 else None
+            if dtype is not None and rel.suffix == ".safetensors" and needs_cast(src, dtype):
+                log.info(f"Casting {rel.as_posix()} to {dtype_name(dtype)}...")
+                write_cast_safetensors(src, dst, dtype)
+            else:
+                _link_or_copy(src, dst)
+        self._write_stamp(tmp, fingerprint, records, dtypes)
+
+        old = self.snapshot_root / f"{tag}.old"
+        if target.exists():
+            target.rename(old)
+        tmp.rename(target)
+        if old.exists():
+            shutil.rmtree(old, ignore_errors=True)
+        log.info(f"Model snapshot ready: {target}")
+        return target
+
+    def _write_stamp(self, target: Path, fingerprint: str, records: dict, dtypes: Dict[str, torch.dtype]):
+        stamp = {
+            "format": SNAPSHOT_FORMAT,
+            "fingerprint": fingerprint,
+            "dtypes": {k: dtype_name(v) for k, v in dtypes.items()},
+            "files": records,
+        }
+        (target / STAMP_NAME).write_text(json.dumps(stamp, indent=2), encoding="utf-8")
+
+
+def snapshot_model_path(tag: str, dtypes: Dict[str, torch.dtype], source_dir: Optional[Path] = None) -> Path:
+    """Snapshot directory to load from, falling back to the source on any error."""
+    source_dir = Path(source_dir or settings.MODELS_DIR)
+    try:
+        return SnapshotBuilder(source_dir, settings.MODEL_SNAPSHOT_DIR).ensure(tag, dtypes)
+    except Exception as e:
+        log.warning(f"Model snapshot unavailable ({e}); loading from {source_dir}.")
+        return source_dir
@@ -1,163 +1,265 @@
+import importlib.util
 import os
-import torch
+import tempfile
+import threading
 import numpy as np
 import soundfile as sf
-import librosa
-from pathlib import Path
 from app.utils.logger import get_logger
 from app.config import settings
+from app.engine.residency import residency
+from app.engine.scheduler import TaskCancelled, enhancement_scheduler
+from app.engine.chunked_audio import process_in_chunks
+from app.utils.metrics import AUDIOSR_SECONDS, MASTERING_SECONDS
+from app.utils.task_spans import span
 
-# Import Pedalboard
-try:
-    from pedalboard import Pedalboard, Compressor, Limiter, HighpassFilter, LowShelfFilter, HighShelfFilter, Gain
-    from pedalboard.io import AudioFile
-    HAS_PEDALBOARD = True
-except ImportError:
-    HAS_PEDALBOARD = False
-
-# Import AudioSR
-try:
-    from audiosr import build_model, super_resolution
-    HAS_AUDIOSR = True
-except ImportError:
-    HAS_AUDIOSR = False
+# Optional backends are looked up without importing them (AudioSR pulls in
+# torch); they are imported on first use so the API starts listening fast.
+HAS_PEDALBOARD = importlib.util.find_spec("pedalboard") is not None
+HAS_AUDIOSR = importlib.util.find_spec("audiosr") is not None
 
 log = get_logger("StudioEnhancer")
 
 class StudioEnhancer:
+    # AudioSR settings
+    SR_MODEL = "basic"
+    SR_DDIM_STEPS = 200 # Increased from 100 (User request: "200 steps pls")
+    SR_GUIDANCE_SCALE = 3.5
+    SR_SEED = 42
+    SR_SAMPLE_RATE = 48000 # AudioSR always renders 48 kHz
+    SR_CHUNK_SECONDS = 10.24 # AudioSR's native window; bounds memory per chunk
+    SR_OVERLAP_SECONDS = 0.5 # Crossfaded between neighbouring chunks
+    # Bump when the mastering chain changes so cached renders are invalidated
+    MASTERING_VERSION = 1
+    MASTERING_BLOCK_FRAMES = 65536 # Streamed through the chain; bounds mastering memory
+
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._device = None # Probed on first use (imports torch)
+        self.audiosr_model = None
+        self.mastering_chain = None
+        self.lock = threading.Lock() # One AudioSR job at a time (its chunks may run in parallel)
+
+        # AudioSR shares memory with HeartMuLa; let the residency manager swap it
+        residency.register(
+            "audiosr",
+            loader=self._build_audiosr,
+            unloader=self._release_audiosr,
+            pool="ram", # Moved to "vram" by probe_device() on an accelerator
+            size_estimate=2_000_000_000,
+        )
+
+    @property
+    def device(self):
+        return self.probe_device()
+
+    def probe_device(self):
+        """Pick AudioSR's device once (imports torch) and account it to the matching memory pool."""
+        if self._device is not None:
+            return self._device
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
         # DirectML check for AudioSR (might need CPU if not supported)
         try:
             import torch_directml
-            self.device = torch_directml.device()
+            device = torch_directml.device()
             # AudioSR might not like DirectML, use CPU fallback if needed
         except ImportError:
             pass
-            
+        residency.set_pool("audiosr", "ram" if str(device) == "cpu" else "vram")
+        self._device = device
+        return device
+
+    def _build_audiosr(self):
+        from audiosr import build_model
+
+        log.info("Loading AudioSR model...")
+        # AudioSR: 'basic' model is efficient and good quality
+        self.audiosr_model = build_model(model_name=self.SR_MODEL, device=self.device)
+        log.info("AudioSR model loaded.")
+        return self.audiosr_model
+
+    def _release_audiosr(self, model):
         self.audiosr_model = None
-        self.mastering_chain = None
         
     def _load_models(self):
         """Lazy load models only when needed."""
-        if self.audiosr_model:
-            return
-
-        if HAS_AUDIOSR:
-            log.info("Loading AudioSR model...")
+        if HAS_AUDIOSR and not residency.is_resident("audiosr"):
             try:
-                # AudioSR: 'basic' model is efficient and good quality
-                self.audiosr_model = build_model(model_name="basic", device=self.device)
-                log.info("AudioSR model loaded.")
+                self.probe_device() # Pool accounting must be right before the load
+                residency.load("audiosr")
             except Exception as e:
                 log.error(f"Failed to load AudioSR: {e}")
                 
         if HAS_PEDALBOARD and not self.mastering_chain:
-            # Studio Grade Mastering Chain
-            self.mastering_chain = Pedalboard([
-                # 1. Clean up low end
-                HighpassFilter(cutoff_frequency_hz=30),
-                
-                # 2. Gentle compression (Glue)
-                Compressor(threshold_db=-12, ratio=2.5, attack_ms=30, release_ms=100),
-                
-                # 3. Tonal Balance (Smiley Curve - slight boost to lows and highs)
-                LowShelfFilter(cutoff_frequency_hz=100, gain_db=2.0),
-                HighShelfFilter(cutoff_frequency_hz=10000, gain_db=2.0),
-                
-                # 4. Limiting (Maximize Loudness without clipping)
-                Limiter(threshold_db=-0.5, release_ms=60)
-            ])
+            self.mastering_chain = self.build_mastering_chain()
+
+    @staticmethod
+    def build_mastering_chain():
+        from pedalboard import Pedalboard, Compressor, Limiter, HighpassFilter, LowShelfFilter, HighShelfFilter
+
+        # Studio Grade Mastering Chain
+        return Pedalboard([
+            # 1. Clean up low end
+            HighpassFilter(cutoff_frequency_hz=30),
+            
+            # 2. Gentle compression (Glue)
+            Compressor(threshold_db=-12, ratio=2.5, attack_ms=30, release_ms=100),
+            
+            # 3. Tonal Balance (Smiley Curve - slight boost to lows and highs)
+            LowShelfFilter(cutoff_frequency_hz=100, gain_db=2.0),
+            HighShelfFilter(cutoff_frequency_hz=10000, gain_db=2.0),
+            
+            # 4. Limiting (Maximize Loudness without clipping)
+            Limiter(threshold_db=-0.5, release_ms=60)
+        ])
 
-    def enhance(self, input_path: str, output_path: str, enable_upscale: bool = True):
-        self._load_models()
+    def settings_fingerprint(self, enable_upscale: bool = True) -> dict:
+        """Everything about this stage that changes its output (used in render cache keys)."""
+        return self._fingerprint(HAS_AUDIOSR and enable_upscale, HAS_PEDALBOARD)
+
+    def _fingerprint(self, upscale: bool, mastering: bool) -> dict:
+        return {
+            "audiosr": {
+                "model": self.SR_MODEL,
+                "ddim_steps": self.SR_DDIM_STEPS,
+                "guidance_scale": self.SR_GUIDANCE_SCALE,
+                "seed": self.SR_SEED,
+                "chunk_seconds": self.SR_CHUNK_SECONDS,
+                "overlap_seconds": self.SR_OVERLAP_SECONDS,
+            } if upscale else None,
+            "mastering": self.MASTERING_VERSION if mastering else None,
+        }
+
+    def sr_workers(self) -> int:
+        """Chunks processed concurrently: spread over cores on CPU, one at a time on a GPU."""
+        if settings.ENHANCE_SR_WORKERS > 0:
+            return settings.ENHANCE_SR_WORKERS
+        if str(self.device) != "cpu":
+            return 1
+        return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+    def _upscale_chunk(self, model, chunk: np.ndarray, samplerate: int, index: int):
+        """AudioSR on one in-memory chunk -> ([frames, channels] at 48 kHz, 48000)."""
+        from audiosr import super_resolution
+
+        # super_resolution only takes a file path; hand it a private temp file
+        with tempfile.TemporaryDirectory(prefix="kuno_sr_") as tmp:
+            chunk_path = os.path.join(tmp, f"chunk_{index}.wav")
+            sf.write(chunk_path, chunk, samplerate, subtype="FLOAT")
+            out = super_resolution(
+                model,
+                chunk_path,
+                ddim_steps=self.SR_DDIM_STEPS,
+                guidance_scale=self.SR_GUIDANCE_SCALE,
+                seed=self.SR_SEED + index,
+            )
+        out = np.asarray(out, dtype=np.float32).squeeze()
+        if out.ndim == 1:
+            out = out[:, None]
+        elif out.shape[0] < out.shape[1]:
+            out = out.T # [channels, frames] -> [frames, channels]
+        # AudioSR pads its input up to whole windows; trim back to the chunk length
+        expected = int(round(len(chunk) * self.SR_SAMPLE_RATE / samplerate))
+        return out[:expected], self.SR_SAMPLE_RATE
+
+    def upscale(self, input_path: str, output_path: str, cancel_token=None) -> str:
+        """Chunked AudioSR: input WAV -> output WAV at a caller-chosen path."""
+        workers = self.sr_workers()
+        with self.lock, residency.use("audiosr") as audiosr_model, AUDIOSR_SECONDS.time():
+            return process_in_chunks(
+                input_path,
+                output_path,
+                lambda chunk, sr, index: self._upscale_chunk(audiosr_model, chunk, sr, index),
+                chunk_seconds=self.SR_CHUNK_SECONDS,
+                overlap_seconds=self.SR_OVERLAP_SECONDS,
+                workers=workers,
+                cancel_token=cancel_token,
+                # Chunk threads share the enhancement stage's torch thread budget
+                initializer=enhancement_scheduler.helper_initializer(workers),
+            )
+
+    def enhance(self, input_path: str, output_path: str, enable_upscale: bool = True, cancel_token=None):
+        """
+        AudioSR upscaling then mastering. cancel_token (optional) is checked
+        between chunks. Returns (output_path, fingerprint): the fingerprint
+        covers the stages that actually ran, so a failed upscale that fell back
+        to the raw render can't be cached as an upscaled one.
+        """
+        with span("load"):
+            self._load_models()
         log.info(f"Starting studio enhancement for {input_path}...")
         
         # 1. AudioSR Upscaling (Bandwidth Extension)
-        # Input: Path, Output: Helpers usually save to file, but we might want to pipe
-        # AudioSR 'super_resolution' saves to file.
-        
+        # Deterministic handoff: the SR stage writes next to its input
         temp_upscaled = input_path.replace(".wav", "_sr.wav")
         
         current_input = input_path
+        upscaled = False
         
         if HAS_AUDIOSR and enable_upscale and self.audiosr_model:
             log.info("Running AudioSR Upscaling (High Quality)...")
             try:
-                # AudioSR wrapper typically handles loading/saving
-                # We can use the helper or manual inference
-                super_resolution(
-                    self.audiosr_model,
-                    input_path,
-                    save_path=output_path.replace(".wav", ""), # AudioSR appends suffix sometimes or we handle it
-                    ddim_steps=200, # Increased from 100 (User request: "200 steps pls")
-                    guidance_scale=3.5,
-                    seed=42
-                )
-                
-                # Check for output file
-                # AudioSR file naming can be complex.
-                # Strategy: Look for the newest file in the directory that is not the input or output path
-                # and contains the basename of input.
-                
-                search_dir = os.path.dirname(output_path) or "."
-                input_basename = os.path.basename(input_path).replace(".wav", "")
-                
-                candidates = []
-                for fname in os.listdir(search_dir):
-                    fpath = os.path.join(search_dir, fname)
-                    if input_basename in fname and fpath != input_path and fpath != output_path:
-                        # Check modification time (must be recent)
-                        mtime = os.path.getmtime(fpath)
-                        # Filter likely candidates
-                        candidates.append((fpath, mtime))
-                
-                if candidates:
-                    # Sort by time, newest first
-                    candidates.sort(key=lambda x: x[1], reverse=True)
-                    likely_sr = candidates[0][0]
-                    log.info(f"Found likely AudioSR output: {likely_sr}")
-                    current_input = likely_sr
-                else:
-                    log.warning("Could not locate AudioSR output file. Using original input.")
-                
+                with span("audiosr"):
+                    current_input = self.upscale(input_path, temp_upscaled, cancel_token=cancel_token)
+                upscaled = True
+                log.info(f"AudioSR output: {current_input}")
+            except TaskCancelled:
+                if os.path.exists(temp_upscaled):
+                    os.remove(temp_upscaled)
+                raise
             except Exception as e:
                 log.error(f"AudioSR failed: {e}. Skipping upscaling.")
+                if os.path.exists(temp_upscaled):
+                    os.remove(temp_upscaled)
         
-        # 2. Pedalboard Mastering
+        # 2. Mastering
+        try:
+            with span("mastering"):
+                mastered = self._master(current_input, output_path)
+            return output_path, self._fingerprint(upscaled, mastered)
+        finally:
+            # The SR output is only a handoff between the two stages
+            if current_input == temp_upscaled and os.path.exists(temp_upscaled):
+                os.remove(temp_upscaled)
+
+    def master(self, input_path: str, output_path: str) -> str:
+        """Pedalboard mastering chain (input may be the raw or the upscaled render)."""
+        self._master(input_path, output_path)
+        return output_path
+
+    def _master(self, input_path: str, output_path: str) -> bool:
+        """Returns False when the chain didn't run and the input was copied instead."""
         if HAS_PEDALBOARD and self.mastering_chain:
+            from pedalboard.io import AudioFile
+
             log.info("Running Pedalboard Mastering Chain...")
             try:
-                # Use current_input (which might be the upscaled one if found)
-                # For robustness, check if upscaled exists
-                input_to_master = current_input
-                # If AudioSR succeeded, it created a new file. Let's try to find it.
-                # Common AudioSR outputs: output_path + _out.wav
-                # (Simple logic: if we find a new file that matches pattern, use it. Else use raw)
-                
-                with AudioFile(input_to_master) as f:
-                    audio = f.read(f.frames)
+                # Stream fixed-size blocks reader -> chain -> writer. The chain
+                # keeps its filter/compressor state across blocks (reset=False),
+                # so the result is sample-identical to processing the whole
+                # file at once while memory stays constant. A fresh chain per
+                # job keeps concurrent jobs from sharing state.
+                chain = self.build_mastering_chain()
+                with AudioFile(input_path) as f, MASTERING_SECONDS.time():
                     samplerate = f.samplerate
-                
-                # Process
-                effected = self.mastering_chain(audio, samplerate)
-                
-                # Save (High Quality Float32 to avoid size reduction)
-                # Pedalboard defaults to 16-bit. We force 32-bit float.
-                import soundfile as sf
-                sf.write(output_path, effected.T if len(effected.shape)>1 else effected, samplerate, subtype='FLOAT')
+                    # Save (High Quality Float32 to avoid size reduction)
+                    # Pedalboard defaults to 16-bit. We force 32-bit float.
+                    with sf.SoundFile(output_path, "w", samplerate=int(samplerate), channels=f.num_channels,
+                                      subtype='FLOAT') as out:
+                        while f.tell() < f.frames:
+                            block = f.read(self.MASTERING_BLOCK_FRAMES)
+                            out.write(chain(block, samplerate, reset=False).T)
                     
                 log.info(f"Mastering complete. Saved to {output_path}")
-                return output_path
+                return True
             except Exception as e:
                 log.error(f"Pedalboard failed: {e}")
                 # Fallback to copy
                 import shutil
-                shutil.copy(current_input, output_path)
-                return output_path
+                shutil.copy(input_path, output_path)
+                return False
         else:
             log.warning("Pedalboard not found. Skipping mastering.")
             # Copy input to output
             import shutil
-            shutil.copy(current_input, output_path)
-            return output_path
+            shutil.copy(input_path, output_path)
+            return False
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+import soundfile as sf
+
+from app.config import settings
+from app.engine import analysis
+from app.engine.scheduler import JobScheduler, TaskCancelled, generation_scheduler, enhancement_scheduler
+from app.utils.logger import get_logger
+from app.utils.readiness import Readiness, readiness
+
+log = get_logger("Warmup")
+
+# Short enough to finish in seconds, long enough to run the frame loop and a codec decode
+WARMUP_SONG = {
+    "title": "Warm-up",
+    "genre": "Pop",
+    "structure": [{"type": "Verse", "text": "la la la"}],
+}
+
+
+def _run_on_stage(stage: JobScheduler, name: str, fn, timeout: float):
+    """
+    Run fn(token) on one of the stage's workers and wait for it. torch thread
+    pools are per thread, so priming them has to happen there. On timeout
+    the job is cancelled: fn must check the CancellationToken (the pipeline
+    does at every frame) so a hung warm-up frees the worker for real jobs.
+    """
+    done = threading.Event()
+    outcome = {}
+
+    def job(token):
+        try:
+            fn(token)
+        except TaskCancelled:
+            log.warning(f"{name} warm-up cancelled.")
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    # Low priority: a real request submitted meanwhile goes first
+    stage.submit(f"warmup-{name}", job, priority="low", cost=settings.WARMUP_SECONDS)
+    if not done.wait(timeout):
+        stage.cancel(f"warmup-{name}")
+        raise TimeoutError(f"{name} warm-up did not finish within {timeout:.0f}s")
+    if "error" in outcome:
+        raise outcome["error"]
+
+
+def _test_tone(path: str, seconds: float, sample_rate: int = 48000):
+    """Stereo tone + noise: enough signal for AudioSR, the mastering chain and analysis."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    rng = np.random.RandomState(0)
+    tone = 0.3 * np.sin(2 * np.pi * 220.0 * t)[:, None] + 0.05 * rng.randn(len(t), 2)
+    sf.write(path, tone.astype(np.float32), sample_rate, subtype="FLOAT")
+
+
+def warm_up(heartmula, enhancer, generation_stage: JobScheduler = generation_scheduler,
+            enhancement_stage: JobScheduler = enhancement_scheduler, registry: Readiness = readiness) -> bool:
+    """
+    Load the pipeline and push a tiny synthetic song through generation
+    and a short clip through enhancement (+ analysis), so the first real
+    /generate doesn't pay for model construction, allocator growth and
+    kernel selection. Nothing is written to the library or task store.
+    Returns True when every stage warmed up.
+    """
+    if not settings.WARMUP_ENABLED:
+        registry.set("generation", "skipped")
+        registry.set("enhancement", "skipped")
+        return True
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="kuno_warmup_") as tmp:
+        try:
+            with registry.track("generation"):
+                # Load outside the job so model load time doesn't skew the queue's ETA rate
+                heartmula.load_pipeline()
+                song = dict(WARMUP_SONG, duration_target=settings.WARMUP_SECONDS)
+                # Same code path as a task without a preview subscriber: the pipeline call
+                _run_on_stage(generation_stage, "generation",
+                              lambda token: heartmula.generate(song, os.path.join(tmp, "song.wav"), cancel_token=token),
+                              settings.WARMUP_TIMEOUT)
+        except Exception as e:
+            log.error(f"Generation warm-up failed: {e}")
+            ok = False
+
+        def enhance(token):
+            clip = os.path.join(tmp, "clip.wav")
+            _test_tone(clip, settings.WARMUP_SECONDS)
+            mastered, _ = enhancer.enhance(clip, os.path.join(tmp, "clip_F.wav"),
+                                           enable_upscale=settings.WARMUP_UPSCALE, cancel_token=token)
+            token.raise_if_cancelled()
+            analysis.analyze_file(mastered, os.path.join(tmp, "clip.peaks"))
+
+        try:
+            with registry.track("enhancement"):
+                _run_on_stage(enhancement_stage, "enhancement", enhance, settings.WARMUP_TIMEOUT)
+        except Exception as e:
+            log.error(f"Enhancement warm-up failed: {e}")
+            ok = False
+    return ok
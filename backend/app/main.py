@@ -4,6 +4,14 @@ from app.config import settings
 from app.utils.logger import get_logger
 from app.routers import generation, system
 from app.engine.model_loader import ensure_models_available
+from app.engine.residency import residency
+from app.engine.scheduler import generation_scheduler, enhancement_scheduler, configure_stage_threads, pipeline_stage
+from app.engine.heartmula import accelerator_name
+from app.utils.task_events import task_events
+from app.utils.library import library
+from app.utils.telemetry import telemetry
+from app.utils.readiness import readiness
+from app.engine import warmup
 import asyncio
 
 # ... (omitted)
@@ -36,25 +44,96 @@ async def startup_event():
     # Initialize status
     app.state.status = "initializing"
     
+    # Idle/memory-pressure eviction for warm models
+    residency.start()
+    
+    # One sampler feeds /stats; requests never measure anything themselves
+    telemetry.set_stage_provider(pipeline_stage)
+    telemetry.set_vram_provider(
+        lambda: round(100.0 * residency.status()["used"]["vram"] / (settings.VRAM_TOTAL_GB * 1024 ** 3), 1)
+    )
+    telemetry.start()
+    
+    # Generation threads hand progress events to this loop
+    task_events.attach(asyncio.get_running_loop())
+    
+    # Stage workers start once the device is probed (that imports torch,
+    # which takes seconds) and the weights are verified; until then jobs
+    # wait in the queue
+    generation_scheduler.stop()
+    enhancement_scheduler.stop()
+    
+    # Catch the library catalog up with songs added/removed while we were down,
+    # then analyze songs that have no waveform/loudness sidecar yet
+    asyncio.get_running_loop().run_in_executor(None, generation.sync_library)
+    
     # Run model loading in background so API is responsive immediately
     asyncio.create_task(background_init())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    telemetry.stop()
+    generation_scheduler.stop(timeout=5)
+    enhancement_scheduler.stop(timeout=5)
+    # Write out any batched progress before exiting
+    generation.task_store.close()
+    library.close()
+
+def probe_engine() -> bool:
+    """
+    Import the ML stack and probe the device off the event loop (everything
+    else is served while this runs). Returns True on an accelerator.
+    """
+    try:
+        with readiness.track("device"):
+            accelerated = generation.heartmula.probe_device()
+            generation.enhancer.probe_device()
+            telemetry.device_name = accelerator_name()
+            # CUDA cards report their size once torch is in
+            residency.refresh_vram_budget()
+    except Exception as e:
+        log.error(f"Device probe failed ({e}); running on CPU.")
+        accelerated = False
+    return accelerated
+
+def start_stages(accelerated: bool):
+    """Start the stage workers (only once the model weights are verified)."""
+    # Generation and enhancement run as separate stages: song N+1 generates
+    # while song N is enhanced. Split CPU threads so they don't fight.
+    configure_stage_threads(accelerated)
+    generation_scheduler.start()
+    enhancement_scheduler.start()
+
 async def background_init():
+    loop = asyncio.get_running_loop()
+    accelerated = await loop.run_in_executor(None, probe_engine)
     try:
         log.info("Running background initialization...")
         # ensure_models_available might trigger downloads, which is slow
         # We run it here to not block the server startup
         # use run_in_executor to avoid blocking the event loop with synchronous code
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, ensure_models_available)
-        
-        app.state.status = "ready"
-        log.info("Background initialization complete. System READY.")
+        with readiness.track("models"):
+            await loop.run_in_executor(None, ensure_models_available)
     except Exception as e:
         log.error(f"Model initialization failed: {e}")
+        readiness.set("generation", "skipped")
+        readiness.set("enhancement", "skipped")
         app.state.status = "error"
+        # Stage workers stay stopped: queued jobs would only fail on missing weights
+        return
     
-    log.info("Startup complete. Ready to rock.")
+    # Only now that the weights are verified do jobs start running
+    start_stages(accelerated)
+    
+    # Prime the pipeline so the first /generate doesn't pay for it
+    app.state.status = "warming"
+    warm = await loop.run_in_executor(None, warmup.warm_up, generation.heartmula, generation.enhancer)
+    if warm:
+        app.state.status = "ready"
+        log.info("Background initialization complete. System READY.")
+    else:
+        app.state.status = "error"
+        log.error("Warm-up failed; /api/v1/ready names the component.")
 
 @app.get("/")
 def read_root():
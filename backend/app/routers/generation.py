@@ -1,20 +1,34 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
 from app.engine.heartmula import HeartMuLaService
 # from app.engine.heartcodec import HeartCodecService # Deprecated: Pipeline handles codec
 # from app.engine.enhancer import AudioEnhancer # Deprecated
 from app.engine.studio_enhancer import StudioEnhancer
+from app.engine.preview import previews, wav_stream_header
+from app.engine.render_cache import render_cache, cache_key, link_or_copy
+from app.engine.renditions import renditions, negotiate_format, FORMATS
+from app.engine import analysis
+from app.engine.scheduler import generation_scheduler, enhancement_scheduler, QueueFull, PRIORITIES, TaskCancelled, CancellationToken
 from app.utils.logger import get_logger
+from app.utils.task_store import create_task_store, TERMINAL_STATUSES
+from app.utils.task_logs import task_logs
+from app.utils.library import library
+from app.utils.uploads import store_upload, UploadTooLarge, UnsupportedAudio
+from app.utils.metrics import STAGE_ERRORS, TASKS
+from app.utils.task_spans import task_spans, span
+from app.utils import profiling
+from app.utils.task_events import task_events, format_sse
+from app.config import settings
+import asyncio
 import uuid
 import os
-import glob
-import shutil
-import json
 import sys
 import contextlib
 import re
+import threading
 import time
 
 router = APIRouter()
@@ -49,47 +63,68 @@ class GenerationRequest(BaseModel):
     inspiration: Optional[str] = None
     vocal_processing: Optional[str] = None
     generation_parameters: Optional[dict] = None
+    
+    # Scheduling: "high", "normal" or "low"
+    priority: Optional[str] = "normal"
+    
+    # Fixed seed makes the render reproducible (and cacheable)
+    seed: Optional[int] = None
 
 class GenerationResponse(BaseModel):
     task_id: str
     status: str
     message: str
 
-# Global task store (InMemory but persistent)
-TASKS_FILE = "tasks.json"
+# Global task store (SQLite by default, see TASK_STORE_BACKEND)
+task_store = create_task_store(task_logs)
+task_store.start(ttl_seconds=settings.TASK_TTL_HOURS * 3600)
 
-def load_tasks():
-    if os.path.exists(TASKS_FILE):
-        try:
-            with open(TASKS_FILE, "r") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+def update_task(task_id, data, durable=True):
+    """durable=False batches the write (per-frame progress); status changes stay durable."""
+    task_store.update(task_id, data, durable=durable)
+    # Push subscribers: durable status writes are stage changes, the rest is coalesced progress
+    event_type = "stage" if durable and "status" in data else "progress"
+    task_events.publish(task_id, event_type, data)
 
-def save_tasks():
-    with open(TASKS_FILE, "w") as f:
-        json.dump(TASKS, f)
+# A stage's spans land on the task record when its top-level span closes
+task_spans.sink = lambda task_id, spans: update_task(task_id, {"spans": spans}, durable=False)
 
-TASKS = load_tasks() 
+def catalog_song(path: str, task_id: str, request: "GenerationRequest", completed_at: float):
+    """Add a finished song to the library (never fails the task)."""
+    try:
+        library.record_song(path, task_id, request.dict(), created_at=completed_at)
+    except Exception as e:
+        log.warning(f"Could not catalog {path}: {e}")
 
-def update_task(task_id, data):
-    if task_id not in TASKS:
-        TASKS[task_id] = {}
-    TASKS[task_id].update(data)
-    save_tasks()
+def materialize_cached_render(cached: str, task_id: str, request: "GenerationRequest", completed_at: float) -> str:
+    """Link a cache hit into place as the task's output and catalog it (file + DB I/O)."""
+    _, _, final_path = output_paths(task_id, request.title)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    link_or_copy(cached, final_path)
+    catalog_song(final_path, task_id, request, completed_at)
+    return final_path
 
-import sys
-import contextlib
-import re
-import time
+def library_lookup(task_id: str):
+    """Task record (payload + completion time) for songs the catalog finds on disk (startup reconcile)."""
+    return task_store.get(task_id)
+
+def analyze_song(path: str):
+    """Write the song's waveform/loudness sidecar (never fails the task)."""
+    try:
+        analysis.ensure_analysis(path)
+    except Exception as e:
+        log.warning(f"Could not analyze {path}: {e}")
 
-# ... existing code ...
+def sync_library():
+    """Startup: reconcile the catalog with disk, then backfill missing analysis sidecars."""
+    library.reconcile(library_lookup)
+    if settings.ANALYSIS_BACKFILL:
+        analysis.backfill(library.paths())
 
 class LogCapture:
     def __init__(self, task_id: str):
         self.task_id = task_id
-        self.last_save = 0
+        self.log = task_logs.open(task_id)
         self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
         
     def write(self, text: str):
@@ -98,40 +133,90 @@ class LogCapture:
         sys.__stdout__.flush()
         
         # 2. Process for UI
-        if self.task_id not in TASKS: return
-        
         # Clean ANSI codes for cleaner UI (optional)
         clean_text = self.ansi_escape.sub('', text)
         
-        logs = TASKS[self.task_id].get("logs", [])
-        if not logs: logs.append("")
-        
-        for char in clean_text:
-            if char == '\r':
-                # Carriage return: clear the current line (simulate overwriting)
-                if logs: logs[-1] = ""
-            elif char == '\n':
-                # Newline: commit current line and start new
-                logs.append("")
-            else:
-                # Regular char: append to last line
-                if not logs: logs.append("")
-                logs[-1] += char
-                
-        TASKS[self.task_id]["logs"] = logs
-        
-        # Throttle save to disk (once per second)
-        now = time.time()
-        if now - self.last_save > 1.0:
-            save_tasks()
-            self.last_save = now
+        # Ring buffer handles \r (tqdm redraws) and \n; full log spills to disk
+        committed = self.log.write(clean_text)
+        if committed:
+            task_events.publish(self.task_id, "log", {"lines": committed, "cursor": self.log.total})
+        if self.log.partial:
+            task_events.publish(self.task_id, "log_partial", {"partial": self.log.partial})
 
     def flush(self):
         sys.__stdout__.flush()
 
-def process_generation_task(task_id: str, request: GenerationRequest):
-    capture = LogCapture(task_id)
-    
+_capture_local = threading.local()
+
+class ThreadRoutedStream:
+    """
+    Process-wide stdout/stderr stand-in. Writes from a thread running a task
+    go to that task's LogCapture; everything else goes to the original
+    stream. (contextlib.redirect_stdout is global, so concurrent workers
+    would otherwise capture each other's output.)
+    """
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        capture = getattr(_capture_local, "capture", None)
+        return (capture or self.fallback).write(text)
+
+    def flush(self):
+        capture = getattr(_capture_local, "capture", None)
+        (capture or self.fallback).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+@contextlib.contextmanager
+def capture_task_output(capture: LogCapture):
+    if not isinstance(sys.stdout, ThreadRoutedStream):
+        sys.stdout = ThreadRoutedStream(sys.stdout)
+    if not isinstance(sys.stderr, ThreadRoutedStream):
+        sys.stderr = ThreadRoutedStream(sys.stderr)
+    _capture_local.capture = capture
+    try:
+        yield
+    finally:
+        _capture_local.capture = None
+
+def output_paths(task_id: str, title: str):
+    output_dir = settings.OUTPUT_DIR
+    raw_path = os.path.join(output_dir, f"{task_id}_raw.wav")
+    final_path = os.path.join(output_dir, f"{task_id}_{title.replace(' ', '_')}.wav")
+    return output_dir, raw_path, final_path
+
+def render_key(request: GenerationRequest, enhancer_fingerprint: Optional[dict] = None) -> Optional[str]:
+    """
+    Render cache key: hash of the normalized prompt (what the pipeline actually
+    sees), sampling params, model id and enhancer settings (the configured
+    ones unless enhancer_fingerprint says otherwise). Unseeded requests are
+    non-deterministic and never cached.
+    """
+    if request.seed is None:
+        return None
+    prompt = request.dict()
+    return cache_key({
+        "inputs": HeartMuLaService.build_inputs(prompt),
+        "sampling": HeartMuLaService.sampling_params(prompt),
+        "mastering": prompt.get("mastering"),
+        "model": settings.HEARTMULA_MODEL_ID,
+        "enhancer": enhancer_fingerprint or enhancer.settings_fingerprint(),
+    })
+
+def make_progress_handler(task_id: str):
+    def progress_handler(current, total):
+        pct = int((current / total) * 100)
+        global_progress = 20 + int(pct * 0.5) 
+        
+        # Update status/progress only
+        message = f"Generating audio tokens... {current}/{total} frames"
+        update_task(task_id, {"status": "generating", "message": message, "progress": global_progress}, durable=False)
+        # Note: We rely on tqdm printing to stdout for the granular logs!
+    return progress_handler
+
+def make_status_updater(task_id: str):
     # helper for specific milestones (still useful for "message" field updates)
     def update_status(msg: str, progress: int = None):
          data = {"message": msg}
@@ -140,67 +225,204 @@ def process_generation_task(task_id: str, request: GenerationRequest):
          update_task(task_id, data)
          # We do NOT append to logs here manually anymore, strictly use print()
          print(f"[{task_id}] {msg}")
+    return update_status
+
+def finish_failed_task(task_id: str, error: BaseException, raw_path: str, stage: str):
+    """Terminal bookkeeping shared by both stages (cancelled or failed)."""
+    if isinstance(error, TaskCancelled):
+        TASKS.inc(status="cancelled")
+        print(f"Task {task_id} cancelled.")
+        update_task(task_id, {"status": "cancelled", "message": "Cancelled.", "progress": 0})
+        # Drop partial output; nothing downstream will use it
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    else:
+        TASKS.inc(status="failed")
+        STAGE_ERRORS.inc(stage=stage)
+        print(f"Task {task_id} failed: {error}")
+        import traceback
+        traceback.print_exception(type(error), error, error.__traceback__) # This will be captured!
+        update_task(task_id, {"status": "failed", "message": str(error), "progress": 0})
 
-    # Wrap execution in redirect
-    with contextlib.redirect_stdout(capture), contextlib.redirect_stderr(capture):
+def process_generation_task(task_id: str, request: GenerationRequest, cancel_token: Optional[CancellationToken] = None,
+                            key: Optional[str] = None, generated: bool = False,
+                            generation_error: Optional[BaseException] = None, profile: Optional[str] = None):
+    """
+    Generation stage: tokens -> raw WAV, then hand the task to the
+    enhancement stage so this worker can start the next song. With
+    generated=True the raw audio was already produced by a batched run
+    (process_generation_batch) and only its outcome is replayed here.
+    profile ("cprofile"/"torch") captures a profile of each stage.
+    """
+    cancel_token = cancel_token or CancellationToken()
+    capture = LogCapture(task_id)
+    update_status = make_status_updater(task_id)
+    handed_off = False
+    # Decoding for preview only runs when a client subscribed before now
+    preview = previews.claim(task_id) if not generated else None
+
+    # Route this thread's stdout/stderr (prints, tqdm) into the task log; time the stage
+    # (a batched run already timed its generation in process_generation_batch)
+    with capture_task_output(capture), task_spans.activate(task_id), \
+            contextlib.nullcontext() if generated else span("generation"):
         # Init
         update_task(task_id, {"status": "processing"})
         update_status("Initializing...", 5)
         print(f"Processing task for song: {request.title}")
         
+        output_dir, raw_path, final_path = output_paths(task_id, request.title)
+        
         try:
-            output_dir = "generated_songs"
+            cancel_token.raise_if_cancelled()
             os.makedirs(output_dir, exist_ok=True)
-            raw_path = f"{output_dir}/{task_id}_raw.wav"
-            final_path = f"{output_dir}/{task_id}_{request.title.replace(' ', '_')}.wav"
             
             # 1. Generate
             print("Initializing HeartMuLa pipeline...")
             update_status("Initializing HeartMuLa pipeline...", 10)
             
-            def progress_handler(current, total):
-                pct = int((current / total) * 100)
-                global_progress = 20 + int(pct * 0.5) 
-                
-                # Update status/progress only
-                message = f"Generating audio tokens... {current}/{total} frames"
-                update_task(task_id, {"status": "generating", "message": message, "progress": global_progress})
-                # Note: We rely on tqdm printing to stdout for the granular logs!
-                
-            print("Starting generation sequence...")
-            heartmula.generate(request.dict(), raw_path, video_callback=progress_handler)
+            if generated:
+                print("Generated in a batch with other requests.")
+                if generation_error is not None:
+                    raise generation_error
+            else:
+                print("Starting generation sequence...")
+                with profiling.capture(task_id, "generation", profile):
+                    heartmula.generate(request.dict(), raw_path, video_callback=make_progress_handler(task_id),
+                                       cancel_token=cancel_token, preview=preview)
             print("Generation sequence completed.")
             
-            # 2. Enhance
-            update_status("Enhancing audio (Studio Mode)...", 70)
+            # 2. Enhance (own stage/workers). Status first, so a cancel from here on
+            # also looks for the job in the enhancement queue
+            update_task(task_id, {"status": "waiting_enhancement"})
+            update_status("Waiting for enhancer...", 70)
+            # Cancelled after the last frame: don't start the enhancer
+            cancel_token.raise_if_cancelled()
+            try:
+                enhancement_scheduler.submit(
+                    task_id,
+                    lambda token: process_enhancement_task(task_id, request, token, key=key, profile=profile),
+                    cost=request.duration_target or 30,
+                )
+                handed_off = True
+            except QueueFull:
+                # Can't happen with default sizing; degrade to running it inline
+                print("Enhancement queue full; enhancing in the generation worker.")
+                handed_off = True
+                process_enhancement_task(task_id, request, cancel_token, key=key, capture=capture, profile=profile)
             
-            enhancer.enhance(raw_path, final_path)
+        except Exception as e:
+            finish_failed_task(task_id, e, raw_path, stage="generation")
+        finally:
+            if preview is not None:
+                preview.close() # No-op if the decoder already closed it
+            if not handed_off:
+                if key:
+                    render_cache.finish_inflight(key, task_id)
+                task_logs.close(task_id)
+        # Models stay warm for the next job; the residency manager unloads them
+        # when idle or under memory pressure.
+
+def process_enhancement_task(task_id: str, request: GenerationRequest, cancel_token: Optional[CancellationToken] = None,
+                             key: Optional[str] = None, capture: Optional[LogCapture] = None,
+                             profile: Optional[str] = None):
+    """Enhancement stage: AudioSR + mastering, cache the render, complete the task."""
+    cancel_token = cancel_token or CancellationToken()
+    capture = capture or LogCapture(task_id)
+    update_status = make_status_updater(task_id)
+    _, raw_path, final_path = output_paths(task_id, request.title)
+    
+    with capture_task_output(capture), task_spans.activate(task_id), \
+            profiling.capture(task_id, "enhancement", profile):
+        try:
+            with span("enhancement"):
+                cancel_token.raise_if_cancelled()
+                update_task(task_id, {"status": "enhancing"})
+                update_status("Enhancing audio (Studio Mode)...", 75)
+                
+                _, ran = enhancer.enhance(raw_path, final_path, cancel_token=cancel_token)
+                
+                if key:
+                    # Keyed by what actually ran: a fallback render must not answer for the full one
+                    ran_key = render_key(request, ran)
+                    if ran_key != key:
+                        log.warning(f"Enhancement for {task_id} skipped a stage; caching it as {ran_key[:12]}.")
+                    render_cache.put(ran_key, final_path)
+                update_status("Analyzing...", 95)
+                with span("analysis"):
+                    analyze_song(final_path)
+                completed_at = time.time()
+                catalog_song(final_path, task_id, request, completed_at)
             
+            TASKS.inc(status="completed")
             print(f"Task completed successfully. Final output: {final_path}")
-            update_task(task_id, {"status": "completed", "message": "Ready to play.", "progress": 100})
-            
+            update_task(task_id, {"status": "completed", "message": "Ready to play.", "progress": 100, "output": final_path,
+                                  "completed_at": completed_at, "spans": task_spans.get(task_id)})
         except Exception as e:
-            print(f"Task {task_id} failed: {e}")
-            import traceback
-            traceback.print_exc() # This will be captured!
-            update_task(task_id, {"status": "failed", "message": str(e), "progress": 0})
-            update_task(task_id, {"status": "failed", "message": str(e), "progress": 0})
-            save_tasks()
+            finish_failed_task(task_id, e, raw_path, stage="enhancement")
         finally:
-            # Ensure VRAM is always cleaned up
-            heartmula.reset()
+            if key:
+                render_cache.finish_inflight(key, task_id)
+            task_logs.close(task_id)
+
+def process_generation_batch(jobs):
+    """
+    Scheduler batch runner: batched frame loops for several compatible
+    requests, then enhancement per task as usual. Each task is handed to the
+    enhancement stage as soon as its own song is decoded.
+    """
+    items = []
+    for job in jobs:
+        request, _ = job.payload
+        output_dir, raw_path, _ = output_paths(job.task_id, request.title)
+        os.makedirs(output_dir, exist_ok=True)
+        update_task(job.task_id, {"status": "processing", "message": f"Generating in a batch of {len(jobs)}...",
+                                  "progress": 10})
+        items.append({
+            "task_id": job.task_id,
+            "prompt_dict": request.dict(),
+            "output_path": raw_path,
+            "video_callback": make_progress_handler(job.task_id),
+            "cancel_token": job.token,
+            "preview": previews.claim(job.task_id),
+        })
+    
+    handed_off = set()
+    
+    def hand_off(index: int, error: Optional[BaseException]):
+        job = jobs[index]
+        request, key = job.payload
+        handed_off.add(index)
+        process_generation_task(job.task_id, request, job.token, key=key, generated=True, generation_error=error)
+    
+    try:
+        with task_spans.activate(*[job.task_id for job in jobs]), span("generation", batch=len(jobs)):
+            heartmula.generate_batch(items, on_result=hand_off)
+    except Exception as e:
+        for index in range(len(jobs)):
+            if index not in handed_off:
+                hand_off(index, e)
+
+generation_scheduler.set_batch_runner(process_generation_batch)
 
 @router.post("/generate", response_model=GenerationResponse)
-async def generate_song(request: GenerationRequest, background_tasks: BackgroundTasks):
+async def generate_song(request: GenerationRequest, profile: Optional[str] = None, preview: bool = False):
+    """
+    profile=cprofile|torch captures a profile of each stage (GET /profile/{task_id}).
+    preview=true subscribes to the live preview (GET /preview/{task_id}) before
+    the job can start, so it is decoded even when the queue is empty.
+    """
 
     from app.utils.project_state import save_project_state
     
+    priority = request.priority or "normal"
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    if profile is not None and profile not in profiling.PROFILE_MODES:
+        raise HTTPException(status_code=422, detail=f"profile must be one of {', '.join(profiling.PROFILE_MODES)}")
+    
     task_id = str(uuid.uuid4())
     log.info(f"Received generation request. ID: {task_id}")
     
-    # Init Status with empty logs
-    update_task(task_id, {"status": "queued", "message": "Waiting for worker...", "progress": 0, "logs": []})
-
     # Update Shared Project State IMMEDIATELY so UI reflects it
     new_state = {
         "title": request.title,
@@ -211,9 +433,93 @@ async def generate_song(request: GenerationRequest, background_tasks: Background
     }
     save_project_state(new_state)
     
-    background_tasks.add_task(process_generation_task, task_id, request)
+    # A profiled request must actually render: no cache, no sharing
+    key = render_key(request) if profile is None else None
+    if key:
+        cached = render_cache.get(key)
+        if cached:
+            completed_at = time.time()
+            final_path = await run_in_threadpool(materialize_cached_render, cached, task_id, request, completed_at)
+            log.info(f"Render cache hit for {task_id} ({key[:12]}).")
+            TASKS.inc(status="completed")
+            update_task(task_id, {"status": "completed", "message": "Ready to play.", "progress": 100,
+                                  "output": final_path, "completed_at": completed_at, "cache_key": key,
+                                  "cache_hit": True})
+            return GenerationResponse(task_id=task_id, status="completed", message="Served from render cache.")
+        
+        leader = render_cache.join_inflight(key, task_id)
+        if leader:
+            log.info(f"Identical render already in flight; sharing task {leader}.")
+            return GenerationResponse(task_id=leader, status="queued", message="Joined identical in-flight render.")
+    
+    # Init Status
+    update_task(task_id, {"status": "queued", "message": "Waiting for worker...", "progress": 0, "priority": priority,
+                          "cache_key": key, "request": request.dict(), "profile": profile})
+    if preview and settings.PREVIEW_STREAMING:
+        previews.subscribe(task_id)
+    # Tokenizes the prompt, so off the event loop
+    batch_key = await run_in_threadpool(heartmula.batch_key, request.dict()) if profile is None else None
+    
+    try:
+        # Single device queue: jobs never share the pipeline concurrently
+        generation_scheduler.submit(
+            task_id,
+            lambda token: process_generation_task(task_id, request, token, key=key, profile=profile),
+            priority=priority,
+            cost=request.duration_target or 30,
+            # Compatible queued requests may share one batched frame loop (GENERATION_MAX_BATCH);
+            # a profile should only contain its own task
+            batch_key=batch_key,
+            payload=(request, key),
+        )
+    except QueueFull as e:
+        if key:
+            render_cache.finish_inflight(key, task_id)
+        buffer = previews.get(task_id)
+        if buffer is not None:
+            buffer.close()
+        update_task(task_id, {"status": "failed", "message": str(e)})
+        raise HTTPException(status_code=429, detail=str(e))
+
     return GenerationResponse(task_id=task_id, status="queued", message="Started.")
 
+@router.delete("/tasks/{task_id}")
+async def cancel_task(task_id: str):
+    """
+    Cancel a queued or running generation. Running jobs stop at the next
+    frame boundary and skip enhancement; the process and warm models stay up.
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task.get("status") in ("waiting_enhancement", "enhancing"):
+        # Handed off: the enhancement job holds the live token while the generation job unwinds
+        outcome = enhancement_scheduler.cancel(task_id) or generation_scheduler.cancel(task_id)
+    else:
+        outcome = generation_scheduler.cancel(task_id) or enhancement_scheduler.cancel(task_id)
+    if outcome == "queued":
+        if task.get("cache_key"):
+            render_cache.finish_inflight(task["cache_key"], task_id)
+        preview = previews.get(task_id)
+        if preview is not None:
+            preview.close() # Release clients waiting for a job that won't run
+        # Queued for enhancement: the raw render and open log are ours to clean up
+        _, raw_path, _ = output_paths(task_id, "")
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        task_logs.close(task_id)
+        TASKS.inc(status="cancelled")
+        stage = "enhancement" if task.get("status") == "waiting_enhancement" else "start"
+        update_task(task_id, {"status": "cancelled", "message": f"Cancelled before {stage}.", "progress": 0})
+        return {"task_id": task_id, "status": "cancelled"}
+    if outcome == "running":
+        update_task(task_id, {"message": "Cancelling..."})
+        return {"task_id": task_id, "status": "cancelling"}
+    if task.get("status") in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Task already {task['status']}")
+    raise HTTPException(status_code=409, detail="Task is not active")
+
 @router.get("/project")
 async def get_current_project():
     from app.utils.project_state import load_project_state
@@ -223,46 +529,299 @@ async def get_current_project():
     return state
     
 @router.get("/status/{task_id}")
-async def get_status(task_id: str):
-    return TASKS.get(task_id, {"status": "unknown", "message": "Task not found", "progress": 0, "logs": []})
+async def get_status(task_id: str, cursor: Optional[int] = None, limit: int = 200):
+    """
+    Task record plus logs. Pass the returned `log_cursor` back as `cursor` to
+    get only lines committed since the last poll; `log_partial` is the line
+    currently being written (e.g. the live tqdm bar). Without a cursor the
+    last `limit` lines are returned with the partial line appended.
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        return {"status": "unknown", "message": "Task not found", "progress": 0, "logs": []}
+    
+    logs = task_logs.read(task_id, cursor=cursor, limit=min(limit, 1000))
+    if logs is None:
+        # Legacy records carried their logs inline
+        logs = {"lines": task.get("logs", []), "cursor": len(task.get("logs", [])), "partial": "", "truncated": False}
+    
+    lines = logs["lines"]
+    if cursor is None and logs["partial"]:
+        lines = lines + [logs["partial"]]
+    spans = task_spans.get(task_id)
+    if spans:
+        task["spans"] = spans # Live, including spans still open
+    if task.get("status") == "queued":
+        task.update(generation_scheduler.queue_info(task_id))
+    elif task.get("status") == "waiting_enhancement":
+        task.update(enhancement_scheduler.queue_info(task_id))
+    task.update({
+        "logs": lines,
+        "log_cursor": logs["cursor"],
+        "log_partial": logs["partial"],
+        "log_truncated": logs["truncated"],
+    })
+    return task
 
-@router.get("/library")
-async def get_library():
-    """List all generated songs."""
-    output_dir = "generated_songs"
-    if not os.path.exists(output_dir):
-        return []
+def _snapshot_event(task_id: str, task: dict) -> dict:
+    data = {k: v for k, v in task.items() if k != "logs"}
+    logs = task_logs.read(task_id, limit=0)
+    if logs:
+        data["log_cursor"] = logs["cursor"]
+    return {"task_id": task_id, "type": "snapshot", "data": data}
+
+async def _event_stream(request: Request, sub, initial: list, close_when_done: bool):
+    try:
+        for event in initial:
+            yield format_sse(event)
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+            if close_when_done and event["type"] == "stage" and event["data"].get("status") in TERMINAL_STATUSES:
+                break
+    finally:
+        task_events.unsubscribe(sub)
+
+@router.get("/events/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    """
+    Server-Sent Events for one task: a `snapshot`, then `stage`, coalesced
+    `progress`, `log` (new lines + cursor) and `log_partial` events. The
+    stream ends after the task reaches a terminal status.
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    sub = task_events.subscribe([task_id])
+    # Re-read after subscribing so no stage change slips between the two
+    task = task_store.get(task_id)
+    snapshot = _snapshot_event(task_id, task)
+    done = task.get("status") in TERMINAL_STATUSES
+    if done:
+        task_events.unsubscribe(sub)
+        return StreamingResponse(iter([format_sse(snapshot)]), media_type="text/event-stream")
+    return StreamingResponse(
+        _event_stream(request, sub, [snapshot], close_when_done=True),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/events")
+async def stream_all_events(request: Request, task_ids: Optional[str] = None):
+    """Multi-task SSE stream for dashboards (comma-separated task_ids, or every task)."""
+    ids = [t for t in task_ids.split(",") if t] if task_ids else None
+    sub = task_events.subscribe(ids)
+    initial = []
+    for task_id in ids or []:
+        task = task_store.get(task_id)
+        if task is not None:
+            initial.append(_snapshot_event(task_id, task))
+    return StreamingResponse(
+        _event_stream(request, sub, initial, close_when_done=False),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/preview/{task_id}")
+async def stream_preview(task_id: str, request: Request):
+    """
+    Raw (pre-enhancement) audio of a running generation as a chunked WAV
+    stream (PCM16), decoded while tokens are still being generated. Only
+    tasks with a subscriber are decoded: connect while the task is queued
+    (or submit it with preview=true). The stream starts with the first
+    decoded chunk and ends when generation finishes.
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    buffer = previews.get(task_id)
+    if buffer is None:
+        if not settings.PREVIEW_STREAMING or task.get("status") != "queued":
+            raise HTTPException(status_code=404, detail="No preview for this task")
+        # Loses to a job that starts first: that leaves a closed buffer -> 404 below
+        buffer = previews.subscribe(task_id)
     
-    files = glob.glob(f"{output_dir}/*.wav")
-    # Filter out raw files if you want only finalized ones
-    # files = [f for f in files if "_raw" not in f]
+    while not buffer.closed and buffer.sample_rate is None:
+        if await request.is_disconnected():
+            return Response(status_code=204)
+        await run_in_threadpool(buffer.wait_for_format, 5.0)
+    if buffer.sample_rate is None:
+        raise HTTPException(status_code=404, detail="Preview unavailable for this task")
     
-    songs = []
-    for f in files:
-        filename = os.path.basename(f)
-        songs.append({
-            "filename": filename,
-            "path": f,
-            "size": os.path.getsize(f)
-        })
+    async def body():
+        yield wav_stream_header(buffer.sample_rate, buffer.channels)
+        offset = 0
+        while not await request.is_disconnected():
+            data = await run_in_threadpool(buffer.read, offset, 1.0)
+            if data:
+                offset += len(data)
+                yield data
+            elif buffer.closed:
+                break
+    
+    return StreamingResponse(body(), media_type="audio/wav", headers={"Cache-Control": "no-store"})
+
+@router.get("/queue")
+async def get_queue():
+    """Scheduler state: queued jobs in run order with their ETAs (generation stage), plus the enhancement stage."""
+    stats = generation_scheduler.stats()
+    stats["jobs"] = [
+        {"task_id": job.task_id, "priority": job.priority, "eta_seconds": generation_scheduler.eta(job.task_id)}
+        for job in generation_scheduler.queued()
+    ]
+    stats["enhancement"] = enhancement_scheduler.stats()
+    stats["enhancement"]["jobs"] = [
+        {"task_id": job.task_id, "eta_seconds": enhancement_scheduler.eta(job.task_id)}
+        for job in enhancement_scheduler.queued()
+    ]
+    return stats
+
+@router.get("/cache")
+async def get_render_cache_stats():
+    return {**render_cache.stats(), "renditions": renditions.stats()}
+
+@router.get("/tasks")
+async def list_tasks(status: Optional[str] = None, limit: int = 50):
+    """Recent tasks, optionally filtered by status (indexed lookup)."""
+    tasks = task_store.list(status=status, limit=min(limit, 500))
+    # Keep listings light: logs are only returned by /status
+    return [{k: v for k, v in t.items() if k != "logs"} for t in tasks]
+
+@router.get("/library")
+async def get_library(response: Response, offset: int = 0, limit: int = 100, sort: str = "created_at",
+                      order: str = "desc", q: Optional[str] = None):
+    """
+    Finished songs from the library catalog, one page at a time. `q` searches
+    title, genre, tags and lyrics; the total match count is in X-Total-Count.
+    Raw/intermediate renders are listed under each song's `artifacts`.
+    """
+    try:
+        total, songs = await run_in_threadpool(library.list, offset, min(limit, 500), sort, order, q)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    response.headers["X-Total-Count"] = str(total)
+    for song in songs:
+        song["path"] = os.path.join(library.output_dir, song["filename"])
     return songs
 
-@router.get("/audio/{filename}")
-async def get_audio_file(filename: str):
-    """Serve an audio file."""
-    file_path = os.path.join("generated_songs", filename)
-    if not os.path.exists(file_path):
+def not_modified(request_headers, etag: str, last_modified: str) -> bool:
+    """Conditional GET check (If-None-Match wins over If-Modified-Since)."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        from email.utils import parsedate
+        since, modified = parsedate(if_modified_since), parsedate(last_modified)
+        return since is not None and modified is not None and since >= modified
+    return False
+
+def song_path(filename: str) -> str:
+    """Path of a file in the output dir; 404 for anything outside it."""
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+    file_path = os.path.join(settings.OUTPUT_DIR, filename)
+    if not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, media_type="audio/wav")
+    return file_path
+
+@router.get("/audio/{filename}")
+async def get_audio_file(filename: str, request: Request, format: Optional[str] = None):
+    """
+    Serve an audio file, or a compressed rendition of it (flac/opus/mp3)
+    chosen by `?format=` or the Accept header. Supports Range requests and
+    conditional GETs (ETag / Last-Modified -> 304).
+    """
+    file_path = song_path(filename)
+    try:
+        fmt = negotiate_format(format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    media_type = "audio/wav"
+    if fmt is not None:
+        try:
+            file_path = await asyncio.wrap_future(renditions.request(file_path, fmt))
+        except Exception as e:
+            log.error(f"Rendition {fmt} of {filename} failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Could not encode {fmt}")
+        media_type = FORMATS[fmt][2]
+
+    response = FileResponse(file_path, media_type=media_type, stat_result=os.stat(file_path),
+                            headers={"Vary": "Accept"})
+    if not_modified(request.headers, response.headers["etag"], response.headers["last-modified"]):
+        return Response(status_code=304, headers={
+            k: response.headers[k] for k in ("etag", "last-modified", "vary", "accept-ranges")
+        })
+    return response
+
+@router.get("/analysis/{filename}")
+async def get_analysis(filename: str):
+    """Integrated loudness, true peak and spectral summary of a song (analyzed on first request)."""
+    file_path = song_path(filename)
+    try:
+        header = await run_in_threadpool(analysis.ensure_analysis, file_path)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not analyze {filename}: {e}")
+    return analysis.summary(header)
+
+@router.get("/waveform/{filename}")
+async def get_waveform(filename: str, pixels: int = 1000, start: float = 0.0, end: Optional[float] = None):
+    """
+    Min/max waveform peaks, one pair per pixel, over [start, end) seconds.
+    Served from the precomputed peak pyramid, so cost depends on `pixels`,
+    not on track length or zoom.
+    """
+    file_path = song_path(filename)
+    try:
+        await run_in_threadpool(analysis.ensure_analysis, file_path)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not analyze {filename}: {e}")
+    return await run_in_threadpool(analysis.read_waveform, analysis.sidecar_path(file_path),
+                                   min(max(pixels, 1), 20000), start, end)
+
+@router.get("/profile/{task_id}")
+async def get_profiles(task_id: str):
+    """Profiler captures of a task started with POST /generate?profile=..."""
+    captures = profiling.list_profiles(task_id)
+    if not captures:
+        raise HTTPException(status_code=404, detail="No profile captured for this task")
+    for capture in captures:
+        capture["url"] = f"/api/v1/profile/{task_id}/{capture['stage']}"
+    return captures
+
+@router.get("/profile/{task_id}/{stage}")
+async def download_profile(task_id: str, stage: str):
+    for capture in profiling.list_profiles(task_id):
+        if capture["stage"] == stage:
+            media_type = "application/json" if capture["mode"] == "torch" else "application/octet-stream"
+            return FileResponse(os.path.join(settings.PROFILE_DIR, capture["filename"]), media_type=media_type,
+                                filename=capture["filename"])
+    raise HTTPException(status_code=404, detail="Profile not found")
 
 @router.post("/upload_audio")
-async def upload_audio(file: UploadFile = File(...)):
-    """Handle vocal input upload."""
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, f"{uuid.uuid4()}_{file.filename}")
+async def upload_audio(request: Request, file: UploadFile = File(...)):
+    """
+    Handle vocal input upload. Streamed to disk in chunks and stored by
+    content hash, so re-uploading the same audio reuses the stored file.
+    """
+    max_bytes = int(settings.UPLOAD_MAX_MB * 1024 * 1024)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + 64 * 1024:
+        # Reject obviously oversized bodies before reading them (64 KB of multipart overhead allowed)
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {settings.UPLOAD_MAX_MB:g} MB")
+    try:
+        stored = await store_upload(file, settings.UPLOAD_DIR, max_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedAudio as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        await file.close()
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    return {"filename": file.filename, "status": "uploaded", "path": file_path}
+    return {"filename": file.filename, "status": "uploaded", **stored}
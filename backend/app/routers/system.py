@@ -1,48 +1,63 @@
 from fastapi import APIRouter, HTTPException, Request, BackgroundTasks
-import psutil
-import torch
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from pathlib import Path
 from app.utils.logger import get_logger
 from app.engine.heartmula import HeartMuLaService
+from app.engine.residency import residency
+from app.utils.telemetry import telemetry
+from app.utils.metrics import metrics
+from app.utils.readiness import readiness
 import os
-import asyncio
 import time
+from typing import Optional
 
 router = APIRouter()
 log = get_logger("SystemRouter")
 
 @router.get("/stats")
-async def get_system_stats(request: Request):
+async def get_system_stats(request: Request, history: Optional[float] = None):
     """
-    Returns system utilization stats for the frontend monitor.
+    Returns system utilization stats for the frontend monitor, from the
+    background telemetry sampler (no measuring per request). Pass
+    `history` (seconds) to also get the samples of that window.
     """
     try:
-        cpu_usage = psutil.cpu_percent(interval=None)
-        memory = psutil.virtual_memory()
-        ram_usage = memory.percent
-        
-        # GPU Stats (Estimates for DirectML/AMD)
-        gpu_usage = 0 
-        vram_usage = 0
-        
         # Get status from app state if available, else default to ready
         status = getattr(request.app.state, "status", "ready")
+        sample = telemetry.latest()
+        if sample is None:
+            # Sampler not started (e.g. imported without the app's startup)
+            sample = telemetry.record()
         
-        return {
-            "cpu": cpu_usage,
-            "ram": ram_usage,
-            "gpu": gpu_usage, 
-            "vram": vram_usage,
-            "gpu_name": "AMD Radeon RX 6600 XT",
-            "status": status
+        response = {
+            "cpu": sample["cpu"],
+            "ram": sample["ram"],
+            "gpu": sample["gpu"],
+            "vram": sample["vram"],
+            "gpu_name": telemetry.device_name,
+            "status": status,
+            "sample": sample,
         }
+        if history:
+            response["history"] = telemetry.history(min(history, telemetry.interval * telemetry.samples.maxlen))
+        return response
     except Exception as e:
         log.error(f"Error getting stats: {e}")
         return {"error": str(e), "status": "error"}
 
+@router.get("/ready")
+async def get_readiness(request: Request):
+    """
+    Startup progress per component (device, models, generation, enhancement).
+    Answering at all means the API is up; `ready` means the engine is
+    verified and warm. status: initializing -> warming -> ready (or error).
+    """
+    status = getattr(request.app.state, "status", "initializing")
+    return {"status": status, "ready": status == "ready", "components": readiness.snapshot()}
+
 from app.config import settings
 from pydantic import BaseModel
-from typing import Optional
 
 
 @router.get("/config")
@@ -70,10 +85,26 @@ async def update_config(config: ConfigUpdate):
         settings.USE_CPU_DECODING = config.use_cpu_decoding
     if config.vram_target is not None:
         settings.VRAM_TARGET_USAGE = config.vram_target
+        # May swap models out; keep it off the event loop
+        await run_in_threadpool(residency.refresh_vram_budget)
     
     return {"status": "updated", "config": await get_config()}
 
 
+@router.get("/models")
+async def get_model_residency():
+    """Which models are warm, their memory pool and the pool budgets."""
+    status = await run_in_threadpool(residency.status)
+    streamer = HeartMuLaService().streamer
+    status["layer_streaming"] = streamer.stats() if streamer is not None else None
+    return status
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Pipeline metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 def kill_process():
     """Wait briefly then force kill the process."""
@@ -89,7 +120,8 @@ async def reset_system(background_tasks: BackgroundTasks):
     """
     try:
         service = HeartMuLaService()
-        service.reset()
+        # reset() waits for a running generation; keep the event loop free
+        await run_in_threadpool(service.reset)
         
         # Trigger Uvicorn Reload by touching main.py (Standard method)
         current_file = Path(__file__).resolve()
@@ -0,0 +1,34 @@
+import hashlib
+import os
+from typing import Dict, Optional
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def sha256_file(path, chunk_size: int = CHUNK_SIZE) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_signature(path) -> Dict[str, int]:
+    """Cheap change detector: size + mtime (ns)."""
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def cached_sha256(path, cached: Optional[dict]) -> str:
+    """
+    Reuse a previously recorded hash when size and mtime still match
+    (`cached` holds size / mtime_ns / sha256), otherwise hash the file.
+    """
+    if cached and cached.get("sha256") and file_signature(path) == {
+        "size": cached.get("size"), "mtime_ns": cached.get("mtime_ns")
+    }:
+        return cached["sha256"]
+    return sha256_file(path)
@@ -0,0 +1,277 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import soundfile as sf
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+log = get_logger("Library")
+
+TASK_FILE = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_(.+)\.wav$")
+SORT_COLUMNS = ("created_at", "title", "genre", "bpm", "duration", "size")
+COLUMNS = ("filename", "task_id", "title", "genre", "bpm", "duration", "sample_rate", "size", "mtime_ns",
+           "created_at", "tags", "lyrics", "artifacts")
+
+
+def classify(filename: str) -> Tuple[Optional[str], str]:
+    """(task id or None, kind) of a file in the output dir; kind is "song", "raw" or "intermediate"."""
+    match = TASK_FILE.match(filename)
+    if not match:
+        return None, "song"
+    suffix = match.group(2)
+    if suffix == "raw":
+        return match.group(1), "raw"
+    if suffix.endswith("_sr"):
+        return match.group(1), "intermediate" # AudioSR scratch file of a running enhancement
+    return match.group(1), "song"
+
+
+def audio_info(path: str) -> Dict[str, Any]:
+    try:
+        info = sf.info(path)
+        return {"duration": round(info.duration, 3), "sample_rate": info.samplerate}
+    except Exception:
+        return {"duration": None, "sample_rate": None}
+
+
+class LibraryCatalog:
+    """
+    Persistent index of finished songs (SQLite, WAL) so listing the library
+    never touches the output directory. Rows are written when a task
+    completes; `reconcile()` catches up with files added or removed while
+    the server was down. Text search uses FTS5 over title, genre, tags and
+    lyrics where SQLite has it, and LIKE otherwise.
+    """
+
+    def __init__(self, path: str, output_dir: str):
+        self.path = path
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS songs ("
+            " filename TEXT PRIMARY KEY,"
+            " task_id TEXT,"
+            " title TEXT,"
+            " genre TEXT,"
+            " bpm INTEGER,"
+            " duration REAL,"
+            " sample_rate INTEGER,"
+            " size INTEGER,"
+            " mtime_ns INTEGER,"
+            " created_at REAL,"
+            " tags TEXT,"
+            " lyrics TEXT,"
+            " artifacts TEXT NOT NULL DEFAULT '{}')"
+        )
+        for column in SORT_COLUMNS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_songs_{column} ON songs({column})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_task ON songs(task_id)")
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5("
+                "filename UNINDEXED, title, genre, tags, lyrics, tokenize='unicode61 remove_diacritics 2')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            log.warning("SQLite built without FTS5; library search falls back to LIKE.")
+            self.fts = False
+
+    # --- Writes ---
+
+    def upsert(self, row: Dict[str, Any]):
+        row = {column: row.get(column) for column in COLUMNS}
+        row["artifacts"] = json.dumps(row["artifacts"] or {})
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO songs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                    [row[column] for column in COLUMNS],
+                )
+                if self.fts:
+                    self._conn.execute("DELETE FROM songs_fts WHERE filename = ?", (row["filename"],))
+                    self._conn.execute(
+                        "INSERT INTO songs_fts (filename, title, genre, tags, lyrics) VALUES (?, ?, ?, ?, ?)",
+                        (row["filename"], row["title"] or "", row["genre"] or "", row["tags"] or "",
+                         row["lyrics"] or ""),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def remove(self, filename: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM songs WHERE filename = ?", (filename,))
+            if self.fts:
+                self._conn.execute("DELETE FROM songs_fts WHERE filename = ?", (filename,))
+
+    def _artifacts(self, task_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        """Other stage outputs of a task still on disk (currently the raw render)."""
+        if not task_id:
+            return {}
+        raw = os.path.join(self.output_dir, f"{task_id}_raw.wav")
+        try:
+            return {"raw": {"filename": os.path.basename(raw), "size": os.path.getsize(raw)}}
+        except OSError:
+            return {}
+
+    def record_song(self, path: str, task_id: Optional[str] = None, request: Optional[Dict[str, Any]] = None,
+                    created_at: Optional[float] = None):
+        """
+        Catalog a finished song; `request` is the generation payload it was
+        made from and `created_at` the task's completion time (the file's
+        mtime when unknown: a hard-linked cache hit shares the original's).
+        """
+        request = request or {}
+        filename = os.path.basename(path)
+        st = os.stat(path)
+        lyrics = "\n".join(
+            f"[{part.get('type')}] {part['text']}" for part in request.get("structure") or [] if part.get("text")
+        )
+        tags = " ".join(filter(None, [
+            request.get("genre"),
+            request.get("inspiration"),
+            request.get("vocal_processing"),
+            *[part.get("description") for part in request.get("structure") or []],
+        ]))
+        self.upsert({
+            "filename": filename,
+            "task_id": task_id,
+            "title": request.get("title") or self._title_from_filename(filename),
+            "genre": request.get("genre"),
+            "bpm": request.get("bpm"),
+            **audio_info(path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "created_at": created_at if created_at is not None else st.st_mtime,
+            "tags": tags,
+            "lyrics": lyrics,
+            "artifacts": self._artifacts(task_id),
+        })
+
+    def _refresh(self, path: str, task_id: Optional[str], st: os.stat_result):
+        info = audio_info(path)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE songs SET size = ?, mtime_ns = ?, duration = ?, sample_rate = ?, artifacts = ? "
+                "WHERE filename = ?",
+                (st.st_size, st.st_mtime_ns, info["duration"], info["sample_rate"],
+                 json.dumps(self._artifacts(task_id)), os.path.basename(path)),
+            )
+
+    @staticmethod
+    def _title_from_filename(filename: str) -> str:
+        match = TASK_FILE.match(filename)
+        stem = match.group(2) if match else os.path.splitext(filename)[0]
+        return stem.replace("_", " ")
+
+    def reconcile(self, lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None) -> Dict[str, int]:
+        """
+        Bring the catalog in line with the output directory: catalog new or
+        changed songs, drop rows whose file is gone, refresh artifact lists.
+        `lookup(task_id)` may return the task's record (its generation
+        payload under "request", its completion time under "completed_at").
+        """
+        if not os.path.isdir(self.output_dir):
+            return {"added": 0, "updated": 0, "removed": 0}
+        on_disk = {}
+        raw_tasks = set()
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".wav"):
+                    continue
+                task_id, kind = classify(entry.name)
+                if kind == "song":
+                    on_disk[entry.name] = (task_id, entry.stat())
+                elif kind == "raw":
+                    raw_tasks.add(task_id)
+
+        with self._lock:
+            known = {
+                filename: (mtime_ns, size, json.loads(artifacts))
+                for filename, mtime_ns, size, artifacts in
+                self._conn.execute("SELECT filename, mtime_ns, size, artifacts FROM songs").fetchall()
+            }
+        added = updated = removed = 0
+        for filename, (task_id, st) in on_disk.items():
+            previous = known.get(filename)
+            if previous is not None:
+                mtime_ns, size, artifacts = previous
+                if mtime_ns == st.st_mtime_ns and size == st.st_size and ("raw" in artifacts) == (task_id in raw_tasks):
+                    continue
+            path = os.path.join(self.output_dir, filename)
+            if previous is None:
+                task = (lookup(task_id) if lookup and task_id else None) or {}
+                self.record_song(path, task_id, task.get("request"), task.get("completed_at"))
+                added += 1
+            else:
+                self._refresh(path, task_id, st) # Keep the metadata recorded at completion
+                updated += 1
+        for filename in set(known) - set(on_disk):
+            self.remove(filename)
+            removed += 1
+        if added or updated or removed:
+            log.info(f"Library reconciled: {added} added, {updated} updated, {removed} removed.")
+        return {"added": added, "updated": updated, "removed": removed}
+
+    # --- Reads ---
+
+    def _fts_query(self, q: str) -> str:
+        # Each word as a quoted prefix term, so user input can't break FTS syntax
+        words = re.findall(r"\w+", q)
+        return " ".join(f'"{word}"*' for word in words)
+
+    def list(self, offset: int = 0, limit: int = 50, sort: str = "created_at", order: str = "desc",
+             q: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """(total matches, page of rows)."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        direction = "ASC" if order.lower() == "asc" else "DESC"
+        where, params = "", []
+        if q and q.strip():
+            if self.fts:
+                match = self._fts_query(q)
+                if not match:
+                    return 0, []
+                where = "WHERE filename IN (SELECT filename FROM songs_fts WHERE songs_fts MATCH ?)"
+                params.append(match)
+            else:
+                like = f"%{q.strip()}%"
+                where = "WHERE title LIKE ? OR genre LIKE ? OR tags LIKE ? OR lyrics LIKE ?"
+                params.extend([like] * 4)
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM songs {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM songs {where} "
+                f"ORDER BY {sort} {direction}, filename {direction} LIMIT ? OFFSET ?",
+                [*params, max(0, limit), max(0, offset)],
+            ).fetchall()
+        songs = []
+        for row in rows:
+            song = dict(zip(COLUMNS, row))
+            song["artifacts"] = json.loads(song["artifacts"])
+            song.pop("mtime_ns")
+            songs.append(song)
+        return total, songs
+
+    def paths(self) -> List[str]:
+        """Paths of every cataloged song."""
+        with self._lock:
+            rows = self._conn.execute("SELECT filename FROM songs ORDER BY created_at DESC").fetchall()
+        return [os.path.join(self.output_dir, filename) for (filename,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+library = LibraryCatalog(settings.LIBRARY_DB_PATH, settings.OUTPUT_DIR)
@@ -2,9 +2,11 @@ import sys
 from loguru import logger
 from pathlib import Path
 
+from app.config import settings
+
 # Configure Logger
-log_path = Path("logs")
-log_path.mkdir(exist_ok=True)
+log_path = Path(settings.LOG_DIR)
+log_path.mkdir(parents=True, exist_ok=True)
 
 logger.remove()  # Remove default handler
 
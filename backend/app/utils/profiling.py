@@ -0,0 +1,125 @@
+import contextlib
+import cProfile
+import os
+import re
+import threading
+from typing import List, Optional
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+log = get_logger("Profiling")
+
+# mode -> file suffix. cProfile dumps are pstats files (snakeviz, pstats);
+# torch traces are Chrome trace JSON (chrome://tracing, Perfetto).
+PROFILE_MODES = {"cprofile": ".prof", "torch": ".trace.json"}
+# Kineto (behind torch.profiler) is process-wide: one trace at a time
+_torch_lock = threading.Lock()
+PROFILE_FILE = re.compile(r"^(?P<task>[0-9a-f-]{36})\.(?P<stage>[a-z]+)(?P<suffix>\.prof|\.trace\.json)$")
+
+
+def profile_path(task_id: str, stage: str, mode: str) -> str:
+    return os.path.join(settings.PROFILE_DIR, f"{task_id}.{stage}{PROFILE_MODES[mode]}")
+
+
+def list_profiles(task_id: str) -> List[dict]:
+    """Captures written for a task: [{stage, mode, filename, size}]."""
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    modes = {suffix: mode for mode, suffix in PROFILE_MODES.items()}
+    captures = []
+    for entry in sorted(os.scandir(settings.PROFILE_DIR), key=lambda e: e.name):
+        match = PROFILE_FILE.match(entry.name)
+        if match and match.group("task") == task_id:
+            captures.append({
+                "stage": match.group("stage"),
+                "mode": modes[match.group("suffix")],
+                "filename": entry.name,
+                "size": entry.stat().st_size,
+            })
+    return captures
+
+
+def _prune():
+    """Keep the newest PROFILE_MAX_FILES captures."""
+    try:
+        entries = [e for e in os.scandir(settings.PROFILE_DIR) if PROFILE_FILE.match(e.name)]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[settings.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+@contextlib.contextmanager
+def _cprofile(path: str):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Only one cProfile may be active at a time on 3.12+ (other stage is profiling)
+        log.warning(f"cProfile unavailable for {path}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(path)
+        except OSError as e:
+            log.warning(f"Could not write {path}: {e}")
+
+
+@contextlib.contextmanager
+def _torch_profile(path: str):
+    import torch # Only when a trace is actually requested
+
+    if not _torch_lock.acquire(blocking=False):
+        log.warning(f"Another torch trace is running; skipping {path}")
+        yield
+        return
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    try:
+        profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+        profiler.start()
+        try:
+            yield
+        finally:
+            try:
+                profiler.stop()
+                profiler.export_chrome_trace(path)
+            except Exception as e:
+                log.warning(f"Could not write {path}: {e}")
+    finally:
+        _torch_lock.release()
+
+
+@contextlib.contextmanager
+def capture(task_id: str, stage: str, mode: Optional[str]):
+    """
+    Profile the block into PROFILE_DIR when mode is set ("cprofile" or
+    "torch"). cProfile sees the calling thread only: the stage worker, not
+    helper threads such as the preview decoder or AudioSR chunk pool.
+    A failing profiler never fails the task.
+    """
+    if not mode:
+        yield
+        return
+    path = profile_path(task_id, stage, mode)
+    with contextlib.ExitStack() as stack:
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            stack.enter_context(_cprofile(path) if mode == "cprofile" else _torch_profile(path))
+        except Exception as e:
+            log.warning(f"Could not start {mode} profiler for {task_id}: {e}")
+        try:
+            yield
+        finally:
+            stack.close()
+            _prune()
@@ -3,10 +3,9 @@ import os
 from pathlib import Path
 from typing import Dict, Any, Optional
 
-# Resolve path relative to this file (backend/app/utils/project_state.py)
-# We want to store it in backend/ (parent of app) or backend/data
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-PROJECT_STATE_FILE = BASE_DIR / "current_project.json"
+from app.config import settings
+
+PROJECT_STATE_FILE = Path(settings.PROJECT_STATE_PATH)
 
 def save_project_state(state: Dict[str, Any]):
     """Saves the current project state to a JSON file."""
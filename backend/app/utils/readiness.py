@@ -0,0 +1,63 @@
+import contextlib
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from app.utils.logger import get_logger
+
+log = get_logger("Readiness")
+
+# Startup phases behind /ready. The API itself is up whenever it answers.
+COMPONENTS = ("device", "models", "generation", "enhancement")
+STATES = ("pending", "running", "ready", "failed", "skipped")
+
+
+class Readiness:
+    """
+    Startup state per component, so clients can tell "API up" apart from
+    "engine warm". Each component goes pending -> running -> ready/failed
+    (or straight to skipped).
+    """
+
+    def __init__(self, components: Iterable[str] = COMPONENTS):
+        self._lock = threading.Lock()
+        self._components: Dict[str, dict] = {name: {"state": "pending"} for name in components}
+
+    def set(self, name: str, state: str, error: Optional[str] = None, seconds: Optional[float] = None):
+        if state not in STATES:
+            raise ValueError(f"Unknown readiness state '{state}'")
+        entry = {"state": state, "since": time.time()}
+        if seconds is not None:
+            entry["seconds"] = round(seconds, 3)
+        if error is not None:
+            entry["error"] = error
+        with self._lock:
+            self._components[name] = entry
+
+    @contextlib.contextmanager
+    def track(self, name: str):
+        """Mark the component running for the block; ready when it returns, failed (and re-raised) if it raises."""
+        self.set(name, "running")
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.set(name, "failed", error=str(e), seconds=time.perf_counter() - start)
+            raise
+        self.set(name, "ready", seconds=time.perf_counter() - start)
+        log.info(f"{name} ready in {time.perf_counter() - start:.2f}s.")
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            return self._components[name]["state"]
+
+    def failed(self) -> bool:
+        with self._lock:
+            return any(c["state"] == "failed" for c in self._components.values())
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._components.items()}
+
+
+readiness = Readiness()
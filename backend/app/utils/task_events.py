@@ -0,0 +1,121 @@
+import asyncio
+import json
+import queue
+import threading
+from typing import Iterable, Optional, Set
+
+from app.utils.logger import get_logger
+
+log = get_logger("TaskEvents")
+
+# Event types where only the latest value per task matters
+COALESCED = ("progress", "log_partial")
+
+
+class Subscription:
+    def __init__(self, task_ids: Optional[Iterable[str]], maxsize: int = 256):
+        self.task_ids: Optional[Set[str]] = set(task_ids) if task_ids else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def wants(self, task_id: str) -> bool:
+        return self.task_ids is None or task_id in self.task_ids
+
+    def offer(self, event: dict):
+        # A slow client loses its oldest events, never blocks the bus
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+
+class TaskEventBus:
+    """
+    Fan-out of task progress/stage/log events to push clients (SSE).
+
+    `publish` is called from generation threads: it only appends to a
+    thread-safe queue and, at most once per coalescing window, asks the event
+    loop to drain it. The drain runs on the loop, merges progress events per
+    task and hands them to subscriber queues, so generation never waits on
+    HTTP clients.
+    """
+
+    def __init__(self, coalesce_window: float = 0.1):
+        self.coalesce_window = coalesce_window
+        self._pending: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Set[Subscription] = set()
+        self._scheduled = False
+        self._flag_lock = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    # --- Producer side (any thread) ---
+
+    def publish(self, task_id: str, event_type: str, data: dict):
+        if not self._subscribers or self._loop is None:
+            return
+        self._pending.put((task_id, event_type, data))
+        with self._flag_lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._loop.call_later, self.coalesce_window, self._drain)
+        except RuntimeError:
+            # Loop closed (shutdown)
+            self._scheduled = False
+
+    # --- Consumer side (event loop) ---
+
+    def _drain(self):
+        with self._flag_lock:
+            self._scheduled = False
+        events = []
+        latest = {}
+        while True:
+            try:
+                task_id, event_type, data = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            key = (task_id, event_type)
+            if event_type in COALESCED:
+                if key in latest:
+                    # Updates may be partial (e.g. only eta); keep fields the newer one omits
+                    latest[key]["data"].update(data)
+                    continue
+            elif event_type == "log" and key in latest:
+                # Merge consecutive log deltas into one event
+                merged = latest[key]["data"]
+                merged["lines"] = merged["lines"] + data["lines"]
+                merged["cursor"] = data["cursor"]
+                continue
+            event = {"task_id": task_id, "type": event_type, "data": dict(data)}
+            if event_type in COALESCED or event_type == "log":
+                latest[key] = event
+            if event_type == "stage":
+                # Progress after a stage change belongs to the new stage
+                latest.pop((task_id, "progress"), None)
+                latest.pop((task_id, "log"), None)
+            events.append(event)
+        for event in events:
+            for sub in list(self._subscribers):
+                if sub.wants(event["task_id"]):
+                    sub.offer(event)
+
+    def subscribe(self, task_ids: Optional[Iterable[str]] = None) -> Subscription:
+        sub = Subscription(task_ids)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps({'task_id': event['task_id'], **event['data']})}\n\n"
+
+
+task_events = TaskEventBus()
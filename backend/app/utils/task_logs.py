@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+log = get_logger("TaskLogs")
+
+
+class TaskLog:
+    """
+    Bounded, line-based log for one task.
+
+    Committed lines get absolute indices (0, 1, 2, ...) which clients use as a
+    cursor. Only the last `max_lines` stay in memory; every committed line is
+    also appended to a per-task spill file. A carriage return rewinds the
+    current (uncommitted) line, which is how tqdm redraws its progress bar.
+    """
+
+    def __init__(self, task_id: str, max_lines: int, spill_path: Optional[str] = None):
+        self.task_id = task_id
+        self.lines = deque(maxlen=max_lines)
+        self.total = 0 # Absolute index of the next committed line
+        self.partial = ""
+        self.spill_path = spill_path
+        self._spill = None
+        self._lock = threading.Lock()
+
+    @property
+    def first_index(self) -> int:
+        return self.total - len(self.lines)
+
+    def write(self, text: str) -> List[str]:
+        """Append raw text. Returns the lines committed by this write."""
+        committed = []
+        with self._lock:
+            parts = text.split("\n")
+            for i, part in enumerate(parts):
+                if "\r" in part:
+                    self.partial = part.rsplit("\r", 1)[1]
+                else:
+                    self.partial += part
+                if i < len(parts) - 1:
+                    committed.append(self.partial)
+                    self._commit(self.partial)
+                    self.partial = ""
+        return committed
+
+    def _commit(self, line: str):
+        self.lines.append(line)
+        self.total += 1
+        if self.spill_path:
+            if self._spill is None:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                self._spill = open(self.spill_path, "a", encoding="utf-8", buffering=1)
+            self._spill.write(line + "\n")
+
+    def read(self, cursor: Optional[int] = None, limit: int = 500) -> dict:
+        """
+        Lines from `cursor` on (at most `limit`). Without a cursor, the last
+        `limit` lines. `truncated` means lines before the buffer were dropped
+        (they are still in the spill file).
+        """
+        with self._lock:
+            first = self.first_index
+            if cursor is None:
+                start = max(first, self.total - limit)
+            else:
+                start = min(max(cursor, first), self.total)
+            truncated = cursor is not None and cursor < first
+            end = min(self.total, start + limit)
+            offset = start - first
+            lines = [self.lines[i] for i in range(offset, offset + (end - start))]
+            return {
+                "lines": lines,
+                "cursor": end,
+                "partial": self.partial,
+                "truncated": truncated,
+            }
+
+    def close(self):
+        with self._lock:
+            if self.partial:
+                self._commit(self.partial)
+                self.partial = ""
+            if self._spill:
+                self._spill.close()
+                self._spill = None
+
+
+class TaskLogRegistry:
+    """Live logs for running tasks plus a small LRU of recently finished ones."""
+
+    def __init__(self, log_dir: str, max_lines: int, keep_finished: int = 32):
+        self.log_dir = log_dir
+        self.max_lines = max_lines
+        self.keep_finished = keep_finished
+        self._active: Dict[str, TaskLog] = {}
+        self._finished: "OrderedDict[str, TaskLog]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def spill_path(self, task_id: str) -> str:
+        return os.path.join(self.log_dir, f"{task_id}.log")
+
+    def open(self, task_id: str) -> TaskLog:
+        with self._lock:
+            task_log = self._active.get(task_id)
+            if task_log is None:
+                task_log = TaskLog(task_id, self.max_lines, self.spill_path(task_id))
+                self._active[task_id] = task_log
+            return task_log
+
+    def close(self, task_id: str):
+        with self._lock:
+            task_log = self._active.pop(task_id, None)
+            if task_log is None:
+                return
+            task_log.close()
+            self._finished[task_id] = task_log
+            while len(self._finished) > self.keep_finished:
+                self._finished.popitem(last=False)
+
+    def get(self, task_id: str) -> Optional[TaskLog]:
+        with self._lock:
+            task_log = self._active.get(task_id) or self._finished.get(task_id)
+            if task_log is not None:
+                return task_log
+        # Older task: rebuild from its spill file (bounded by max_lines)
+        path = self.spill_path(task_id)
+        if not os.path.exists(path):
+            return None
+        task_log = TaskLog(task_id, self.max_lines)
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                task_log._commit(line.rstrip("\n"))
+        with self._lock:
+            self._finished[task_id] = task_log
+            while len(self._finished) > self.keep_finished:
+                self._finished.popitem(last=False)
+        return task_log
+
+    def discard(self, task_id: str):
+        """Forget a task's log and delete its spill file (task pruned from the store)."""
+        with self._lock:
+            task_log = self._active.pop(task_id, None) or self._finished.pop(task_id, None)
+        if task_log is not None:
+            task_log.close()
+        try:
+            os.remove(self.spill_path(task_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"Could not delete log for task {task_id}: {e}")
+
+    def read(self, task_id: str, cursor: Optional[int] = None, limit: int = 500) -> Optional[dict]:
+        task_log = self.get(task_id)
+        return task_log.read(cursor, limit) if task_log else None
+
+
+task_logs = TaskLogRegistry(settings.TASK_LOG_DIR, settings.TASK_LOG_MAX_LINES)
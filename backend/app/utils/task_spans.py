@@ -0,0 +1,147 @@
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from app.utils.logger import get_logger
+
+log = get_logger("TaskSpans")
+
+_local = threading.local()
+
+
+class SpanRecorder:
+    """
+    Nested timing spans of one task. Offsets are seconds since the task's
+    first span, so spans recorded by different stage threads (generation,
+    enhancement) line up on one timeline.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.roots: List[dict] = []
+        self._lock = threading.Lock()
+
+    def open(self, name: str, parent: Optional[dict], attrs: dict, start: float) -> dict:
+        node = {"name": name, "start": round(start - self._origin, 4), "duration": None, "children": []}
+        if attrs:
+            node["attrs"] = dict(attrs)
+        with self._lock:
+            (parent["children"] if parent is not None else self.roots).append(node)
+        return node
+
+    def close(self, node: dict, end: float, attrs: Optional[dict] = None):
+        with self._lock:
+            node["duration"] = max(0.0, round(end - self._origin - node["start"], 4))
+            if attrs:
+                node.setdefault("attrs", {}).update(attrs)
+
+    def tree(self) -> List[dict]:
+        """Copy of the span tree; open spans have duration None."""
+        def copy(node):
+            copied = dict(node, children=[copy(child) for child in node["children"]])
+            if "attrs" in node:
+                copied["attrs"] = dict(node["attrs"])
+            return copied
+        with self._lock:
+            return [copy(root) for root in self.roots]
+
+
+class TaskSpanRegistry:
+    """
+    Span recorders by task id. A stage thread activates the recorders of
+    the task(s) it works for; `span()` anywhere below (service, enhancer)
+    then records into all of them, which is how one batched frame loop
+    shows up on every task of the batch. Without an active task, spans
+    cost nothing.
+    """
+
+    def __init__(self, keep: int = 256):
+        self.keep = keep
+        self._recorders: "OrderedDict[str, SpanRecorder]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Called with (task_id, spans) whenever a task's top-level span closes
+        self.sink: Optional[Callable[[str, List[dict]], None]] = None
+
+    def recorder(self, task_id: str) -> SpanRecorder:
+        with self._lock:
+            recorder = self._recorders.get(task_id)
+            if recorder is None:
+                recorder = self._recorders[task_id] = SpanRecorder(task_id)
+                while len(self._recorders) > self.keep:
+                    self._recorders.popitem(last=False)
+            return recorder
+
+    def get(self, task_id: str) -> Optional[List[dict]]:
+        with self._lock:
+            recorder = self._recorders.get(task_id)
+        return recorder.tree() if recorder else None
+
+    @contextlib.contextmanager
+    def activate(self, *task_ids: str):
+        """Record this thread's spans into the given tasks for the duration of the block."""
+        previous = getattr(_local, "frames", None)
+        _local.frames = [(self.recorder(task_id), []) for task_id in task_ids]
+        try:
+            yield
+        finally:
+            _local.frames = previous
+
+    @contextlib.contextmanager
+    def narrow(self, task_id: Optional[str]):
+        """Within a multi-task activation, record only into task_id's (open) spans; None is a no-op."""
+        previous = getattr(_local, "frames", None)
+        if task_id is not None and previous:
+            _local.frames = [frame for frame in previous if frame[0].task_id == task_id]
+        try:
+            yield
+        finally:
+            _local.frames = previous
+
+    def _publish(self, recorder: SpanRecorder):
+        if self.sink is None:
+            return
+        try:
+            self.sink(recorder.task_id, recorder.tree())
+        except Exception as e:
+            log.warning(f"Could not store spans for {recorder.task_id}: {e}")
+
+
+task_spans = TaskSpanRegistry()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    Time the block as a child of the current span of every active task.
+    Yields a dict; keys set on it are added to the span's attrs when it closes.
+    """
+    late_attrs = {}
+    frames = getattr(_local, "frames", None)
+    if not frames:
+        yield late_attrs
+        return
+    start = time.perf_counter()
+    opened = []
+    for recorder, stack in frames:
+        node = recorder.open(name, stack[-1] if stack else None, attrs, start)
+        stack.append(node)
+        opened.append((recorder, stack, node))
+    try:
+        yield late_attrs
+    finally:
+        end = time.perf_counter()
+        for recorder, stack, node in opened:
+            recorder.close(node, end, late_attrs)
+            stack.remove(node)
+            if not stack:
+                task_spans._publish(recorder)
+
+
+def add_span(name: str, start: float, end: float, **attrs):
+    """Record an already finished block (perf_counter timestamps) under the current spans."""
+    for recorder, stack in getattr(_local, "frames", None) or []:
+        recorder.close(recorder.open(name, stack[-1] if stack else None, attrs, start), end)
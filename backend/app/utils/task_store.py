@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.task_logs import TaskLogRegistry
+
+log = get_logger("TaskStore")
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class TaskStore(ABC):
+    """
+    Task record storage.
+
+    Writes go to an in-memory record first. `update(..., durable=False)` (used for
+    per-frame progress) only marks the task dirty; dirty records are written in a
+    batch by `flush()`, which the background flusher calls every
+    TASK_STORE_FLUSH_INTERVAL seconds. Cost per update is independent of how many
+    historical tasks exist.
+    """
+
+    def __init__(self, task_logs: Optional[TaskLogRegistry] = None):
+        self.task_logs = task_logs # Pruned tasks take their spill logs with them
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update(self, task_id: str, data: Dict[str, Any], durable: bool = True):
+        ...
+
+    @abstractmethod
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def _expire(self, cutoff: float) -> List[str]:
+        """Delete finished tasks last updated before cutoff. Returns their ids."""
+
+    def prune(self, ttl_seconds: float) -> int:
+        """Remove finished tasks not updated within ttl_seconds. Returns count removed."""
+        removed = self._expire(time.time() - ttl_seconds)
+        if self.task_logs is not None:
+            for task_id in removed:
+                self.task_logs.discard(task_id)
+        return len(removed)
+
+    def flush(self):
+        pass
+
+    def start(self, ttl_seconds: Optional[float] = None, prune_every: float = 3600.0):
+        """Start background flushing/pruning (no-op for stores that don't need it)."""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class MemoryTaskStore(TaskStore):
+    """Non-persistent store (tests, ephemeral runs)."""
+
+    def __init__(self, task_logs: Optional[TaskLogRegistry] = None):
+        super().__init__(task_logs)
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, task_id):
+        with self._lock:
+            record = self._tasks.get(task_id)
+            return dict(record) if record is not None else None
+
+    def update(self, task_id, data, durable=True):
+        now = time.time()
+        with self._lock:
+            record = self._tasks.setdefault(task_id, {"task_id": task_id, "created_at": now})
+            record.update(data)
+            record["updated_at"] = now
+
+    def list(self, status=None, limit=100):
+        with self._lock:
+            records = [dict(r) for r in self._tasks.values() if status is None or r.get("status") == status]
+        records.sort(key=lambda r: r.get("updated_at", 0), reverse=True)
+        return records[:limit]
+
+    def _expire(self, cutoff):
+        with self._lock:
+            stale = [tid for tid, r in self._tasks.items()
+                     if r.get("status") in TERMINAL_STATUSES and r.get("updated_at", 0) < cutoff]
+            for tid in stale:
+                del self._tasks[tid]
+        return stale
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite (WAL) backed store. One row per task, indexed by id and status.
+    Records of tasks that are still running are cached in memory; finished
+    tasks are read from disk on demand.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, task_logs: Optional[TaskLogRegistry] = None):
+        super().__init__(task_logs)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY,"
+            " status TEXT,"
+            " created_at REAL,"
+            " updated_at REAL,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, updated_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at)")
+
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._dirty = set()
+        self._stop = threading.Event()
+        self._flusher = None
+        self.flush_interval = flush_interval
+
+    # --- Reads ---
+
+    def get(self, task_id):
+        with self._lock:
+            record = self._cache.get(task_id)
+            if record is not None:
+                return dict(record)
+            row = self._conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, status=None, limit=100):
+        self.flush()
+        with self._lock:
+            if status:
+                rows = self._conn.execute(
+                    "SELECT data FROM tasks WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (status, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT data FROM tasks ORDER BY updated_at DESC LIMIT ?", (limit,)
+                ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    # --- Writes ---
+
+    def update(self, task_id, data, durable=True):
+        now = time.time()
+        with self._lock:
+            record = self._cache.get(task_id)
+            if record is None:
+                record = self.get(task_id) or {"task_id": task_id, "created_at": now}
+                self._cache[task_id] = record
+            record.update(data)
+            record["updated_at"] = now
+            self._dirty.add(task_id)
+            if durable:
+                self._write([task_id])
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._write(list(self._dirty))
+
+    def _write(self, task_ids):
+        rows = []
+        for task_id in task_ids:
+            record = self._cache[task_id]
+            rows.append((task_id, record.get("status"), record.get("created_at"),
+                         record.get("updated_at"), json.dumps(record)))
+            self._dirty.discard(task_id)
+            if record.get("status") in TERMINAL_STATUSES:
+                # Finished: the database copy is authoritative from here on
+                del self._cache[task_id]
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT INTO tasks (task_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, "
+                "updated_at = excluded.updated_at, data = excluded.data",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _expire(self, cutoff):
+        placeholders = ",".join("?" for _ in TERMINAL_STATUSES)
+        where = f"status IN ({placeholders}) AND updated_at < ?"
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(f"SELECT task_id FROM tasks WHERE {where}",
+                                          (*TERMINAL_STATUSES, cutoff)).fetchall()
+                self._conn.execute(f"DELETE FROM tasks WHERE {where}", (*TERMINAL_STATUSES, cutoff))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [task_id for (task_id,) in rows]
+
+    def import_legacy_json(self, json_path: str) -> int:
+        """One-time migration from the old whole-file tasks.json."""
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                legacy = json.load(f)
+        except Exception as e:
+            log.warning(f"Could not read legacy {json_path}: {e}")
+            return 0
+        mtime = os.path.getmtime(json_path)
+        with self._lock:
+            for task_id, record in legacy.items():
+                record = dict(record)
+                if record.get("status") not in TERMINAL_STATUSES:
+                    # Whatever was running died with the old process
+                    record["status"] = "failed"
+                    record["message"] = "Interrupted by restart."
+                record.setdefault("task_id", task_id)
+                record.setdefault("created_at", mtime)
+                record.setdefault("updated_at", mtime)
+                self._cache[task_id] = record
+            self._write(list(legacy.keys()))
+        os.replace(json_path, json_path + ".migrated")
+        log.info(f"Migrated {len(legacy)} tasks from {json_path}.")
+        return len(legacy)
+
+    def recover_interrupted(self) -> int:
+        """Mark tasks that were mid-flight when the process died as failed."""
+        placeholders = ",".join("?" for _ in TERMINAL_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE status NOT IN ({placeholders})", TERMINAL_STATUSES
+            ).fetchall()
+        for (task_id,) in rows:
+            self.update(task_id, {"status": "failed", "message": "Interrupted by restart."})
+        return len(rows)
+
+    # --- Background flushing ---
+
+    def start(self, ttl_seconds: Optional[float] = None, prune_every: float = 3600.0):
+        if self._flusher and self._flusher.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            last_prune = 0.0
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                    if ttl_seconds and time.time() - last_prune > prune_every:
+                        removed = self.prune(ttl_seconds)
+                        if removed:
+                            log.info(f"Pruned {removed} expired tasks.")
+                        last_prune = time.time()
+                except Exception as e:
+                    log.error(f"Task store flush failed: {e}")
+
+        self._flusher = threading.Thread(target=run, name="task-store-flusher", daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def create_task_store(task_logs: Optional[TaskLogRegistry] = None) -> TaskStore:
+    backend = settings.TASK_STORE_BACKEND
+    if backend == "memory":
+        return MemoryTaskStore(task_logs)
+    if backend == "sqlite":
+        store = SQLiteTaskStore(settings.TASK_STORE_PATH, flush_interval=settings.TASK_STORE_FLUSH_INTERVAL,
+                                task_logs=task_logs)
+        store.import_legacy_json(settings.TASK_STORE_LEGACY_JSON)
+        store.recover_interrupted()
+        return store
+    raise ValueError(f"Unknown TASK_STORE_BACKEND '{backend}'")
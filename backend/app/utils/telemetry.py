@@ -0,0 +1,135 @@
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+import psutil
+
+from app.config import settings
+from app.utils.logger import get_logger
+
+log = get_logger("Telemetry")
+
+
+def torch_memory() -> Optional[Dict[str, int]]:
+    """CUDA caching-allocator stats, if torch is loaded and has a CUDA device (DirectML exposes none)."""
+    torch = sys.modules.get("torch") # Never import torch just to sample it
+    if torch is None or not torch.cuda.is_available():
+        return None
+    try:
+        utilization = torch.cuda.utilization() # Needs pynvml
+    except Exception:
+        utilization = None
+    return {
+        "allocated": torch.cuda.memory_allocated(),
+        "reserved": torch.cuda.memory_reserved(),
+        "max_allocated": torch.cuda.max_memory_allocated(),
+        "total": torch.cuda.get_device_properties(0).total_memory,
+        "utilization": utilization,
+    }
+
+
+class TelemetrySampler:
+    """
+    One background thread samples the machine every `interval` seconds into
+    a ring buffer of `history` samples. Readers (/stats) get the latest
+    sample or a window of history without triggering any measurement.
+    """
+
+    def __init__(self, interval: float, history: int):
+        self.interval = interval
+        self.samples: deque = deque(maxlen=max(1, history))
+        self.device_name: Optional[str] = None
+        self._stage_provider: Optional[Callable[[], Dict[str, Any]]] = None
+        self._vram_provider: Optional[Callable[[], Optional[float]]] = None
+        self._process = psutil.Process()
+        self._last_disk = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def set_stage_provider(self, provider: Callable[[], Dict[str, Any]]):
+        """provider() -> {"stage": ..., ...} describing what the pipeline is doing."""
+        self._stage_provider = provider
+
+    def set_vram_provider(self, provider: Callable[[], Optional[float]]):
+        """provider() -> estimated VRAM use in percent, for backends without allocator stats."""
+        self._vram_provider = provider
+
+    def sample(self) -> Dict[str, Any]:
+        now = time.time()
+        memory = psutil.virtual_memory()
+        sample = {
+            "timestamp": round(now, 3),
+            "cpu": psutil.cpu_percent(interval=None),
+            "per_core": psutil.cpu_percent(interval=None, percpu=True),
+            "ram": memory.percent,
+            "ram_used": memory.used,
+            "process_rss": self._process.memory_info().rss,
+            "process_cpu": self._process.cpu_percent(interval=None),
+            "torch": torch_memory(),
+            "disk": self._disk_rates(now),
+        }
+        if sample["torch"]:
+            sample["gpu"] = sample["torch"]["utilization"]
+            sample["vram"] = round(100.0 * sample["torch"]["reserved"] / sample["torch"]["total"], 1)
+        else:
+            # No utilisation counter on DirectML/CPU; VRAM is the residency manager's estimate
+            sample["gpu"] = None
+            sample["vram"] = self._vram_provider() if self._vram_provider else None
+        try:
+            sample.update(self._stage_provider() if self._stage_provider else {"stage": "unknown"})
+        except Exception as e:
+            sample["stage"] = f"error: {e}"
+        return sample
+
+    def _disk_rates(self, now: float) -> Optional[Dict[str, float]]:
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return None
+        previous, self._last_disk = self._last_disk, (now, counters)
+        if previous is None:
+            return {"read_bytes_per_s": 0.0, "write_bytes_per_s": 0.0}
+        elapsed = max(now - previous[0], 1e-6)
+        return {
+            "read_bytes_per_s": round((counters.read_bytes - previous[1].read_bytes) / elapsed, 1),
+            "write_bytes_per_s": round((counters.write_bytes - previous[1].write_bytes) / elapsed, 1),
+        }
+
+    def record(self) -> Dict[str, Any]:
+        sample = self.sample()
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.samples[-1] if self.samples else None
+
+    def history(self, seconds: float) -> List[Dict[str, Any]]:
+        cutoff = time.time() - seconds
+        with self._lock:
+            return [s for s in self.samples if s["timestamp"] >= cutoff]
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.record() # Primes the cpu_percent baselines; /stats has data right away
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.record()
+                except Exception as e:
+                    log.error(f"Telemetry sample failed: {e}")
+
+        self._thread = threading.Thread(target=run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+telemetry = TelemetrySampler(settings.TELEMETRY_INTERVAL, settings.TELEMETRY_HISTORY)
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import uuid
+from typing import Any, Dict
+
+import soundfile as sf
+from starlette.concurrency import run_in_threadpool
+
+from app.utils.logger import get_logger
+
+log = get_logger("Uploads")
+
+CHUNK_SIZE = 1024 * 1024
+EXTENSIONS = {"WAV": "wav", "WAVEX": "wav", "FLAC": "flac", "OGG": "ogg", "MP3": "mp3", "AIFF": "aiff"}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedAudio(Exception):
+    pass
+
+
+def probe_audio(path: str) -> Dict[str, Any]:
+    try:
+        info = sf.info(path)
+    except Exception as e:
+        raise UnsupportedAudio(f"Not a readable audio file: {e}")
+    return {
+        "duration": round(info.duration, 3),
+        "sample_rate": info.samplerate,
+        "channels": info.channels,
+        "format": info.format,
+        "subtype": info.subtype,
+    }
+
+
+def _write_chunk(f, h, chunk: bytes):
+    f.write(chunk)
+    h.update(chunk)
+
+
+def _commit(tmp_path: str, upload_dir: str, digest: str) -> Dict[str, Any]:
+    """Probe the spooled file and move it to its content address (or drop it if already stored)."""
+    info = probe_audio(tmp_path)
+    path = os.path.join(upload_dir, f"{digest}.{EXTENSIONS.get(info['format'], 'bin')}")
+    deduplicated = os.path.exists(path)
+    if deduplicated:
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    return {"path": path, "deduplicated": deduplicated, **info}
+
+
+async def store_upload(upload, upload_dir: str, max_bytes: int) -> Dict[str, Any]:
+    """
+    Copy an UploadFile to `upload_dir` in chunks, hashing as it goes, without
+    blocking the event loop. The file is stored as <sha256>.<ext>, so the
+    same audio uploaded twice is kept once. Raises UploadTooLarge past
+    `max_bytes` and UnsupportedAudio if the result isn't readable audio.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    tmp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}.part")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes // (1024 * 1024)} MB")
+                await run_in_threadpool(_write_chunk, f, h, chunk)
+        result = await run_in_threadpool(_commit, tmp_path, upload_dir, h.hexdigest())
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if result["deduplicated"]:
+        log.info(f"Upload {upload.filename} already stored as {result['path']}.")
+    return {"sha256": h.hexdigest(), "size": size, **result}
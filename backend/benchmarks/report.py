@@ -0,0 +1,143 @@
+"""Result summaries and baseline comparison for the benchmark suite."""
+import json
+import math
+import os
+import platform
+from typing import Dict, List, Optional, Sequence
+
+# metric -> (relative tolerance, absolute floor). A metric regresses when it
+# is worse than the baseline by more than both: relative alone is too
+# twitchy on tiny values (a 1 ms status call), absolute alone on big ones.
+# Every metric here is lower-is-better.
+DEFAULT_TOLERANCES = {
+    "rtf": (0.20, 0.01),
+    "latency_p50": (0.20, 0.05),
+    "latency_p95": (0.30, 0.10),
+    "peak_rss_mb": (0.15, 64.0),
+    "submit_ms_p50": (0.50, 2.0),
+    "status_ms_p50": (0.50, 2.0),
+}
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100); None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(config: dict, latencies: List[float], wall_seconds: float, peak_rss: int,
+              submit_ms: List[float], status_ms: List[float], failures: int) -> dict:
+    """One scenario's metrics. rtf = wall time / seconds of audio produced (lower is faster)."""
+    audio_seconds = config["duration"] * config["concurrency"] * config["repeats"]
+    return dict(
+        config,
+        jobs=len(latencies) + failures,
+        failures=failures,
+        audio_seconds=audio_seconds,
+        wall_seconds=round(wall_seconds, 3),
+        rtf=round(wall_seconds / audio_seconds, 4) if audio_seconds else None,
+        latency_p50=_round(percentile(latencies, 50)),
+        latency_p95=_round(percentile(latencies, 95)),
+        peak_rss_mb=round(peak_rss / 2 ** 20, 1),
+        submit_ms_p50=_round(percentile(submit_ms, 50)),
+        status_ms_p50=_round(percentile(status_ms, 50)),
+    )
+
+
+def _round(value: Optional[float], digits: int = 3) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+
+def machine_info() -> dict:
+    info = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def compare(results: dict, baseline: dict, tolerances: Optional[Dict[str, tuple]] = None) -> dict:
+    """
+    Compare a run against a stored baseline of the same mode.
+
+    Returns {"regressions": [...], "improvements": [...], "new": [...],
+    "missing": [...]}; each regression/improvement is a dict with
+    scenario, metric, baseline, current and the allowed limit. Failed
+    jobs always count as a regression.
+    """
+    if results.get("mode") != baseline.get("mode"):
+        raise ValueError(f"Baseline is for mode '{baseline.get('mode')}', results are '{results.get('mode')}'")
+    tolerances = dict(DEFAULT_TOLERANCES, **{k: tuple(v) for k, v in
+                                             (tolerances or baseline.get("tolerances") or {}).items()})
+    report = {"regressions": [], "improvements": [], "new": [], "missing": []}
+    current, reference = results.get("scenarios", {}), baseline.get("scenarios", {})
+    report["missing"] = sorted(set(reference) - set(current))
+
+    for name, metrics in current.items():
+        if name not in reference:
+            report["new"].append(name)
+            continue
+        if metrics.get("failures"):
+            report["regressions"].append({"scenario": name, "metric": "failures", "baseline": 0,
+                                          "current": metrics["failures"], "limit": 0})
+        for metric, (relative, absolute) in tolerances.items():
+            base, value = reference[name].get(metric), metrics.get(metric)
+            if base is None or value is None:
+                continue
+            slack = max(base * relative, absolute)
+            entry = {"scenario": name, "metric": metric, "baseline": base, "current": value,
+                     "limit": round(base + slack, 4)}
+            if value > base + slack:
+                report["regressions"].append(entry)
+            elif value < base - slack:
+                report["improvements"].append(entry)
+    return report
+
+
+def format_comparison(report: dict) -> str:
+    lines = []
+    for kind in ("regressions", "improvements"):
+        for entry in report[kind]:
+            change = (entry["current"] - entry["baseline"]) / entry["baseline"] * 100 if entry["baseline"] else 0.0
+            lines.append(f"{kind[:-1].upper():<11} {entry['scenario']:<28} {entry['metric']:<14} "
+                         f"{entry['baseline']} -> {entry['current']} ({change:+.1f}%, limit {entry['limit']})")
+    if report["new"]:
+        lines.append(f"Not in baseline: {', '.join(report['new'])}")
+    if report["missing"]:
+        lines.append(f"Baseline scenarios not run: {', '.join(report['missing'])}")
+    if not report["regressions"]:
+        lines.append("No regressions against the baseline.")
+    return "\n".join(lines)
+
+
+def format_table(results: dict) -> str:
+    columns = ("rtf", "latency_p50", "latency_p95", "peak_rss_mb", "submit_ms_p50", "status_ms_p50", "failures")
+    lines = [f"{'scenario':<28}" + "".join(f"{c:>15}" for c in columns)]
+    for name, metrics in results["scenarios"].items():
+        lines.append(f"{name:<28}" + "".join(f"{str(metrics.get(c)):>15}" for c in columns))
+    return "\n".join(lines)
+
+
+def load(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(data: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=False)
+        f.write("\n")
+    os.replace(tmp, path)
@@ -0,0 +1,318 @@
+"""
+Benchmark suite (run from backend/):
+
+    python -m benchmarks.run                        # stand-in pipeline, compared to benchmarks/baseline.json
+    python -m benchmarks.run --scenarios duration-10s,batch-4 --repeats 1
+    python -m benchmarks.run --update-baseline      # accept this run as the new baseline
+    python -m benchmarks.run --mode real            # real weights from MODELS_DIR, when present
+
+The app runs in-process behind FastAPI's TestClient, with all of its state
+(task store, songs, library, logs) in a scratch directory and default
+settings, so runs don't depend on the local .env or earlier songs.
+
+Every round holds the generation scheduler while it submits its songs,
+then releases them together: batches form the same way on every run and
+latency is measured from that release to the task's completion
+timestamp, not to whenever a poll happened to see it. The pipeline is
+loaded and warmed up before the first scenario.
+
+Exit status: 0 ok (or real mode skipped for lack of weights),
+1 regressions against the baseline.
+"""
+import argparse
+import contextlib
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+from benchmarks import report, scenarios as scenario_sets
+from benchmarks import standin
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+RESULTS_DIR = BENCH_DIR / "results"
+POLL_INTERVAL = 0.05
+
+
+class RssSampler:
+    """Peak resident set size of this process (the whole app runs in it) while running."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-rss", daemon=True)
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def real_weights_missing(models_dir: Path):
+    """Why real mode can't run here (None when it can)."""
+    if importlib.util.find_spec("heartlib") is None:
+        return "heartlib is not installed"
+    required = ["HeartMuLa-oss-3B", "HeartCodec-oss", "gen_config.json", "tokenizer.json"]
+    missing = [name for name in required if not (models_dir / name).exists()]
+    if missing:
+        return f"no weights in {models_dir} (missing {', '.join(missing)})"
+    return None
+
+
+def prepare(mode: str, workdir: Path, models_dir: Path, verbose: bool):
+    """Point the app at a scratch directory; must run before anything imports `app`."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ.update({
+        "DATA_DIR": str(workdir), # Songs, caches, logs and the "current project" stay out of backend/
+        "TASK_STORE_BACKEND": "memory",
+        "ANALYSIS_BACKFILL": "false",
+        "WARMUP_ENABLED": "false", # warm_up() below loads and times the pipeline itself
+        "MODELS_DIR": str(models_dir if mode == "real" else workdir / "models"),
+        "MODEL_SNAPSHOT_DIR": str(BACKEND_DIR / "model_snapshots" if mode == "real" else workdir / "model_snapshots"),
+        # The stand-in has no weight files to snapshot
+        "MODEL_SNAPSHOTS": os.environ.get("MODEL_SNAPSHOTS", "true") if mode == "real" else "false",
+    })
+    os.chdir(workdir)
+    if mode == "standin":
+        standin.install()
+
+    from loguru import logger
+    # Importing the app's logger installs its sinks, so it has to happen before they're replaced
+    from app.utils.logger import log_path
+    if not verbose:
+        # Keep the file log the app normally writes, drop the console chatter
+        logger.remove()
+        logger.add(log_path / "kuno_app.log", level="DEBUG")
+        logger.add(sys.stderr, level="WARNING")
+
+
+@contextlib.contextmanager
+def quiet_stdout():
+    """Point fd 1 at /dev/null: task output is echoed to sys.__stdout__, not sys.stdout."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.__stdout__.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def song(scenario: dict, round_index: int, index: int) -> dict:
+    # Unseeded: no render cache hits, and every song of a round can share a batch
+    return {
+        "title": f"Bench {scenario['name']} {round_index}-{index}",
+        "genre": "Synthwave",
+        "bpm": 110,
+        "duration_target": scenario["duration"],
+        "structure": [
+            {"type": "Verse", "bars": 8, "text": f"Benchmark take {round_index} {index}, steady as it goes"},
+            {"type": "Chorus", "bars": 8, "text": "Measure twice and render once"},
+        ],
+    }
+
+
+@contextlib.contextmanager
+def scenario_settings(scenario: dict):
+    """Apply a scenario's batch size and enhancer toggle for its duration."""
+    from app.engine.scheduler import generation_scheduler
+    from app.routers.generation import enhancer
+
+    previous_batch = generation_scheduler.max_batch
+    generation_scheduler.max_batch = scenario["batch"]
+    if not scenario["enhance"]:
+        def passthrough(input_path, output_path, enable_upscale=True, cancel_token=None):
+            shutil.copyfile(input_path, output_path)
+            return output_path, enhancer._fingerprint(upscale=False, mastering=False)
+        enhancer.enhance = passthrough
+    try:
+        yield
+    finally:
+        generation_scheduler.max_batch = previous_batch
+        enhancer.__dict__.pop("enhance", None)
+
+
+def wait_for(client, task_ids: list, status_ms: list, timeout: float) -> dict:
+    """Poll /status until every task is terminal; returns the final records."""
+    pending, records = set(task_ids), {}
+    deadline = time.time() + timeout
+    while pending:
+        if time.time() > deadline:
+            raise TimeoutError(f"{len(pending)} task(s) still running after {timeout:.0f}s")
+        for task_id in sorted(pending):
+            start = time.perf_counter()
+            record = client.get(f"/api/v1/status/{task_id}", params={"limit": 1}).json()
+            status_ms.append((time.perf_counter() - start) * 1000)
+            if record["status"] in ("completed", "failed", "cancelled"):
+                records[task_id] = record
+                pending.discard(task_id)
+        time.sleep(POLL_INTERVAL)
+    return records
+
+
+def run_scenario(client, scenario: dict, timeout: float) -> dict:
+    from app.engine.scheduler import generation_scheduler
+
+    latencies, submit_ms, status_ms = [], [], []
+    failures, wall = 0, 0.0
+    with scenario_settings(scenario), RssSampler() as rss:
+        for round_index in range(scenario["repeats"]):
+            # Hold the worker so the whole round arrives at once
+            generation_scheduler.stop()
+            task_ids = []
+            try:
+                for index in range(scenario["concurrency"]):
+                    start = time.perf_counter()
+                    response = client.post("/api/v1/generate", json=song(scenario, round_index, index))
+                    submit_ms.append((time.perf_counter() - start) * 1000)
+                    response.raise_for_status()
+                    task_ids.append(response.json()["task_id"])
+            finally:
+                released = time.time()
+                generation_scheduler.start()
+            records = wait_for(client, task_ids, status_ms, timeout)
+            for record in records.values():
+                if record["status"] == "completed":
+                    latencies.append(record["updated_at"] - released)
+                else:
+                    failures += 1
+            wall += max(record["updated_at"] for record in records.values()) - released
+    return report.summarize(scenario, latencies, wall, rss.peak, submit_ms, status_ms, failures)
+
+
+def warm_up(client, timeout: float) -> float:
+    """Load the pipeline (returns the load time) and push one short song through every stage."""
+    from app.main import app as api
+    from app.routers.generation import heartmula
+
+    # Startup starts the stage workers; held rounds must not race it
+    deadline = time.monotonic() + timeout
+    while api.state.status in ("initializing", "warming") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    start = time.perf_counter()
+    heartmula.load_pipeline()
+    load_seconds = time.perf_counter() - start
+    run_scenario(client, scenario_sets.scenario("warmup", duration=2, repeats=1), timeout)
+    return load_seconds
+
+
+def run(mode: str, chosen: list, timeout_scale: float) -> dict:
+    from fastapi.testclient import TestClient
+    import app.main
+    from app.main import app as api
+
+    if mode == "standin":
+        # Nothing to download or verify for the stand-in
+        app.main.ensure_models_available = lambda: None
+
+    results = {
+        "mode": mode,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": report.machine_info(),
+        "profile": standin.StandInPipeline.profile if mode == "standin" else None,
+        "scenarios": {},
+    }
+    with TestClient(api) as client:
+        results["load_seconds"] = round(warm_up(client, 600 * timeout_scale), 3)
+        for scenario in chosen:
+            print(f"Running {scenario['name']} ({scenario['repeats']} x {scenario['concurrency']} x "
+                  f"{scenario['duration']}s, batch {scenario['batch']}, "
+                  f"enhancer {'on' if scenario['enhance'] else 'off'})...", file=sys.stderr, flush=True)
+            # Generous: a stalled pipeline should fail the run, a slow machine shouldn't
+            timeout = timeout_scale * (120 + 30 * scenario["duration"] * scenario["concurrency"])
+            results["scenarios"][scenario["name"]] = run_scenario(client, scenario, timeout)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Kuno generation benchmarks.")
+    parser.add_argument("--mode", choices=("standin", "real"), default="standin")
+    parser.add_argument("--scenarios", help="Comma-separated scenario names (default: all for the mode)")
+    parser.add_argument("--repeats", type=int, help="Override every scenario's repeat count")
+    parser.add_argument("--out", help="Results JSON (default: benchmarks/results/<mode>-<time>.json)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run as the baseline")
+    parser.add_argument("--models-dir", default=str(BACKEND_DIR / "models"), help="Weights for --mode real")
+    parser.add_argument("--workdir", help="Scratch directory for app state (default: a temp dir, removed after)")
+    parser.add_argument("--timeout-scale", type=float, default=1.0, help="Multiply per-scenario timeouts")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's console logging")
+    parser.add_argument("--list", action="store_true", help="List the mode's scenarios and exit")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()] if args.scenarios else None
+    chosen = scenario_sets.select(args.mode, names, args.repeats)
+    if args.list:
+        for scenario in chosen:
+            print(scenario)
+        return 0
+
+    models_dir = Path(args.models_dir).resolve()
+    if args.mode == "real":
+        reason = real_weights_missing(models_dir)
+        if reason:
+            print(f"Skipping real-weight benchmarks: {reason}.")
+            return 0
+
+    out = Path(args.out).resolve() if args.out else RESULTS_DIR / f"{args.mode}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    baseline_path = Path(args.baseline).resolve()
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix="kuno_bench_"))
+    cwd = os.getcwd()
+    try:
+        prepare(args.mode, workdir, models_dir, args.verbose)
+        with contextlib.nullcontext() if args.verbose else quiet_stdout():
+            results = run(args.mode, chosen, args.timeout_scale)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report.save(results, str(out))
+    print(report.format_table(results))
+    print(f"Results written to {out}")
+
+    if args.update_baseline:
+        baseline = dict(results, tolerances={k: list(v) for k, v in report.DEFAULT_TOLERANCES.items()})
+        if baseline_path.exists():
+            # Keep hand-tuned tolerances
+            baseline["tolerances"] = report.load(str(baseline_path)).get("tolerances", baseline["tolerances"])
+        report.save(baseline, str(baseline_path))
+        print(f"Baseline updated: {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --update-baseline to create one.")
+        return 0
+    baseline = report.load(str(baseline_path))
+    if baseline.get("mode") != args.mode:
+        print(f"Baseline {baseline_path} is for mode '{baseline.get('mode')}'; not comparing.")
+        return 0
+    comparison = report.compare(results, baseline)
+    print(report.format_comparison(comparison))
+    return 1 if comparison["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Benchmark scenarios. Each round submits `concurrency` songs of
+`duration` seconds at once; `batch` is the generation scheduler's
+max_batch for the scenario, `enhance` toggles the enhancement stage.
+"""
+
+
+def scenario(name: str, duration: int = 10, concurrency: int = 1, batch: int = 1, enhance: bool = True,
+             repeats: int = 3) -> dict:
+    return {
+        "name": name,
+        "duration": duration,
+        "concurrency": concurrency,
+        "batch": batch,
+        "enhance": enhance,
+        "repeats": repeats,
+    }
+
+
+STANDIN_SCENARIOS = [
+    # Duration: per-frame cost, KV growth, decode and enhancement scaling
+    scenario("duration-10s", duration=10),
+    scenario("duration-30s", duration=30),
+    scenario("duration-60s", duration=60, repeats=2),
+    # Concurrency: jobs queue behind one device worker (latency tail, stage overlap)
+    scenario("concurrency-2", concurrency=2),
+    scenario("concurrency-4", concurrency=4),
+    # Batching: concurrent jobs sharing one frame loop
+    scenario("batch-2", concurrency=2, batch=2),
+    scenario("batch-4", concurrency=4, batch=4),
+    # Generation alone, without the enhancement stage
+    scenario("enhancer-off", enhance=False),
+    scenario("enhancer-off-concurrency-4", concurrency=4, enhance=False),
+]
+
+# Real weights are slow: durations and the enhancer toggle only, one pass each
+REAL_SCENARIOS = [
+    scenario("duration-10s", duration=10, repeats=1),
+    scenario("duration-30s", duration=30, repeats=1),
+    scenario("enhancer-off", enhance=False, repeats=1),
+    scenario("batch-2", concurrency=2, batch=2, repeats=1),
+]
+
+SCENARIOS = {"standin": STANDIN_SCENARIOS, "real": REAL_SCENARIOS}
+
+
+def select(mode: str, names=None, repeats=None) -> list:
+    """Scenarios for a mode, optionally filtered by name and with repeats overridden."""
+    chosen = SCENARIOS[mode]
+    if names:
+        unknown = set(names) - {s["name"] for s in chosen}
+        if unknown:
+            raise ValueError(f"Unknown {mode} scenario(s): {', '.join(sorted(unknown))}")
+        chosen = [s for s in chosen if s["name"] in names]
+    if repeats:
+        chosen = [dict(s, repeats=repeats) for s in chosen]
+    return chosen
@@ -0,0 +1,211 @@
+"""
+Deterministic stand-in for heartlib's HeartMuLaGenPipeline.
+
+It exposes everything Kuno drives (from_pretrained, __call__, preprocess,
+config, mula.setup_caches / generate_frame, codec.detokenize) and costs
+roughly what the real model costs per unit of work, just scaled down:
+
+- every frame step streams all backbone weights once (memory-bound, like
+  autoregressive decoding), so extra batch rows are cheap and longer
+  prompts only cost at prefill;
+- attention reads the KV cache up to the current position, so later
+  frames are a little slower than early ones;
+- KV caches are allocated per batch row, the codec runs a fixed number of
+  refinement passes per decoded frame.
+
+Tokens come from per-row generators seeded by the prompt, so the same
+request always yields the same frames (and the same audio) no matter how
+it was batched. The stand-in never emits EOS: every job runs its full
+frame budget, which keeps runs comparable.
+"""
+import hashlib
+import sys
+import time
+import types
+
+import numpy as np
+import soundfile as sf
+import torch
+
+SAMPLES_PER_FRAME = 3840 # 80 ms at 48 kHz
+CODEBOOKS = 8
+VOCAB = 8192
+
+# Scaled-down 3B: 16 x 1024^2 float32 backbone (64 MB streamed per frame step)
+DEFAULT_PROFILE = {
+    "hidden": 1024,
+    "layers": 16,
+    "kv_frames": 1600, # KV cache positions per row (prompt + frames)
+    "codec_hidden": 512,
+    "decode_steps": 16, # Codec refinement passes per decode
+    "seed": 0,
+}
+
+
+def prompt_seed(tokens: torch.Tensor) -> int:
+    """Stable seed from a prompt row's tokens (independent of padding and batch layout)."""
+    values = tokens[tokens != 0].to(torch.int64).cpu().numpy().tobytes()
+    return int.from_bytes(hashlib.sha1(values).digest()[:8], "little")
+
+
+class StandInConfig:
+    empty_id = 0
+    audio_eos_id = VOCAB + 1 # Never sampled
+
+
+class StandInMula(torch.nn.Module):
+    def __init__(self, profile: dict):
+        super().__init__()
+        g = torch.Generator().manual_seed(profile["seed"])
+        hidden = profile["hidden"]
+        scale = hidden ** -0.5
+        self.embed = torch.nn.Parameter(torch.randn(VOCAB + 2, hidden, generator=g) * scale, requires_grad=False)
+        self.backbone = torch.nn.Parameter(
+            torch.randn(profile["layers"], hidden, hidden, generator=g) * scale, requires_grad=False)
+        self.kv_frames = profile["kv_frames"]
+        self.cache = None
+        self.position = 0
+        self.generators = []
+        self.steps = 0
+
+    def setup_caches(self, bs: int):
+        self.cache = torch.zeros(bs, self.kv_frames, self.backbone.shape[-1])
+        self.position = 0
+        self.generators = []
+
+    def reset_caches(self):
+        self.cache = None
+        self.generators = []
+
+    def generate_frame(self, tokens, tokens_mask, input_pos, temperature, topk, cfg_scale,
+                       continuous_segments=None, starts=None):
+        bs = self.cache.shape[0]
+        rows = bs // 2 if cfg_scale != 1.0 else bs
+        if not self.generators:
+            # Prefill: one generator per request, seeded by its prompt
+            self.generators = [torch.Generator().manual_seed(prompt_seed(tokens[i])) for i in range(rows)]
+        if tokens.shape[0] < bs:
+            tokens = tokens.repeat(bs // tokens.shape[0], 1, 1)
+
+        x = self.embed[tokens.clamp(0, VOCAB + 1)].sum(dim=-2) # [bs, L, hidden]
+        h = torch.tanh(x @ self.backbone[0]).mean(dim=1) # Prefill cost scales with L
+        length = min(self.position, self.kv_frames)
+        for layer in self.backbone[1:]:
+            h = torch.tanh(h @ layer)
+            if length:
+                context = self.cache[:, :length]
+                weights = torch.softmax(torch.einsum("bd,btd->bt", h, context), dim=-1)
+                h = h + torch.einsum("bt,btd->bd", weights, context)
+        self.cache[:, self.position % self.kv_frames] = h
+        self.position += 1
+        self.steps += 1
+
+        return torch.stack([
+            torch.randint(0, VOCAB, (CODEBOOKS,), generator=g) for g in self.generators
+        ])
+
+
+class StandInCodec(torch.nn.Module):
+    def __init__(self, profile: dict):
+        super().__init__()
+        g = torch.Generator().manual_seed(profile["seed"] + 1)
+        hidden = profile["codec_hidden"]
+        scale = hidden ** -0.5
+        self.codebook = torch.nn.Parameter(torch.randn(VOCAB, hidden, generator=g) * scale, requires_grad=False)
+        self.refine = torch.nn.Parameter(
+            torch.randn(profile["decode_steps"], hidden, hidden, generator=g) * scale, requires_grad=False)
+        self.out = torch.nn.Parameter(torch.randn(hidden, SAMPLES_PER_FRAME, generator=g) * scale,
+                                      requires_grad=False)
+
+    def detokenize(self, codes: torch.Tensor) -> torch.Tensor:
+        """[8, T] codes -> [2, T * 3840] audio at 48 kHz."""
+        h = self.codebook[codes.long().clamp(0, VOCAB - 1)].sum(dim=0) # [T, hidden]
+        for layer in self.refine:
+            h = h + torch.tanh(h @ layer)
+        mono = (0.1 * torch.tanh(h @ self.out)).reshape(-1)
+        return torch.stack([mono, torch.roll(mono, 1)])
+
+
+class StandInPipeline:
+    """Drop-in for heartlib.HeartMuLaGenPipeline (see module docstring)."""
+
+    profile = dict(DEFAULT_PROFILE)
+    sample_rate = 48000
+
+    def __init__(self, profile: dict):
+        self.config = StandInConfig()
+        self.mula = StandInMula(profile)
+        self.codec = StandInCodec(profile)
+        self.mula_device = torch.device("cpu")
+        self.mula_dtype = torch.float32
+
+    @classmethod
+    def from_pretrained(cls, path, device=None, dtype=None, version="3B", lazy_load=False, **kwargs):
+        return cls(cls.profile)
+
+    def preprocess(self, inputs: dict, cfg_scale: float) -> dict:
+        text = f"{inputs.get('tags', '')}\n{inputs.get('lyrics', '')}".encode("utf-8")
+        ids = torch.tensor([1 + b for b in text] or [1], dtype=torch.long)
+        rows = 2 if cfg_scale != 1.0 else 1
+        tokens = torch.zeros(rows, len(ids), CODEBOOKS + 1, dtype=torch.long)
+        tokens[0, :, -1] = ids
+        if rows == 2:
+            tokens[1, :, -1] = 1 # Unconditional row: blank prompt
+        mask = torch.zeros_like(tokens, dtype=torch.bool)
+        mask[..., -1] = True
+        return {
+            "tokens": tokens,
+            "tokens_mask": mask,
+            "muq_embed": torch.zeros(rows, 512),
+            "muq_idx": [len(ids) - 1] * rows,
+            "pos": torch.arange(len(ids)).unsqueeze(0).repeat(rows, 1),
+        }
+
+    def __call__(self, inputs: dict, max_audio_length_ms: int, save_path: str, topk: int = 50,
+                 temperature: float = 1.0, cfg_scale: float = 1.5, progress_callback=None, **kwargs):
+        from app.engine.frame_loop import FRAME_MS # Not at import time: run.prepare() configures the app first
+
+        total = max(1, max_audio_length_ms // FRAME_MS)
+        prompt = self.preprocess(inputs, cfg_scale)
+        self.mula.setup_caches(prompt["tokens"].shape[0])
+        frames = []
+        tokens = prompt["tokens"]
+        for step in range(total):
+            curr = self.mula.generate_frame(tokens, prompt["tokens_mask"], prompt["pos"], temperature, topk,
+                                            cfg_scale)
+            frames.append(curr[0])
+            if progress_callback:
+                progress_callback(step + 1, total)
+            tokens = torch.zeros(curr.shape[0], 1, CODEBOOKS + 1, dtype=torch.long)
+            tokens[:, 0, :-1] = curr
+        wav = self.codec.detokenize(torch.stack(frames).transpose(0, 1))
+        sf.write(save_path, wav.numpy().T, self.sample_rate)
+
+
+def install(profile: dict = None):
+    """Register the stand-in as `heartlib` (before anything imports app.engine.heartmula)."""
+    StandInPipeline.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+    module = types.ModuleType("heartlib")
+    module.HeartMuLaGenPipeline = StandInPipeline
+    module.__stand_in__ = True
+    sys.modules["heartlib"] = module
+    return module
+
+
+def frame_cost(profile: dict = None, steps: int = 50, rows: int = 2) -> float:
+    """Seconds per frame step on this machine (for sizing a profile)."""
+    mula = StandInMula(dict(DEFAULT_PROFILE, **(profile or {})))
+    mula.setup_caches(rows)
+    tokens = torch.ones(rows, 1, CODEBOOKS + 1, dtype=torch.long)
+    with torch.no_grad():
+        mula.generate_frame(tokens, None, None, 1.0, 50, 1.5)
+        start = time.perf_counter()
+        for _ in range(steps):
+            mula.generate_frame(tokens, None, None, 1.0, 50, 1.5)
+    return (time.perf_counter() - start) / steps
+
+
+def checksum(path: str) -> str:
+    """Digest of a rendered file's samples (determinism checks)."""
+    audio, _ = sf.read(path, dtype="float32")
+    return hashlib.sha1(np.ascontiguousarray(audio).tobytes()).hexdigest()
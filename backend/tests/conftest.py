@@ -0,0 +1,12 @@
+import os
+import shutil
+import tempfile
+
+# Runs before any test module imports `app`: the module-level stores, caches,
+# logs and project state then live in a scratch dir instead of backend/
+DATA_DIR = tempfile.mkdtemp(prefix="kuno_tests_")
+os.environ["DATA_DIR"] = DATA_DIR
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
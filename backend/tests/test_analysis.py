@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from app.engine import analysis
+from app.engine.analysis import SAMPLES_PER_PEAK, TrackAnalyzer, analyze_file, read_header, read_waveform
+
+RATE = 48000
+
+
+def tone(seconds, amplitude, freq=997.0, rate=RATE):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def run(audio, block=10000):
+    analyzer = TrackAnalyzer(RATE, audio.shape[1])
+    for i in range(0, len(audio), block):
+        analyzer.feed(audio[i:i + block])
+    return analyzer.finish()
+
+
+def test_loudness_matches_bs1770_reference():
+    # Full-scale 997 Hz sine in one channel of a stereo pair reads -3.01 LKFS
+    x = tone(5, 1.0)
+    assert abs(run(np.stack([x, np.zeros_like(x)], axis=1))["integrated_lufs"] + 3.01) < 0.02
+    x = tone(5, 0.1)
+    assert abs(run(np.stack([x, x], axis=1))["integrated_lufs"] + 20.0) < 0.05
+
+
+def test_true_peak_sees_intersample_overs():
+    # fs/4 at 45 degrees: samples hit 0.707 of the real peak (-3 dB)
+    t = np.arange(RATE) / RATE
+    x = (0.5 * np.sin(2 * np.pi * RATE / 4 * t + np.pi / 4)).astype(np.float32)
+    result = run(np.stack([x, x], axis=1))
+    assert abs(result["sample_peak_dbfs"] + 9.03) < 0.05
+    assert abs(result["true_peak_dbtp"] + 6.02) < 0.1
+
+
+def test_block_size_does_not_change_results():
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((RATE * 3 + 123, 2)) * 0.1).astype(np.float32)
+    a, b = run(audio, block=4096), run(audio, block=77777)
+    for key in ("integrated_lufs", "true_peak_dbtp", "spectral_centroid_hz", "spectral_bandwidth_hz"):
+        assert abs(a[key] - b[key]) < 1e-6
+    np.testing.assert_array_equal(a["peaks"][0], b["peaks"][0])
+    assert len(a["peaks"][0]) == -(-len(audio) // SAMPLES_PER_PEAK)
+
+
+def test_spectral_stats_track_bandwidth():
+    rng = np.random.default_rng(1)
+    full = (rng.standard_normal((RATE * 2, 1)) * 0.1).astype(np.float32)
+    narrow = tone(2, 0.5, freq=2000.0)[:, None]
+    wide, low = run(full), run(narrow)
+    assert abs(low["spectral_centroid_hz"] - 2000) < 30
+    assert low["spectral_bandwidth_hz"] < 200 < wide["spectral_bandwidth_hz"]
+    assert wide["spectral_rolloff_hz"] > 20000 > low["spectral_rolloff_hz"]
+
+
+def test_sidecar_pyramid_and_waveform(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis.settings, "ANALYSIS_DIR", str(tmp_path / "sidecars"))
+    # 10 s of silence with a single click at 2.5 s
+    audio = np.zeros((RATE * 10, 2), dtype=np.float32)
+    audio[int(RATE * 2.5)] = [0.8, -0.6]
+    song = str(tmp_path / "song.wav")
+    sf.write(song, audio, RATE, subtype="FLOAT")
+
+    header = analysis.ensure_analysis(song)
+    sidecar = analysis.sidecar_path(song)
+    assert header == read_header(sidecar)
+    assert os.path.getsize(sidecar) < RATE * 10 * 8 / 100 # Far smaller than the audio
+    counts = [level["count"] for level in header["levels"]]
+    assert counts[0] == -(-RATE * 10 // SAMPLES_PER_PEAK)
+    assert all(b == -(-a // 2) for a, b in zip(counts, counts[1:]))
+
+    wave = read_waveform(sidecar, pixels=100)
+    assert wave["pixels"] == 100
+    assert wave["samples_per_peak"] > SAMPLES_PER_PEAK # Coarse level for a full view
+    click = 25 # 2.5 s of 10 s across 100 pixels
+    assert max(wave["max"]) == wave["max"][click] and abs(wave["max"][click] - 0.8) < 1e-3
+    assert abs(wave["min"][click] + 0.6) < 1e-3
+    assert sum(1 for v in wave["max"] if v > 0) == 1
+
+    # Zoomed in on 100 ms around the click: finest level, fewer buckets than pixels
+    zoom = read_waveform(sidecar, pixels=1000, start=2.45, end=2.55)
+    assert zoom["samples_per_peak"] == SAMPLES_PER_PEAK
+    assert zoom["pixels"] <= 20 and max(zoom["max"]) > 0.79
+
+    # Fresh sidecar is reused; a changed song is re-analyzed
+    assert analysis.ensure_analysis(song) == header
+    sf.write(song, audio[: RATE * 5], RATE, subtype="FLOAT")
+    assert analysis.ensure_analysis(song)["duration"] == 5.0
+
+
+def test_backfill(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis.settings, "ANALYSIS_DIR", str(tmp_path / "sidecars"))
+    songs = []
+    for name in ("a.wav", "b.wav"):
+        songs.append(str(tmp_path / name))
+        sf.write(songs[-1], np.stack([tone(1, 0.2)] * 2, axis=1), RATE)
+    analyze_file(songs[0], analysis.sidecar_path(songs[0]))
+    assert analysis.backfill(songs + [str(tmp_path / "gone.wav")]) == 1
+    assert analysis.backfill(songs) == 0
+
+
+def test_concurrent_requests_analyze_once_and_release_the_lock(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(analysis.settings, "ANALYSIS_DIR", str(tmp_path / "sidecars"))
+    song = str(tmp_path / "song.wav")
+    sf.write(song, np.stack([tone(1, 0.2)] * 2, axis=1), RATE)
+    calls = []
+    real = analysis.analyze_file
+    monkeypatch.setattr(analysis, "analyze_file", lambda *args: calls.append(args) or real(*args))
+
+    threads = [threading.Thread(target=analysis.ensure_analysis, args=(song,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    # No lock kept per song ever analyzed
+    assert analysis._locks == {}
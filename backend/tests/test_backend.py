@@ -2,7 +2,10 @@ import pytest
 from unittest.mock import MagicMock, patch
 from fastapi.testclient import TestClient
 import numpy as np
+import asyncio
 import sys
+import threading
+import time
 
 # Mock torch_directml if missing for tests
 sys.modules['torch_directml'] = MagicMock()
@@ -46,3 +49,206 @@ def test_generation_flow(mock_heartmula):
         
         # Note: Background tasks are not awaited by TestClient by default in this verification style
         # unless we explicitly run them. For API validity, this is enough.
+
+def test_task_waiting_for_enhancement_reports_queue_and_cancels():
+    from app.engine.scheduler import enhancement_scheduler
+    from app.routers.generation import update_task
+
+    enhancement_scheduler.stop() # Hold the job in the queue
+    try:
+        update_task("handoff", {"status": "waiting_enhancement"})
+        enhancement_scheduler.submit("handoff", lambda token: None)
+        assert client.get("/api/v1/status/handoff").json()["queue_position"] == 0
+
+        assert client.delete("/api/v1/tasks/handoff").json()["status"] == "cancelled"
+        status = client.get("/api/v1/status/handoff").json()
+        assert status["status"] == "cancelled"
+        assert status["message"] == "Cancelled before enhancement."
+    finally:
+        enhancement_scheduler.start()
+
+def events_app():
+    """The generation router on its own, with the event bus attached to the test client's loop."""
+    from fastapi import FastAPI
+    from app.routers import generation
+    from app.utils.task_events import task_events
+
+    api = FastAPI()
+    api.include_router(generation.router, prefix="/api/v1")
+
+    @api.on_event("startup")
+    async def attach_events():
+        task_events.attach(asyncio.get_running_loop())
+
+    @api.on_event("shutdown")
+    async def detach_events():
+        task_events.attach(None)
+
+    return api
+
+def test_task_events_stream_coalesces_progress_until_the_task_ends():
+    from app.routers.generation import update_task
+    from app.utils.task_events import task_events
+
+    update_task("sse", {"status": "generating", "progress": 0})
+
+    def worker():
+        deadline = time.time() + 5
+        while not task_events._subscribers and time.time() < deadline:
+            time.sleep(0.01)
+        for i in range(1, 51):
+            update_task("sse", {"progress": i}, durable=False)
+        update_task("sse", {"status": "completed", "progress": 100})
+
+    with TestClient(events_app()) as events_client:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        response = events_client.get("/api/v1/events/sse")
+        thread.join()
+        # Already finished: the snapshot alone, then the stream ends
+        finished = events_client.get("/api/v1/events/sse")
+        missing = events_client.get("/api/v1/events/no-such-task")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    events = [block.split("\n")[0].removeprefix("event: ") for block in response.text.strip().split("\n\n")]
+    assert events[0] == "snapshot" and events[-1] == "stage"
+    assert '"status": "completed"' in response.text
+    # 50 progress updates in one burst reach the client as a handful of events
+    assert 1 <= events.count("progress") < 10
+    assert finished.text.startswith("event: snapshot") and finished.text.count("event:") == 1
+    assert missing.status_code == 404
+
+def test_cancelling_a_running_task_trips_its_token():
+    from app.engine.scheduler import generation_scheduler
+    from app.routers.generation import update_task
+
+    started, stopped = threading.Event(), threading.Event()
+
+    def job(token):
+        started.set()
+        while not token.cancelled:
+            time.sleep(0.01)
+        stopped.set()
+
+    update_task("running", {"status": "generating"})
+    generation_scheduler.submit("running", job)
+    assert started.wait(30)
+
+    response = client.delete("/api/v1/tasks/running")
+    assert response.status_code == 200
+    assert response.json() == {"task_id": "running", "status": "cancelling"}
+    # The job stops at its next check; the record says so until it has unwound
+    assert stopped.wait(5)
+    assert client.get("/api/v1/status/running").json()["message"] == "Cancelling..."
+
+    update_task("running", {"status": "cancelled"})
+    assert client.delete("/api/v1/tasks/running").status_code == 409
+    assert client.delete("/api/v1/tasks/no-such-task").status_code == 404
+
+def test_audio_range_and_conditional_requests():
+    import os
+    import soundfile as sf
+    from app.config import settings
+
+    os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
+    sf.write(os.path.join(settings.OUTPUT_DIR, "range_test.wav"), np.zeros((8000, 1)), 8000)
+    size = os.path.getsize(os.path.join(settings.OUTPUT_DIR, "range_test.wav"))
+
+    full = client.get("/api/v1/audio/range_test.wav")
+    assert full.status_code == 200
+    assert full.headers["content-type"] == "audio/wav"
+    assert full.headers["accept-ranges"] == "bytes"
+    assert len(full.content) == size
+
+    part = client.get("/api/v1/audio/range_test.wav", headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 100-199/{size}"
+    assert part.content == full.content[100:200]
+
+    etag = full.headers["etag"]
+    cached = client.get("/api/v1/audio/range_test.wav", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag and cached.content == b""
+    since = client.get("/api/v1/audio/range_test.wav", headers={"If-Modified-Since": full.headers["last-modified"]})
+    assert since.status_code == 304
+
+    assert client.get("/api/v1/audio/range_test.wav?format=aiff").status_code == 400
+    assert client.get("/api/v1/audio/..%2Fsecrets.wav").status_code == 404
+    assert client.get("/api/v1/audio/missing.wav").status_code == 404
+
+def test_library_pages_and_search_report_the_total():
+    import os
+    import soundfile as sf
+    from app.config import settings
+    from app.utils.library import library
+
+    os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
+    for title in ("Alpha", "Bravo", "Charlie"):
+        path = os.path.join(settings.OUTPUT_DIR, f"{title.lower()}_zebracore.wav")
+        sf.write(path, np.zeros((800, 1)), 8000)
+        library.record_song(path, request={"title": title, "genre": "Zebracore", "bpm": 120, "structure": []})
+
+    first = client.get("/api/v1/library", params={"q": "zebracore", "sort": "title", "order": "asc", "limit": 2})
+    assert first.status_code == 200
+    assert first.headers["x-total-count"] == "3"
+    assert [song["title"] for song in first.json()] == ["Alpha", "Bravo"]
+    rest = client.get("/api/v1/library", params={"q": "zebracore", "sort": "title", "order": "asc",
+                                                 "limit": 2, "offset": 2})
+    assert rest.headers["x-total-count"] == "3"
+    assert [song["title"] for song in rest.json()] == ["Charlie"]
+    assert rest.json()[0]["path"] == os.path.join(library.output_dir, "charlie_zebracore.wav")
+
+    none = client.get("/api/v1/library", params={"q": "no such words"})
+    assert none.headers["x-total-count"] == "0" and none.json() == []
+    assert client.get("/api/v1/library", params={"sort": "loudness"}).status_code == 422
+
+def test_upload_audio_rejects_oversized_and_non_audio(monkeypatch):
+    import io
+    import soundfile as sf
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "UPLOAD_MAX_MB", 0.1)
+    wav = io.BytesIO()
+    sf.write(wav, np.zeros((4000, 1)), 8000, format="WAV")
+    files = {"file": ("take.wav", wav.getvalue(), "audio/wav")}
+
+    first = client.post("/api/v1/upload_audio", files=files)
+    assert first.status_code == 200
+    assert first.json()["filename"] == "take.wav" and first.json()["deduplicated"] is False
+    again = client.post("/api/v1/upload_audio", files=files)
+    assert again.json()["deduplicated"] is True and again.json()["path"] == first.json()["path"]
+
+    # Declared length past the limit: refused before the body is read
+    huge = client.post("/api/v1/upload_audio", files={"file": ("huge.wav", b"\0" * 400_000, "audio/wav")})
+    assert huge.status_code == 413
+    # Within the multipart allowance but over the limit: refused while streaming
+    over = client.post("/api/v1/upload_audio", files={"file": ("over.wav", b"\0" * 120_000, "audio/wav")})
+    assert over.status_code == 413
+    text = client.post("/api/v1/upload_audio", files={"file": ("notes.txt", b"not audio", "text/plain")})
+    assert text.status_code == 415
+
+def test_stats_serve_the_latest_sample_and_history():
+    from app.utils.telemetry import telemetry
+
+    telemetry.record()
+    response = client.get("/api/v1/stats", params={"history": 60})
+    assert response.status_code == 200
+    body = response.json()
+    assert {"cpu", "ram", "gpu", "vram", "status", "sample"} <= set(body)
+    assert body["history"] and body["history"][-1]["timestamp"] == body["sample"]["timestamp"]
+    assert "history" not in client.get("/api/v1/stats").json()
+
+def test_metrics_exposition():
+    from app.utils.metrics import TASKS
+
+    TASKS.inc(status="completed")
+    response = client.get("/api/v1/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert "# TYPE kuno_tasks_total counter" in response.text
+    assert 'kuno_tasks_total{status="completed"}' in response.text
+    assert "# TYPE kuno_queue_depth gauge" in response.text
+    assert 'kuno_queue_depth{stage="generation"}' in response.text
+    assert "# TYPE kuno_token_generation_seconds histogram" in response.text
@@ -0,0 +1,65 @@
+import pytest
+import torch
+
+from app.engine.frame_loop import FrameRequest, run_batched_frames, supports_batching
+from benchmarks.report import compare, percentile
+from benchmarks.standin import StandInPipeline
+
+TINY = {"hidden": 32, "layers": 2, "kv_frames": 64, "codec_hidden": 16, "decode_steps": 1, "seed": 0}
+
+
+def test_standin_frames_do_not_depend_on_batching(tmp_path):
+    pipeline = StandInPipeline(TINY)
+    assert supports_batching(pipeline)
+    prompts = [{"tags": "pop", "lyrics": "[Verse] one"}, {"tags": "rock", "lyrics": "[Chorus] two, longer"}]
+
+    alone = FrameRequest(prompts[1], 400)
+    run_batched_frames(pipeline, [alone], temperature=1.0, topk=50, cfg_scale=1.5)
+    batched = [FrameRequest(p, 400) for p in prompts]
+    run_batched_frames(pipeline, batched, temperature=1.0, topk=50, cfg_scale=1.5)
+
+    assert len(alone.frames) == 5 # Never stops early: full frame budget
+    assert torch.equal(alone.frames_tensor(), batched[1].frames_tensor())
+    assert not torch.equal(batched[0].frames_tensor(), batched[1].frames_tensor())
+    assert pipeline.codec.detokenize(alone.frames_tensor()).shape == (2, 5 * 3840)
+
+    # The opaque __call__ path renders the same song
+    progress = []
+    pipeline(prompts[1], 400, str(tmp_path / "song.wav"), progress_callback=lambda c, t: progress.append(c))
+    assert progress == [1, 2, 3, 4, 5]
+
+
+def results(mode="standin", **metrics):
+    scenario = {"rtf": 0.1, "latency_p50": 1.0, "peak_rss_mb": 900.0, "status_ms_p50": 1.0, "failures": 0}
+    scenario.update(metrics)
+    return {"mode": mode, "scenarios": {"duration-10s": scenario}}
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = results()
+    report = compare(results(rtf=0.115, latency_p50=1.5, status_ms_p50=2.5), baseline)
+    assert {r["metric"] for r in report["regressions"]} == {"latency_p50"}
+    # rtf is within 20%; the 1.5 ms status slowdown is under the 2 ms floor
+
+    report = compare(results(peak_rss_mb=700.0, failures=1), baseline)
+    assert [r["metric"] for r in report["regressions"]] == ["failures"]
+    assert [r["metric"] for r in report["improvements"]] == ["peak_rss_mb"]
+
+    custom = compare(results(rtf=0.115), dict(baseline, tolerances={"rtf": [0.05, 0.0]}))
+    assert [r["metric"] for r in custom["regressions"]] == ["rtf"]
+
+
+def test_compare_reports_new_and_missing_scenarios_and_checks_mode():
+    current = {"mode": "standin", "scenarios": {"batch-2": {"rtf": 0.1}}}
+    report = compare(current, results())
+    assert report["new"] == ["batch-2"] and report["missing"] == ["duration-10s"]
+    assert not report["regressions"]
+    with pytest.raises(ValueError):
+        compare(results(mode="real"), results())
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 95) == 95
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import soundfile as sf
+
+from app.engine.chunked_audio import plan_chunks, process_in_chunks
+from app.engine.scheduler import CancellationToken, JobScheduler, TaskCancelled
+import pytest
+
+
+def write_tone(path, seconds=5.3, sr=8000, channels=2):
+    t = np.arange(int(seconds * sr)) / sr
+    audio = np.stack([np.sin(2 * np.pi * 220 * t * (c + 1)) for c in range(channels)], axis=1).astype(np.float32)
+    sf.write(path, audio, sr, subtype="FLOAT")
+    return audio
+
+
+def test_plan_covers_track_with_overlaps():
+    plan = plan_chunks(1000, 300, 50)
+    assert plan[0] == (0, 300)
+    assert all(b[0] == a[0] + 250 for a, b in zip(plan, plan[1:]))
+    assert plan[-1][0] + plan[-1][1] == 1000
+    assert plan_chunks(100, 300, 50) == [(0, 100)]
+
+
+def test_identity_chunks_reconstruct_input(tmp_path):
+    src = tmp_path / "in.wav"
+    audio = write_tone(src)
+    seen = []
+    lock = threading.Lock()
+
+    def identity(chunk, sr, index):
+        with lock:
+            seen.append(len(chunk))
+        return chunk, sr
+
+    out = process_in_chunks(str(src), str(tmp_path / "out.wav"), identity, chunk_seconds=1.0,
+                            overlap_seconds=0.25, workers=3)
+    result, sr = sf.read(out, dtype="float32", always_2d=True)
+    assert sr == 8000
+    assert max(seen) == 8000 # Never more than one chunk per call
+    np.testing.assert_allclose(result, audio, atol=1e-6)
+
+
+def test_chunk_threads_share_the_stage_thread_count(tmp_path):
+    torch = pytest.importorskip("torch")
+    src = tmp_path / "in.wav"
+    write_tone(src)
+    stage = JobScheduler("enh", workers=1, max_queue=1, threads=4)
+    seen = set()
+    lock = threading.Lock()
+
+    def probe(chunk, sr, index):
+        with lock:
+            seen.add(torch.get_num_threads())
+        return chunk, sr
+
+    before = torch.get_num_threads()
+    try:
+        process_in_chunks(str(src), str(tmp_path / "out.wav"), probe, chunk_seconds=1.0, overlap_seconds=0.25,
+                          workers=2, initializer=stage.helper_initializer(2))
+    finally:
+        stage.stop(timeout=1)
+        torch.set_num_threads(before)
+    assert seen == {2}
+
+
+def test_resampling_chunks_and_cancellation(tmp_path):
+    src = tmp_path / "in.wav"
+    audio = write_tone(src, channels=1)
+
+    def upsample(chunk, sr, index):
+        return np.repeat(chunk, 2, axis=0), sr * 2
+
+    out = process_in_chunks(str(src), str(tmp_path / "up.wav"), upsample, chunk_seconds=1.0,
+                            overlap_seconds=0.25)
+    result, sr = sf.read(out, dtype="float32", always_2d=True)
+    assert sr == 16000
+    np.testing.assert_allclose(result, np.repeat(audio, 2, axis=0), atol=1e-6)
+
+    token = CancellationToken()
+
+    def cancel_on_second(chunk, sr, index):
+        if index == 1:
+            token.cancel()
+        return chunk, sr
+
+    with pytest.raises(TaskCancelled):
+        process_in_chunks(str(src), str(tmp_path / "c.wav"), cancel_on_second, chunk_seconds=1.0,
+                          overlap_seconds=0.25, cancel_token=token)
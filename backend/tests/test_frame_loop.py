@@ -0,0 +1,133 @@
+import pytest
+import torch
+
+from app.engine.frame_loop import FrameRequest, _collate, run_batched_frames, supports_batching
+from app.engine.scheduler import CancellationToken
+
+EOS = 100
+EMPTY = 0
+
+
+class FakeConfig:
+    audio_eos_id = EOS
+    empty_id = EMPTY
+
+
+class FakeMula:
+    """Row r emits frame value r+1 each step, EOS once its row hits `eos_at` steps."""
+
+    def __init__(self, eos_at):
+        self.eos_at = eos_at
+        self.batch_sizes = []
+        self.steps = 0
+        self.bs = None
+
+    def setup_caches(self, bs):
+        self.bs = bs
+        self.batch_sizes.append(bs)
+
+    def generate_frame(self, tokens, tokens_mask, input_pos, temperature, topk, cfg_scale,
+                       continuous_segments=None, starts=None):
+        assert tokens.shape[0] == self.bs
+        assert input_pos.shape[0] == self.bs
+        out = torch.zeros(self.bs, 8, dtype=torch.long)
+        n = self.bs // 2 if cfg_scale != 1.0 else self.bs
+        for row in range(self.bs):
+            req = row % n
+            eos = self.eos_at.get(req)
+            out[row] = EOS if eos is not None and self.steps >= eos else req + 1
+        self.steps += 1
+        return out
+
+
+class FakePipeline:
+    def __init__(self, eos_at=None):
+        self.config = FakeConfig()
+        self.mula = FakeMula(eos_at or {})
+        self.codec = object()
+
+    def preprocess(self, inputs, cfg_scale):
+        length = len(inputs["lyrics"])
+        rows = 2 if cfg_scale != 1.0 else 1
+        return {
+            "tokens": torch.ones(rows, length, 9, dtype=torch.long),
+            "tokens_mask": torch.ones(rows, length, 9, dtype=torch.bool),
+            "muq_embed": torch.zeros(rows, 4),
+            "muq_idx": [1] * rows,
+            "pos": torch.arange(length).unsqueeze(0).repeat(rows, 1),
+        }
+
+
+def test_batched_loop_per_request_length_eos_and_progress():
+    pipeline = FakePipeline(eos_at={1: 3})
+    progress = {0: [], 1: [], 2: []}
+    requests = [
+        FrameRequest({"lyrics": "abc"}, 400, progress_callback=lambda c, t: progress[0].append((c, t))),
+        FrameRequest({"lyrics": "def"}, 800, progress_callback=lambda c, t: progress[1].append((c, t))),
+        FrameRequest({"lyrics": "ghi"}, 160, progress_callback=lambda c, t: progress[2].append((c, t))),
+    ]
+    assert supports_batching(pipeline)
+    run_batched_frames(pipeline, requests, temperature=1.0, topk=50, cfg_scale=1.5)
+
+    # One cache setup for the whole batch, cond + uncond row per request
+    assert pipeline.mula.batch_sizes == [6]
+    assert [len(r.frames) for r in requests] == [5, 3, 2]
+    assert requests[0].frames_tensor().shape == (8, 5)
+    # Each request only ever sees its own row's tokens
+    assert all(torch.all(f == i + 1) for i, r in enumerate(requests) for f in r.frames)
+    assert progress[0][-1] == (5, 5)
+    assert progress[1][-1] == (3, 10)
+    assert progress[2] == [(1, 2), (2, 2)]
+
+
+def test_prompts_of_different_length_are_not_padded_together():
+    pipeline = FakePipeline()
+    requests = [
+        FrameRequest({"lyrics": "abc"}, 400),
+        FrameRequest({"lyrics": "abcdef"}, 400),
+        FrameRequest({"lyrics": "xyz"}, 400),
+    ]
+    groups = []
+    run_batched_frames(pipeline, requests, temperature=1.0, topk=50, cfg_scale=1.5,
+                       on_group_done=lambda group: groups.append([requests.index(r) for r in group]))
+
+    # Without an attention mask, padding would change what the shorter prompt samples
+    assert pipeline.mula.batch_sizes == [4, 2]
+    assert [len(r.frames) for r in requests] == [5, 5, 5]
+    # Each group is handed back as soon as its own loop ends
+    assert groups == [[0, 2], [1]]
+
+
+def test_collate_rejects_mixed_prompt_lengths():
+    pipeline = FakePipeline()
+    prompts = [pipeline.preprocess({"lyrics": "abc"}, 1.0), pipeline.preprocess({"lyrics": "abcd"}, 1.0)]
+    with pytest.raises(ValueError):
+        _collate(prompts, rows_per=1, device="cpu")
+
+
+def test_cancelling_one_request_keeps_the_others_running():
+    pipeline = FakePipeline()
+    token = CancellationToken()
+
+    def cancel_after_two(current, total):
+        if current == 2:
+            token.cancel()
+        token.raise_if_cancelled()
+
+    requests = [
+        FrameRequest({"lyrics": "ab"}, 400, progress_callback=cancel_after_two),
+        FrameRequest({"lyrics": "ab"}, 400),
+    ]
+    run_batched_frames(pipeline, requests, temperature=1.0, topk=50, cfg_scale=1.0)
+    assert pipeline.mula.batch_sizes == [2]
+    assert requests[0].error is not None
+    assert len(requests[1].frames) == 5
+    assert requests[1].error is None
+
+
+def test_pipeline_without_internals_is_not_batchable():
+    class Opaque:
+        def __call__(self, *args, **kwargs):
+            pass
+
+    assert not supports_batching(Opaque())
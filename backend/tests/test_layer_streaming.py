@@ -0,0 +1,82 @@
+import torch
+import torch.nn as nn
+
+from app.engine.layer_streaming import LayerStreamingExecutor, SimulatedDevicePool, find_layers
+
+
+class Backbone(nn.Module):
+    def __init__(self, n_layers, width=16):
+        super().__init__()
+        self.layers = nn.ModuleList(nn.Linear(width, width) for _ in range(n_layers))
+
+    def forward(self, x):
+        for layer in self.layers:
+            x = torch.tanh(layer(x))
+        return x
+
+
+class Model(nn.Module):
+    def __init__(self, n_layers=6):
+        super().__init__()
+        self.backbone = Backbone(n_layers)
+        self.head = nn.Linear(16, 4)
+
+    def forward(self, x):
+        return self.head(self.backbone(x))
+
+
+def layer_bytes(model):
+    return sum(p.numel() * p.element_size() for p in model.backbone.layers[0].parameters())
+
+
+def test_streamed_forward_matches_and_respects_window():
+    torch.manual_seed(0)
+    model = Model()
+    x = torch.randn(3, 16)
+    expected = model(x)
+
+    pool = SimulatedDevicePool()
+    executor = LayerStreamingExecutor(find_layers(model), pool, max_layers=3, vram_budget=10 ** 9).attach()
+    seen = []
+    model.backbone.layers[2].register_forward_hook(lambda *a: seen.append(len(executor.resident())))
+    for _ in range(2):
+        assert torch.allclose(model(x), expected)
+    executor.detach()
+
+    assert executor.window == 3
+    assert max(seen) <= 3
+    # Never more than the window on the "device" (current + in-flight prefetches)
+    assert pool.peak_bytes <= 3 * layer_bytes(model)
+    assert pool.resident_bytes == 0
+    stats = executor.stats()
+    assert stats["layer_calls"] == 12
+    assert stats["transfers"] >= 6
+
+
+def test_window_capped_by_vram_budget():
+    model = Model(n_layers=8)
+    budget = 2 * layer_bytes(model) + 10
+    executor = LayerStreamingExecutor(find_layers(model), SimulatedDevicePool(), max_layers=6,
+                                      vram_budget=budget).attach()
+    assert executor.window == 2
+    executor.detach()
+
+
+def test_prefetch_overlaps_compute():
+    model = Model(n_layers=4)
+    delay = 0.02
+
+    def slow_compute(module, args, output):
+        import time
+        time.sleep(delay)
+
+    for layer in model.backbone.layers:
+        layer.register_forward_hook(slow_compute)
+    pool = SimulatedDevicePool(transfer_delay=delay)
+    executor = LayerStreamingExecutor(find_layers(model), pool, max_layers=2, vram_budget=10 ** 9).attach()
+    for _ in range(3):
+        model(torch.randn(1, 16))
+    executor.detach()
+    stats = executor.stats()
+    # Uploads run behind compute, so compute waits far less than the copies take
+    assert stats["stall_seconds"] < stats["transfer_seconds"] * 0.6
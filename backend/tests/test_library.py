@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from app.utils.library import LibraryCatalog, classify
+
+TASK = "0f8fad5b-d9cb-469f-a165-70867728950e"
+OTHER = "7c9e6679-7425-40de-944b-e07fc1f90ae7"
+
+
+def write_wav(path, seconds=0.5, rate=8000):
+    sf.write(path, np.zeros((int(seconds * rate), 1)), rate)
+    return path
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    out = tmp_path / "songs"
+    out.mkdir()
+    cat = LibraryCatalog(str(tmp_path / "library.db"), str(out))
+    yield cat
+    cat.close()
+
+
+def request(title, genre, lyrics=""):
+    return {"title": title, "genre": genre, "bpm": 120,
+            "structure": [{"type": "verse", "bars": 4, "text": lyrics, "description": "warm pads"}]}
+
+
+def test_classify():
+    assert classify(f"{TASK}_raw.wav") == (TASK, "raw")
+    assert classify(f"{TASK}_My_Song_sr.wav") == (TASK, "intermediate")
+    assert classify(f"{TASK}_My_Song.wav") == (TASK, "song")
+    assert classify("imported.wav") == (None, "song")
+
+
+def test_record_list_sort_and_search(catalog):
+    out = catalog.output_dir
+    write_wav(os.path.join(out, f"{TASK}_raw.wav"))
+    catalog.record_song(write_wav(os.path.join(out, f"{TASK}_Night_Drive.wav"), 1.0), TASK,
+                        request("Night Drive", "synthwave", "neon lights on the highway"))
+    catalog.record_song(write_wav(os.path.join(out, f"{OTHER}_Café.wav"), 2.0), OTHER,
+                        request("Café", "jazz", "coffee and rain"))
+
+    total, songs = catalog.list(sort="duration", order="asc")
+    assert total == 2
+    assert [s["title"] for s in songs] == ["Night Drive", "Café"]
+    assert songs[0]["duration"] == 1.0 and songs[0]["bpm"] == 120
+    assert songs[0]["artifacts"]["raw"]["filename"] == f"{TASK}_raw.wav"
+
+    total, songs = catalog.list(limit=1, offset=1, sort="title", order="asc")
+    assert total == 2 and [s["title"] for s in songs] == ["Night Drive"]
+
+    assert [s["title"] for s in catalog.list(q="highw")[1]] == ["Night Drive"] # Lyrics, prefix match
+    assert [s["title"] for s in catalog.list(q="JAZZ")[1]] == ["Café"]
+    assert [s["title"] for s in catalog.list(q="cafe")[1]] == ["Café"] # Diacritics folded
+    assert catalog.list(q='"unbalanced AND (')[0] == 0
+    with pytest.raises(ValueError):
+        catalog.list(sort="filename; DROP TABLE songs")
+
+
+def test_cache_hit_is_dated_by_its_own_completion(catalog):
+    out = catalog.output_dir
+    original = write_wav(os.path.join(out, f"{TASK}_Night_Drive.wav"))
+    os.utime(original, (1600000000, 1600000000))
+    catalog.record_song(original, TASK, request("Night Drive", "synthwave"), created_at=1600000000.0)
+    # A later render cache hit: hard link to the same inode, so the same mtime
+    hit = os.path.join(out, f"{OTHER}_Night_Drive.wav")
+    os.link(original, hit)
+    catalog.record_song(hit, OTHER, request("Night Drive", "synthwave"), created_at=1700000000.0)
+
+    songs = catalog.list(sort="created_at", order="desc")[1]
+    assert [s["task_id"] for s in songs] == [OTHER, TASK]
+    assert songs[0]["created_at"] == 1700000000.0
+
+
+def test_like_fallback(catalog):
+    catalog.fts = False
+    catalog.record_song(write_wav(os.path.join(catalog.output_dir, "demo.wav")), None,
+                        request("Demo", "lofi", "late night study"))
+    assert catalog.list(q="study")[0] == 1
+    assert catalog.list(q="metal")[0] == 0
+
+
+def test_reconcile(catalog):
+    out = catalog.output_dir
+    song = write_wav(os.path.join(out, f"{TASK}_Night_Drive.wav"))
+    write_wav(os.path.join(out, f"{TASK}_raw.wav"))
+    write_wav(os.path.join(out, f"{TASK}_Night_Drive_sr.wav")) # In-flight enhancement
+    write_wav(os.path.join(out, "imported_track.wav"))
+    lookups = []
+
+    def lookup(task_id):
+        lookups.append(task_id)
+        return {"request": request("Night Drive", "synthwave"), "completed_at": 1700000000.0}
+
+    assert catalog.reconcile(lookup) == {"added": 2, "updated": 0, "removed": 0}
+    assert lookups == [TASK]
+    songs = {s["filename"]: s for s in catalog.list()[1]}
+    assert songs[f"{TASK}_Night_Drive.wav"]["genre"] == "synthwave"
+    # Dated by the task's completion, not the file's mtime
+    assert songs[f"{TASK}_Night_Drive.wav"]["created_at"] == 1700000000.0
+    assert songs["imported_track.wav"]["created_at"] == os.path.getmtime(os.path.join(out, "imported_track.wav"))
+    assert songs["imported_track.wav"]["title"] == "imported track"
+
+    assert catalog.reconcile(lookup) == {"added": 0, "updated": 0, "removed": 0}
+
+    os.remove(os.path.join(out, f"{TASK}_raw.wav"))
+    os.remove(os.path.join(out, "imported_track.wav"))
+    assert catalog.reconcile(lookup) == {"added": 0, "updated": 1, "removed": 1}
+    total, songs = catalog.list()
+    assert total == 1 and songs[0]["artifacts"] == {} and songs[0]["genre"] == "synthwave"
+    assert os.path.exists(song)
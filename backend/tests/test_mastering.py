@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+pytest.importorskip("pedalboard")
+from pedalboard.io import AudioFile
+
+from app.engine.studio_enhancer import StudioEnhancer
+
+
+def test_streamed_mastering_is_sample_identical_to_one_shot(tmp_path, monkeypatch):
+    sr = 48000
+    rng = np.random.RandomState(0)
+    audio = (rng.randn(sr * 3, 2) * 0.4).astype(np.float32)
+    src = tmp_path / "in.wav"
+    sf.write(src, audio, sr, subtype="FLOAT")
+
+    with AudioFile(str(src)) as f:
+        expected = StudioEnhancer.build_mastering_chain()(f.read(f.frames), sr).T
+
+    enhancer = StudioEnhancer()
+    enhancer._load_models()
+    monkeypatch.setattr(StudioEnhancer, "MASTERING_BLOCK_FRAMES", 10000) # Several odd-sized blocks
+    out = enhancer.master(str(src), str(tmp_path / "out.wav"))
+    result, out_sr = sf.read(out, dtype="float32")
+    assert out_sr == sr
+    assert np.array_equal(result, expected)
+
+    # Chain state doesn't leak into the next job
+    again, _ = sf.read(enhancer.master(str(src), str(tmp_path / "again.wav")), dtype="float32")
+    assert np.array_equal(again, expected)
+
+
+def test_enhance_reports_a_skipped_upscale(tmp_path, monkeypatch):
+    from app.engine import studio_enhancer
+
+    src = tmp_path / "in.wav"
+    sf.write(src, np.zeros((4800, 2), dtype=np.float32), 48000, subtype="FLOAT")
+    enhancer = StudioEnhancer()
+    enhancer._load_models()
+    monkeypatch.setattr(studio_enhancer, "HAS_AUDIOSR", True)
+    monkeypatch.setattr(enhancer, "_load_models", lambda: None)
+    monkeypatch.setattr(enhancer, "audiosr_model", object())
+
+    def broken_upscale(input_path, output_path, cancel_token=None):
+        raise RuntimeError("out of memory")
+    monkeypatch.setattr(enhancer, "upscale", broken_upscale)
+
+    out, ran = enhancer.enhance(str(src), str(tmp_path / "out.wav"))
+    assert out == str(tmp_path / "out.wav")
+    assert enhancer.settings_fingerprint()["audiosr"] is not None
+    assert ran["audiosr"] is None
+    assert ran["mastering"] == enhancer.settings_fingerprint()["mastering"]
@@ -0,0 +1,48 @@
+import pytest
+
+from app.utils.metrics import MetricsRegistry
+
+
+def test_counter_and_gauge_render():
+    registry = MetricsRegistry()
+    errors = registry.counter("errors_total", "Errors.", ["stage"])
+    depth = registry.gauge("queue_depth", "Depth.", ["stage"])
+    errors.inc(stage="generation")
+    errors.inc(2, stage="enhancement")
+    depth.set_function(lambda: {("generation",): 3})
+    text = registry.render()
+    assert "# TYPE errors_total counter" in text
+    assert 'errors_total{stage="enhancement"} 2' in text
+    assert 'errors_total{stage="generation"} 1' in text
+    assert 'queue_depth{stage="generation"} 3' in text
+    assert errors.value(stage="enhancement") == 2
+    with pytest.raises(ValueError):
+        errors.inc(wrong="x")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("decode_seconds", "Decode.", buckets=(1, 5))
+    for value in (0.5, 1.0, 3, 10):
+        seconds.observe(value)
+    lines = registry.render().splitlines()
+    assert 'decode_seconds_bucket{le="1.0"} 2' in lines # le is inclusive
+    assert 'decode_seconds_bucket{le="5.0"} 3' in lines
+    assert 'decode_seconds_bucket{le="+Inf"} 4' in lines
+    assert "decode_seconds_sum 14.5" in lines
+    assert "decode_seconds_count 4" in lines
+
+    with seconds.time():
+        pass
+    assert seconds.count() == 5
+
+
+def test_label_values_are_escaped_and_failures_isolated():
+    registry = MetricsRegistry()
+    registry.counter("loads_total", "Loads.", ["model"]).inc(model='a "b"\\c')
+    registry.gauge("broken", "Broken.").set_function(lambda: 1 / 0)
+    text = registry.render()
+    assert 'loads_total{model="a \\"b\\"\\\\c"} 1' in text
+    assert "# broken unavailable" in text
+    with pytest.raises(ValueError):
+        registry.counter("loads_total", "Again.")
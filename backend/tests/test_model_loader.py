@@ -0,0 +1,66 @@
+import os
+import threading
+
+from app.config import settings
+from app.engine import model_loader
+
+REPO_FILES = {
+    "HeartMuLa/HeartMuLaGen": {"gen_config.json": b"{}", "tokenizer.json": b'{"t": 1}'},
+    "HeartMuLa/HeartMuLa-oss-3B": {"config.json": b"{}", "model.safetensors": b"weights" * 100},
+    "HeartMuLa/HeartCodec-oss": {"model.safetensors": b"codec" * 100},
+}
+
+
+class FakeHub:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def snapshot_download(self, repo_id, local_dir, allow_patterns=None, **kwargs):
+        with self.lock:
+            self.calls.append(("snapshot", repo_id))
+        os.makedirs(local_dir, exist_ok=True)
+        for name, data in REPO_FILES[repo_id].items():
+            with open(os.path.join(local_dir, name), "wb") as f:
+                f.write(data)
+
+    def hf_hub_download(self, repo_id, filename, local_dir, **kwargs):
+        with self.lock:
+            self.calls.append(("file", repo_id, filename))
+        with open(os.path.join(local_dir, filename), "wb") as f:
+            f.write(REPO_FILES[repo_id][filename])
+
+
+def test_manifest_makes_startup_offline_and_repairs_only_bad_files(tmp_path, monkeypatch):
+    hub = FakeHub()
+    monkeypatch.setattr(settings, "MODELS_DIR", tmp_path)
+    monkeypatch.setattr(model_loader, "snapshot_download", hub.snapshot_download)
+    monkeypatch.setattr(model_loader, "hf_hub_download", hub.hf_hub_download)
+
+    model_loader.ensure_models_available()
+    assert sorted(c[1] for c in hub.calls) == sorted(REPO_FILES)
+    manifest = model_loader.load_manifest(tmp_path)
+    assert set(manifest["repos"]["HeartMuLa/HeartMuLa-oss-3B"]["files"]) == {"config.json", "model.safetensors"}
+    # Sub-directories of other repos are not part of the base repo
+    assert set(manifest["repos"]["HeartMuLa/HeartMuLaGen"]["files"]) == {"gen_config.json", "tokenizer.json"}
+
+    # Second start: no network at all
+    hub.calls.clear()
+    model_loader.ensure_models_available()
+    assert hub.calls == []
+
+    # Touched but intact file is accepted after a full hash check
+    weights = tmp_path / "HeartMuLa-oss-3B" / "model.safetensors"
+    os.utime(weights, ns=(1, 1))
+    model_loader.ensure_models_available()
+    assert hub.calls == []
+
+    # Same-size corruption and a missing file: only those are fetched
+    weights.write_bytes(b"X" * len(REPO_FILES["HeartMuLa/HeartMuLa-oss-3B"]["model.safetensors"]))
+    (tmp_path / "tokenizer.json").unlink()
+    model_loader.ensure_models_available()
+    assert sorted(hub.calls) == [
+        ("file", "HeartMuLa/HeartMuLa-oss-3B", "model.safetensors"),
+        ("file", "HeartMuLa/HeartMuLaGen", "tokenizer.json"),
+    ]
+    assert weights.read_bytes() == REPO_FILES["HeartMuLa/HeartMuLa-oss-3B"]["model.safetensors"]
@@ -0,0 +1,81 @@
+import struct
+import threading
+import time
+
+import numpy as np
+import torch
+
+from app.engine.preview import PreviewBuffer, PreviewDecoder, PreviewRegistry, wav_stream_header
+
+SPF = 40 # samples per frame in the fake codec
+
+
+def fake_decode(frames):
+    """Stereo, each frame -> SPF samples of its first code / 100 (local, so chunking is exact)."""
+    values = frames[0].float() / 100.0
+    mono = values.repeat_interleave(SPF)
+    return torch.stack([mono, -mono])
+
+
+def pcm(buffer):
+    data = buffer.read(0, timeout=0)
+    return np.frombuffer(data, dtype="<i2").reshape(-1, 2)
+
+
+def test_incremental_decode_matches_full_decode():
+    buffer = PreviewBuffer("t")
+    decoder = PreviewDecoder(fake_decode, buffer, 1000, chunk_frames=10, overlap_frames=3)
+    frames = [torch.full((8,), i % 50, dtype=torch.long) for i in range(37)]
+    for i, frame in enumerate(frames[:12]):
+        decoder.on_frame(i, frame)
+    # First chunk arrives before generation is done
+    deadline = time.time() + 5
+    while buffer.size == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert buffer.size > 0 and not buffer.closed
+    for i, frame in enumerate(frames[12:], start=12):
+        decoder.on_frame(i, frame)
+    decoder.finish()
+    assert buffer.closed
+
+    full = fake_decode(torch.stack(frames).transpose(0, 1)).numpy().T
+    expected = (np.clip(full, -1, 1) * 32767).astype("<i2")
+    assert np.array_equal(pcm(buffer), expected)
+    assert buffer.sample_rate == 1000 and buffer.channels == 2
+
+
+def test_aborted_decoder_closes_buffer_without_flushing():
+    buffer = PreviewBuffer("t")
+    decoder = PreviewDecoder(fake_decode, buffer, 1000, chunk_frames=100, overlap_frames=10)
+    for i in range(5):
+        decoder.on_frame(i, torch.ones(8, dtype=torch.long))
+    decoder.finish(flush=False)
+    assert buffer.closed and buffer.size == 0
+
+
+def test_reader_waits_for_data():
+    buffer = PreviewBuffer("t")
+    got = []
+    reader = threading.Thread(target=lambda: got.append(buffer.read(0, timeout=5)))
+    reader.start()
+    buffer.append(np.zeros((4, 1), dtype=np.float32), 8000)
+    reader.join(5)
+    assert got == [b"\x00" * 8]
+
+
+def test_stream_header():
+    header = wav_stream_header(48000, 2)
+    assert header[:4] == b"RIFF" and header[8:12] == b"WAVE" and len(header) == 44
+    channels, rate, byte_rate = struct.unpack("<HII", header[22:32])
+    assert (channels, rate, byte_rate) == (2, 48000, 192000)
+
+
+def test_only_subscribed_jobs_get_a_buffer():
+    registry = PreviewRegistry()
+    subscribed = registry.subscribe("a")
+    assert registry.claim("a") is subscribed and not subscribed.closed
+
+    # Nobody subscribed: the job skips decoding, late subscribers get a closed buffer
+    assert registry.claim("b") is None
+    late = registry.subscribe("b")
+    assert late.closed and late.sample_rate is None
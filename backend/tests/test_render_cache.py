@@ -0,0 +1,31 @@
+from app.engine.render_cache import RenderCache, cache_key
+
+
+def test_key_is_canonical():
+    assert cache_key({"a": 1, "b": [1, 2]}) == cache_key({"b": [1, 2], "a": 1})
+    assert cache_key({"a": 1}) != cache_key({"a": 2})
+
+
+def test_lru_eviction_by_count_and_quota(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), max_entries=2, max_bytes=250)
+    for name in ("a", "b", "c"):
+        src = tmp_path / f"{name}.wav"
+        src.write_bytes(b"x" * 100)
+
+    cache.put("a", str(tmp_path / "a.wav"))
+    cache.put("b", str(tmp_path / "b.wav"))
+    assert cache.get("a") # a is now more recently used than b
+    cache.put("c", str(tmp_path / "c.wav"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_single_flight(tmp_path):
+    cache = RenderCache(str(tmp_path), max_entries=10, max_bytes=10 ** 6)
+    assert cache.join_inflight("k", "task-1") is None
+    assert cache.join_inflight("k", "task-2") == "task-1"
+    cache.finish_inflight("k", "task-2") # not the leader: ignored
+    assert cache.join_inflight("k", "task-3") == "task-1"
+    cache.finish_inflight("k", "task-1")
+    assert cache.join_inflight("k", "task-3") is None
@@ -0,0 +1,70 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from app.engine.renditions import RenditionCache, negotiate_format, transcode
+
+
+def make_wav(path, seconds=1.0, rate=48000):
+    t = np.arange(int(seconds * rate)) / rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+    sf.write(path, np.stack([tone, tone], axis=1), rate, subtype="FLOAT")
+    return path
+
+
+def test_negotiate_format():
+    assert negotiate_format(None, None) is None
+    assert negotiate_format("FLAC", "audio/mpeg") == "flac" # Query wins
+    assert negotiate_format("wav", None) is None
+    assert negotiate_format(None, "audio/mpeg;q=0.5, audio/ogg") == "opus"
+    assert negotiate_format(None, "audio/flac;q=0, */*") is None
+    assert negotiate_format(None, "text/html, audio/*") is None
+    with pytest.raises(ValueError):
+        negotiate_format("aiff", None)
+
+
+@pytest.mark.parametrize("fmt", ["flac", "opus", "mp3"])
+def test_transcode_keeps_length_and_rate(tmp_path, fmt):
+    src = make_wav(str(tmp_path / "song.wav"))
+    dest = str(tmp_path / f"song.{fmt}")
+    transcode(src, dest, fmt)
+    info = sf.info(dest)
+    assert info.samplerate == 48000 and info.channels == 2
+    assert abs(info.frames - 48000) < 4000 # Lossy codecs pad a little
+    assert os.path.getsize(dest) < os.path.getsize(src)
+
+
+def test_cache_single_flight_and_hit(tmp_path):
+    src = make_wav(str(tmp_path / "song.wav"))
+    cache = RenditionCache(str(tmp_path / "renditions"), max_bytes=1 << 30, workers=2)
+    first, second = cache.request(src, "flac"), cache.request(src, "flac")
+    assert first is second # One transcode shared by both requests
+    path = first.result(timeout=30)
+    assert cache.request(src, "flac").result() == path
+    assert cache.stats()["transcodes"] == 1 and cache.stats()["hits"] == 1
+
+    # A new render of the song gets a new rendition
+    time.sleep(0.01)
+    make_wav(src, seconds=0.5)
+    assert cache.request(src, "flac").result(timeout=30) != path
+
+    # Index is rebuilt from disk
+    again = RenditionCache(str(tmp_path / "renditions"), max_bytes=1 << 30, workers=1)
+    assert again.request(src, "flac").done()
+
+
+def test_cache_evicts_least_recently_served(tmp_path):
+    a = make_wav(str(tmp_path / "a.wav"))
+    b = make_wav(str(tmp_path / "b.wav"))
+    c = make_wav(str(tmp_path / "c.wav"))
+    cache = RenditionCache(str(tmp_path / "renditions"), max_bytes=1 << 30, workers=1)
+    path_a = cache.request(a, "flac").result(timeout=30)
+    path_b = cache.request(b, "flac").result(timeout=30)
+    cache.max_bytes = os.path.getsize(path_a) + os.path.getsize(path_b) + 1024
+    cache.request(a, "flac").result() # a is now the most recently served
+    path_c = cache.request(c, "flac").result(timeout=30)
+    assert os.path.exists(path_a) and os.path.exists(path_c)
+    assert not os.path.exists(path_b)
@@ -0,0 +1,156 @@
+import threading
+
+from app.engine.scheduler import JobScheduler, QueueFull
+import pytest
+
+
+def test_priority_order_and_single_worker_serialization():
+    scheduler = JobScheduler("test", workers=1, max_queue=10)
+    gate = threading.Event()
+    started = threading.Event()
+    order = []
+    active = []
+    overlap = []
+    done = threading.Event()
+
+    def job(name):
+        def run(token):
+            if name == "blocker":
+                started.set()
+                gate.wait(5)
+            active.append(name)
+            overlap.append(len(active))
+            order.append(name)
+            active.remove(name)
+            if name == "last":
+                done.set()
+        return run
+
+    scheduler.submit("blocker", job("blocker"))
+    # The worker must hold the blocker before the rest are queued behind it
+    assert started.wait(5)
+    scheduler.submit("low", job("last"), priority="low")
+    scheduler.submit("normal", job("normal"))
+    scheduler.submit("high", job("high"), priority="high")
+
+    assert [j.task_id for j in scheduler.queued()] == ["high", "normal", "low"]
+    assert scheduler.position("low") == 2
+
+    gate.set()
+    assert done.wait(5)
+    scheduler.stop(timeout=1)
+    assert order == ["blocker", "high", "normal", "last"]
+    assert max(overlap) == 1
+
+
+def test_bounded_queue_and_eta():
+    scheduler = JobScheduler("test", workers=1, max_queue=2)
+    scheduler._stopping = True # Keep jobs queued
+    scheduler.submit("a", lambda token: None, cost=10)
+    scheduler.submit("b", lambda token: None, cost=10)
+    with pytest.raises(QueueFull):
+        scheduler.submit("c", lambda token: None)
+
+    assert scheduler.eta("b") is None
+    scheduler._rate = 2.0 # 2 s per cost unit
+    assert scheduler.eta("a") == 0.0
+    assert scheduler.eta("b") == 20.0
+
+
+def test_cancel_queued_and_running_jobs():
+    scheduler = JobScheduler("test", workers=1, max_queue=10)
+    started = threading.Event()
+    finished = threading.Event()
+    ran = []
+
+    def long_job(token):
+        started.set()
+        try:
+            for _ in range(500):
+                token.raise_if_cancelled()
+                threading.Event().wait(0.01)
+        finally:
+            finished.set()
+
+    scheduler.submit("running", long_job)
+    scheduler.submit("queued", lambda token: ran.append("queued"))
+    assert started.wait(5)
+
+    assert scheduler.cancel("queued") == "queued"
+    assert scheduler.cancel("running") == "running"
+    assert finished.wait(5)
+    assert scheduler.cancel("unknown") is None
+    scheduler.stop(timeout=1)
+    assert ran == []
+
+
+def test_compatible_jobs_run_as_one_batch():
+    scheduler = JobScheduler("test", workers=1, max_queue=10, max_batch=3)
+    batches = []
+    done = threading.Event()
+
+    def runner(jobs):
+        batches.append([j.task_id for j in jobs])
+        if "d" in batches[-1] or "e" in batches[-1]:
+            done.set()
+
+    scheduler.set_batch_runner(runner)
+    scheduler._stopping = True # Queue everything before a worker starts
+    for task_id, key in [("a", "k1"), ("b", "k2"), ("c", "k1"), ("d", "k1"), ("e", "k1")]:
+        scheduler.submit(task_id, lambda token: None, batch_key=key)
+    scheduler._stopping = False
+    scheduler.start()
+    assert done.wait(5)
+    scheduler.stop(timeout=1)
+    # "b" (other key) runs on its own through its fn, not the batch runner
+    assert batches[0] == ["a", "c", "d"]
+    assert "b" not in sum(batches, [])
+
+
+def test_stage_thread_split():
+    from app.engine.scheduler import stage_thread_split
+    # Accelerator: generation keeps a couple of host threads, enhancement the rest
+    assert stage_thread_split(16, True, 1) == (2, 14)
+    assert stage_thread_split(16, True, 2) == (2, 7)
+    # CPU only: even split
+    assert stage_thread_split(8, False, 1) == (4, 4)
+    assert stage_thread_split(1, False, 1) == (1, 1)
+
+
+def test_two_stage_pipeline_overlaps_jobs():
+    import time
+    torch = pytest.importorskip("torch")
+    generate = JobScheduler("gen", workers=1, max_queue=10, threads=1)
+    enhance = JobScheduler("enh", workers=1, max_queue=10, threads=2)
+    stage_time = 0.1
+    done = threading.Event()
+    finished = []
+    threads_seen = {}
+
+    def enhance_job(task_id):
+        def run(token):
+            threads_seen["enh"] = torch.get_num_threads()
+            time.sleep(stage_time)
+            finished.append(task_id)
+            if len(finished) == 4:
+                done.set()
+        return run
+
+    def generate_job(task_id):
+        def run(token):
+            threads_seen["gen"] = torch.get_num_threads()
+            time.sleep(stage_time)
+            enhance.submit(task_id, enhance_job(task_id))
+        return run
+
+    started = time.time()
+    for i in range(4):
+        generate.submit(f"song{i}", generate_job(f"song{i}"))
+    assert done.wait(5)
+    elapsed = time.time() - started
+    generate.stop(timeout=1)
+    enhance.stop(timeout=1)
+    assert finished == ["song0", "song1", "song2", "song3"]
+    # Sequential would be 8 stage times; pipelined is ~5
+    assert elapsed < 7 * stage_time
+    assert threads_seen == {"gen": 1, "enh": 2}
@@ -0,0 +1,59 @@
+import os
+
+import torch
+from safetensors.torch import load_file, save_file
+
+from app.engine.snapshots import SnapshotBuilder, write_cast_safetensors
+
+
+def make_models(root):
+    (root / "HeartMuLa-oss-3B").mkdir(parents=True)
+    (root / "HeartCodec-oss").mkdir()
+    save_file({"w": torch.randn(4, 3), "ids": torch.arange(5), "b": torch.randn(2, dtype=torch.float64)},
+              str(root / "HeartMuLa-oss-3B" / "model.safetensors"), metadata={"format": "pt"})
+    save_file({"c": torch.randn(3)}, str(root / "HeartCodec-oss" / "model.safetensors"))
+    (root / "HeartMuLa-oss-3B" / "config.json").write_text("{}")
+    (root / "tokenizer.json").write_text("{}")
+
+
+def test_cast_writer_matches_reference_loader(tmp_path):
+    src = tmp_path / "src.safetensors"
+    tensors = {"a": torch.randn(3, 5), "scalar": torch.tensor(2.5), "mask": torch.tensor([True, False]),
+               "idx": torch.arange(7, dtype=torch.int32)}
+    save_file(tensors, str(src))
+    dst = tmp_path / "dst.safetensors"
+    write_cast_safetensors(src, dst, torch.bfloat16)
+    out = load_file(str(dst))
+    assert out["a"].dtype == torch.bfloat16
+    assert torch.equal(out["a"], tensors["a"].to(torch.bfloat16))
+    assert out["scalar"].shape == () and out["scalar"].dtype == torch.bfloat16
+    assert torch.equal(out["mask"], tensors["mask"])
+    assert out["idx"].dtype == torch.int32 and torch.equal(out["idx"], tensors["idx"])
+
+
+def test_snapshot_mirrors_layout_and_rebuilds_on_change(tmp_path):
+    models = tmp_path / "models"
+    make_models(models)
+    builder = SnapshotBuilder(models, tmp_path / "snaps")
+    dtypes = {"HeartMuLa-oss-3B": torch.float16, "HeartCodec-oss": torch.float32}
+
+    snap = builder.ensure("cpu-float16", dtypes)
+    weights = load_file(str(snap / "HeartMuLa-oss-3B" / "model.safetensors"))
+    assert weights["w"].dtype == torch.float16
+    assert weights["b"].dtype == torch.float16
+    assert weights["ids"].dtype == torch.int64
+    # Already the right dtype / not weights: linked, not rewritten
+    assert os.path.samefile(snap / "HeartCodec-oss" / "model.safetensors",
+                            models / "HeartCodec-oss" / "model.safetensors")
+    assert (snap / "tokenizer.json").exists()
+
+    built = (snap / "HeartMuLa-oss-3B" / "model.safetensors").stat().st_mtime_ns
+    assert builder.ensure("cpu-float16", dtypes) == snap
+    assert (snap / "HeartMuLa-oss-3B" / "model.safetensors").stat().st_mtime_ns == built
+
+    # Model updated -> stale snapshot is rebuilt
+    save_file({"w": torch.ones(4, 3)}, str(models / "HeartMuLa-oss-3B" / "model.safetensors"))
+    snap = builder.ensure("cpu-float16", dtypes)
+    weights = load_file(str(snap / "HeartMuLa-oss-3B" / "model.safetensors"))
+    assert torch.equal(weights["w"], torch.ones(4, 3, dtype=torch.float16))
+    assert not (tmp_path / "snaps" / "cpu-float16.tmp").exists()
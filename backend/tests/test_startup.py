@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use or by the startup warm-up, never by importing the API
+HEAVY_MODULES = ("torch", "torch_directml", "heartlib", "audiosr", "pedalboard", "librosa", "scipy.signal")
+# Generous for slow CI disks; importing torch alone blows well past it on most machines
+IMPORT_BUDGET_SECONDS = 2.5
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def test_api_import_stays_light(tmp_path):
+    # Fresh interpreter: the test session itself has torch loaded already
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, TASK_STORE_BACKEND="memory")
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    loaded = set(probe["modules"])
+    assert [m for m in HEAVY_MODULES if m in loaded] == []
+    assert probe["seconds"] < IMPORT_BUDGET_SECONDS, f"import app.main took {probe['seconds']:.2f}s"
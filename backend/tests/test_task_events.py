@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+from app.utils.task_events import TaskEventBus
+
+
+def test_progress_from_worker_thread_is_coalesced():
+    async def scenario():
+        bus = TaskEventBus(coalesce_window=0.05)
+        bus.attach(asyncio.get_running_loop())
+        sub = bus.subscribe(["a"])
+
+        def worker():
+            bus.publish("a", "stage", {"status": "generating"})
+            for i in range(100):
+                bus.publish("a", "progress", {"progress": i})
+            bus.publish("a", "log", {"lines": ["one"], "cursor": 1})
+            bus.publish("a", "log", {"lines": ["two"], "cursor": 2})
+            bus.publish("b", "progress", {"progress": 5})
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.2)
+
+        events = []
+        while not sub.queue.empty():
+            events.append(sub.queue.get_nowait())
+        return events
+
+    events = asyncio.run(scenario())
+    types = [e["type"] for e in events]
+    assert types == ["stage", "progress", "log"]
+    assert events[1]["data"]["progress"] == 99
+    assert events[2]["data"] == {"lines": ["one", "two"], "cursor": 2}
+
+
+def test_coalesced_partial_updates_are_merged():
+    async def scenario():
+        bus = TaskEventBus(coalesce_window=0.05)
+        bus.attach(asyncio.get_running_loop())
+        sub = bus.subscribe(["a"])
+        bus.publish("a", "progress", {"progress": 40, "message": "Generating"})
+        bus.publish("a", "progress", {"eta_seconds": 12})
+        await asyncio.sleep(0.2)
+        return [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+
+    events = asyncio.run(scenario())
+    assert len(events) == 1
+    assert events[0]["data"] == {"progress": 40, "message": "Generating", "eta_seconds": 12}
+
+
+def test_publish_without_subscribers_is_a_no_op():
+    bus = TaskEventBus()
+    bus.publish("a", "progress", {"progress": 1})
+    assert bus._pending.empty()
@@ -0,0 +1,35 @@
+from app.utils.task_logs import TaskLog, TaskLogRegistry
+
+
+def test_carriage_return_rewrites_current_line():
+    log = TaskLog("t", max_lines=10)
+    log.write("Loading\n")
+    log.write("\r 10%|#")
+    log.write("\r 50%|#####")
+    log.write("\r100%|##########\nDone")
+
+    result = log.read(cursor=0)
+    assert result["lines"] == ["Loading", "100%|##########"]
+    assert result["partial"] == "Done"
+    assert result["cursor"] == 2
+
+
+def test_cursor_returns_only_new_lines_and_buffer_is_bounded():
+    log = TaskLog("t", max_lines=3)
+    for i in range(5):
+        log.write(f"line {i}\n")
+
+    assert log.read(cursor=4)["lines"] == ["line 4"]
+    assert log.read(cursor=5)["lines"] == []
+
+    stale = log.read(cursor=0)
+    assert stale["truncated"]
+    assert stale["lines"] == ["line 2", "line 3", "line 4"]
+
+
+def test_finished_log_is_recovered_from_spill_file(tmp_path):
+    registry = TaskLogRegistry(str(tmp_path), max_lines=100, keep_finished=0)
+    registry.open("job").write("a\nb\nc")
+    registry.close("job")
+
+    assert registry.read("job", cursor=1)["lines"] == ["b", "c"]
@@ -0,0 +1,82 @@
+import pstats
+import threading
+import time
+
+from app.config import settings
+from app.utils import profiling
+from app.utils.task_spans import TaskSpanRegistry, add_span, span, task_spans
+
+
+def names(nodes):
+    return [(n["name"], names(n["children"])) for n in nodes]
+
+
+def test_nested_spans_across_stage_threads():
+    published = []
+    task_spans.sink = lambda task_id, spans: published.append((task_id, names(spans)))
+    try:
+        with task_spans.activate("t1"), span("generation"):
+            with span("load"):
+                pass
+            start = time.perf_counter()
+            add_span("token_generation", start, start + 0.5, frames=10)
+
+        def enhancement():
+            with task_spans.activate("t1"), span("enhancement"):
+                with span("mastering") as attrs:
+                    attrs["blocks"] = 3
+
+        thread = threading.Thread(target=enhancement)
+        thread.start()
+        thread.join()
+    finally:
+        task_spans.sink = None
+
+    spans = task_spans.get("t1")
+    assert names(spans) == [("generation", [("load", []), ("token_generation", [])]),
+                            ("enhancement", [("mastering", [])])]
+    generation, enhancement = spans
+    assert generation["children"][1]["duration"] == 0.5 and generation["children"][1]["attrs"] == {"frames": 10}
+    assert enhancement["children"][0]["attrs"] == {"blocks": 3}
+    assert enhancement["start"] >= generation["start"] + generation["duration"]
+    # Each top-level span publishes the whole tree so far
+    assert [len(tree) for _, tree in published] == [1, 2]
+
+
+def test_batch_activation_and_narrowing():
+    registry = TaskSpanRegistry()
+    with registry.activate("a", "b"), span("generation", batch=2):
+        with span("token_generation"):
+            pass
+        for task_id in ("a", "b"):
+            with registry.narrow(task_id), span("codec_decode", task=task_id):
+                pass
+    # Spans outside any activation are free no-ops
+    with span("ignored"):
+        pass
+
+    for task_id in ("a", "b"):
+        (generation,) = registry.get(task_id)
+        assert generation["attrs"] == {"batch": 2}
+        assert [c["name"] for c in generation["children"]] == ["token_generation", "codec_decode"]
+        assert generation["children"][1]["attrs"] == {"task": task_id}
+    assert registry.get("missing") is None
+
+
+def test_profile_capture_is_written_listed_and_never_fails_the_task(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    task_id = "0f8fad5b-d9cb-469f-a165-70867728950e"
+    with profiling.capture(task_id, "generation", "cprofile"):
+        sum(i * i for i in range(1000))
+    with profiling.capture(task_id, "enhancement", None):
+        pass
+
+    (capture,) = profiling.list_profiles(task_id)
+    assert capture["stage"] == "generation" and capture["mode"] == "cprofile" and capture["size"] > 0
+    pstats.Stats(str(tmp_path / capture["filename"])) # Loadable pstats dump
+
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path / "file.txt"))
+    (tmp_path / "file.txt").write_text("not a directory")
+    with profiling.capture(task_id, "generation", "cprofile"):
+        pass # makedirs fails -> logged, block still runs
+    assert profiling.list_profiles("other") == []
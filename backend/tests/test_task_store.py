@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.utils.task_logs import TaskLogRegistry
+from app.utils.task_store import SQLiteTaskStore, TaskStore
+
+
+def test_progress_writes_are_batched(tmp_path):
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"))
+    store.update("a", {"status": "queued", "progress": 0})
+    store.update("a", {"status": "generating", "progress": 40}, durable=False)
+
+    # Visible immediately from the cache, on disk only after a flush
+    assert store.get("a")["progress"] == 40
+    row = store._conn.execute("SELECT data FROM tasks WHERE task_id = 'a'").fetchone()
+    assert json.loads(row[0])["progress"] == 0
+
+    store.flush()
+    row = store._conn.execute("SELECT data FROM tasks WHERE task_id = 'a'").fetchone()
+    assert json.loads(row[0])["progress"] == 40
+
+
+def test_status_lookup_and_prune(tmp_path):
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"))
+    store.update("done", {"status": "completed"})
+    store.update("running", {"status": "generating"})
+
+    assert [t["task_id"] for t in store.list(status="completed")] == ["done"]
+
+    store._conn.execute("UPDATE tasks SET updated_at = 0 WHERE task_id = 'done'")
+    assert store.prune(ttl_seconds=60) == 1
+    assert store.get("done") is None
+    assert store.get("running")["status"] == "generating"
+
+
+def test_legacy_json_is_migrated(tmp_path):
+    legacy = tmp_path / "tasks.json"
+    legacy.write_text(json.dumps({
+        "old": {"status": "completed", "progress": 100},
+        "stuck": {"status": "generating", "progress": 30},
+    }))
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"))
+
+    assert store.import_legacy_json(str(legacy)) == 2
+    assert store.get("old")["progress"] == 100
+    assert store.get("stuck")["status"] == "failed"
+    assert not legacy.exists()
+
+
+def test_prune_deletes_spill_logs(tmp_path):
+    logs = TaskLogRegistry(str(tmp_path / "logs"), max_lines=10)
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"), task_logs=logs)
+    for task_id in ("old", "recent"):
+        logs.open(task_id).write("line\n")
+        logs.close(task_id)
+        store.update(task_id, {"status": "completed"})
+
+    store._conn.execute("UPDATE tasks SET updated_at = 0 WHERE task_id = 'old'")
+    assert store.prune(ttl_seconds=60) == 1
+    assert not (tmp_path / "logs" / "old.log").exists()
+    assert logs.get("old") is None
+    assert logs.read("recent")["lines"] == ["line"]
+
+
+def test_base_store_is_abstract():
+    with pytest.raises(TypeError):
+        TaskStore()
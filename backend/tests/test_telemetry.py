@@ -0,0 +1,46 @@
+import time
+
+from app.utils.telemetry import TelemetrySampler
+
+
+def test_sampler_fills_ring_buffer_in_background():
+    sampler = TelemetrySampler(interval=0.02, history=5)
+    sampler.set_stage_provider(lambda: {"stage": "generating", "queued": 2})
+    sampler.set_vram_provider(lambda: 12.5)
+    sampler.start()
+    try:
+        deadline = time.time() + 5
+        while len(sampler.samples) < 5 and time.time() < deadline:
+            time.sleep(0.02)
+        time.sleep(0.1)
+    finally:
+        sampler.stop()
+    assert len(sampler.samples) == 5 # Bounded
+    latest = sampler.latest()
+    assert latest["stage"] == "generating" and latest["queued"] == 2
+    assert latest["process_rss"] > 0 and len(latest["per_core"]) >= 1
+    assert latest["vram"] == 12.5 or latest["torch"] is not None
+    stamps = [s["timestamp"] for s in sampler.samples]
+    assert stamps == sorted(stamps)
+
+
+def test_reads_do_not_sample():
+    sampler = TelemetrySampler(interval=60, history=10)
+    calls = []
+    sampler.set_stage_provider(lambda: calls.append(1) or {"stage": "idle"})
+    sampler.record()
+    for _ in range(20):
+        sampler.latest()
+        sampler.history(60)
+    assert len(calls) == 1
+
+
+def test_history_window_and_provider_errors():
+    sampler = TelemetrySampler(interval=60, history=10)
+    sampler.set_stage_provider(lambda: 1 / 0)
+    sample = sampler.record()
+    assert sample["stage"].startswith("error")
+    sample["timestamp"] -= 120 # Pretend it is two minutes old
+    sampler.record()
+    assert len(sampler.history(60)) == 1
+    assert len(sampler.history(600)) == 2
@@ -0,0 +1,44 @@
+import asyncio
+import io
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+from starlette.datastructures import UploadFile
+
+from app.utils.uploads import UnsupportedAudio, UploadTooLarge, store_upload
+
+
+def wav_bytes(seconds=1.0, rate=44100, fmt="WAV"):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros((int(seconds * rate), 2)), rate, format=fmt)
+    return buffer.getvalue()
+
+
+def upload(data, name="take.wav"):
+    return UploadFile(file=io.BytesIO(data), filename=name)
+
+
+def test_stores_by_content_and_deduplicates(tmp_path):
+    data = wav_bytes()
+    first = asyncio.run(store_upload(upload(data, "take1.wav"), str(tmp_path), 10 << 20))
+    assert not first["deduplicated"]
+    assert os.path.basename(first["path"]) == f"{first['sha256']}.wav"
+    assert first["size"] == len(data)
+    assert first["duration"] == 1.0 and first["sample_rate"] == 44100 and first["format"] == "WAV"
+
+    second = asyncio.run(store_upload(upload(data, "renamed.wav"), str(tmp_path), 10 << 20))
+    assert second["deduplicated"] and second["path"] == first["path"]
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(first["path"])]
+
+    flac = asyncio.run(store_upload(upload(wav_bytes(fmt="FLAC"), "take.flac"), str(tmp_path), 10 << 20))
+    assert flac["path"].endswith(".flac") and flac["format"] == "FLAC"
+
+
+def test_rejects_oversized_and_non_audio(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(store_upload(upload(wav_bytes(seconds=5)), str(tmp_path), 100_000))
+    with pytest.raises(UnsupportedAudio):
+        asyncio.run(store_upload(upload(b"not audio" * 1000, "notes.txt"), str(tmp_path), 10 << 20))
+    assert os.listdir(tmp_path) == [] # Partial files are cleaned up
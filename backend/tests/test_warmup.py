@@ -0,0 +1,110 @@
+import shutil
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.engine import warmup
+from app.engine.scheduler import JobScheduler
+from app.routers import system
+from app.utils.readiness import Readiness
+
+
+class FakeHeartMuLa:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.loaded = False
+        self.threads = []
+
+    def load_pipeline(self):
+        self.loaded = True
+
+    def generate(self, prompt_dict, output_path, cancel_token=None):
+        self.threads.append(threading.current_thread().name)
+        if self.fail:
+            raise RuntimeError("no weights")
+        assert prompt_dict["duration_target"] == settings.WARMUP_SECONDS
+
+
+class FakeEnhancer:
+    def __init__(self):
+        self.threads = []
+
+    def enhance(self, input_path, output_path, enable_upscale=True, cancel_token=None):
+        self.threads.append(threading.current_thread().name)
+        shutil.copy(input_path, output_path)
+        return output_path, {}
+
+
+@pytest.fixture
+def stages():
+    generation, enhancement = JobScheduler("generation", 1, 4), JobScheduler("enhancement", 1, 4)
+    yield generation, enhancement
+    generation.stop(timeout=1)
+    enhancement.stop(timeout=1)
+
+
+def test_warm_up_runs_each_stage_on_its_workers(stages, monkeypatch):
+    monkeypatch.setattr(settings, "WARMUP_SECONDS", 1)
+    registry = Readiness()
+    heartmula, enhancer = FakeHeartMuLa(), FakeEnhancer()
+
+    assert warmup.warm_up(heartmula, enhancer, *stages, registry=registry)
+
+    assert heartmula.loaded
+    assert heartmula.threads == ["generation-worker-0"] # Primes the worker's own thread pool
+    assert enhancer.threads == ["enhancement-worker-0"]
+    components = registry.snapshot()
+    assert components["generation"]["state"] == components["enhancement"]["state"] == "ready"
+    assert components["device"]["state"] == "pending" # Not warm-up's business
+    assert stages[0].completed == stages[1].completed == 1
+
+
+def test_failed_stage_is_reported_and_the_other_still_warms(stages, monkeypatch):
+    monkeypatch.setattr(settings, "WARMUP_SECONDS", 1)
+    registry = Readiness()
+
+    assert not warmup.warm_up(FakeHeartMuLa(fail=True), FakeEnhancer(), *stages, registry=registry)
+    components = registry.snapshot()
+    assert components["generation"]["state"] == "failed"
+    assert components["generation"]["error"] == "no weights"
+    assert components["enhancement"]["state"] == "ready"
+
+
+def test_timed_out_warm_up_is_cancelled_on_its_worker(stages):
+    generation = stages[0]
+    stopped = threading.Event()
+
+    def hung(token):
+        while not token.cancelled:
+            time.sleep(0.01)
+        stopped.set()
+        token.raise_if_cancelled()
+
+    with pytest.raises(TimeoutError):
+        warmup._run_on_stage(generation, "generation", hung, timeout=0.2)
+    # The running job saw the cancel and gave its worker back
+    assert stopped.wait(5)
+    done = threading.Event()
+    generation.submit("next", lambda token: done.set())
+    assert done.wait(5)
+
+
+def test_disabled_warm_up_and_ready_endpoint(stages, monkeypatch):
+    monkeypatch.setattr(settings, "WARMUP_ENABLED", False)
+    registry = Readiness()
+    heartmula = FakeHeartMuLa()
+    assert warmup.warm_up(heartmula, FakeEnhancer(), *stages, registry=registry)
+    assert not heartmula.loaded
+    assert registry.state("generation") == registry.state("enhancement") == "skipped"
+
+    monkeypatch.setattr(system, "readiness", registry)
+    api = FastAPI()
+    api.include_router(system.router, prefix="/api/v1")
+    api.state.status = "warming"
+    body = TestClient(api).get("/api/v1/ready").json()
+    assert body["status"] == "warming" and body["ready"] is False
+    assert body["components"]["generation"]["state"] == "skipped"
@@ -1,57 +1,19 @@
+"""
+Real-weights benchmark shortcut: one 10-second song through the full API.
 
-import time
-import torch
+The suite itself lives in backend/benchmarks (stand-in pipeline, scenarios,
+baselines); extra arguments are passed through, e.g.
+    python benchmark_heartmula.py --scenarios duration-10s,duration-30s
+"""
 import os
 import sys
 
-# Ensure backend path is in sys.path
-sys.path.append(os.path.join(os.getcwd(), 'backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
 
-from app.engine.heartmula import HeartMuLaService
-from app.utils.logger import get_logger
-
-# Setup logging
-log = get_logger("Benchmark")
-
-def benchmark():
-    log.info("Starting HeartMuLa Benchmark...")
-    
-    service = HeartMuLaService()
-    
-    # Measure Load Time
-    start_load = time.time()
-    service.load_pipeline()
-    end_load = time.time()
-    log.info(f"Pipeline Loaded in {end_load - start_load:.2f} seconds.")
-    
-    # Prompt
-    prompt = {
-        "genre": "Pop",
-        "title": "Benchmark Track",
-        "duration_target": 10, # 10 seconds
-        "structure": [
-            {"type": "Verse", "text": "Testing performance now"}
-        ]
-    }
-    
-    output_path = os.path.join(os.getcwd(), "benchmark_output.wav")
-    
-    # Measure Generation Time
-    log.info("Starting Generation...")
-    start_gen = time.time()
-    try:
-        service.generate(prompt, output_path)
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        log.error(f"Generation failed: {e}")
-        return
-
-    end_gen = time.time()
-    duration = end_gen - start_gen
-    
-    log.info(f"Generation Complete in {duration:.2f} seconds.")
-    log.info(f"Speed: {10 / duration:.2f} seconds of audio / second of compute (Approx)")
+from benchmarks.run import main
 
 if __name__ == "__main__":
-    benchmark()
+    args = sys.argv[1:]
+    if "--scenarios" not in args:
+        args = ["--scenarios", "duration-10s"] + args
+    sys.exit(main(["--mode", "real"] + args))